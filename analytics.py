@@ -0,0 +1,143 @@
+from models import Donation
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+import bisect
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the engine falls back to bisect over Python lists
+    np = None
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_microseconds(timestamp:datetime) -> int:
+    """Naive UTC datetime to integer microseconds since the epoch"""
+    return (timestamp - EPOCH) // MICROSECOND
+
+def from_microseconds(microseconds:int) -> datetime:
+    """Integer microseconds since the epoch back to a naive UTC datetime"""
+    return EPOCH + timedelta(microseconds=microseconds)
+
+class WindowAnalytics:
+    """
+    Read-only analytics engine over a snapshot of donations, built to answer many
+    window queries at once (e.g. "top charity for every hour of the last 90 days").
+    Donations are grouped per charity with sorted timestamps and cumulative sums of their
+    EUR amounts, so the total of a charity over any window is two binary searches and a
+    subtraction. With NumPy all the window ends of a charity are searched in one vectorized pass.
+    """
+    def __init__(self, donations_by_time:Sequence[Donation], use_numpy:bool = None):
+        """donations_by_time must be sorted by timestamp, as DonationService keeps them"""
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        if self.use_numpy and np is None:
+            raise ImportError("NumPy is not installed")
+
+        # charity ids follow the order in which charities first appear in time
+        self.charities : List[str] = []
+        self._donations_per_charity : List[List[Donation]] = []
+        ids : Dict[str, int] = {}
+        for donation in donations_by_time:
+            charity_id = ids.get(donation.charity)
+            if charity_id is None:
+                charity_id = ids[donation.charity] = len(self.charities)
+                self.charities.append(donation.charity)
+                self._donations_per_charity.append([])
+            self._donations_per_charity[charity_id].append(donation)
+
+        # per charity: sorted timestamps and cumulative sums with a leading 0
+        self._timestamps = []
+        self._cumulative_totals = []
+        for donations in self._donations_per_charity:
+            if self.use_numpy:
+                timestamps = np.fromiter((to_microseconds(d.timestamp) for d in donations), dtype=np.int64, count=len(donations))
+                cumulative = np.zeros(len(donations) + 1, dtype=np.float64)
+                np.cumsum(np.fromiter((d.amount_eur for d in donations), dtype=np.float64, count=len(donations)), out=cumulative[1:])
+            else:
+                timestamps = [to_microseconds(d.timestamp) for d in donations]
+                cumulative = [0.0]
+                for donation in donations:
+                    cumulative.append(cumulative[-1] + donation.amount_eur)
+            self._timestamps.append(timestamps)
+            self._cumulative_totals.append(cumulative)
+
+    def totals_per_window(self, ends:Sequence[datetime], window:timedelta = timedelta(days=1)):
+        """
+        Total donated to every charity in every window [end - window, end].
+        Returns a matrix indexed [charity id][end index], and the matching matrices of
+        first and past-the-last donation positions of each charity for each window.
+        With NumPy the three matrices are 2-D arrays.
+        """
+        ends_us = [to_microseconds(end) for end in ends]
+        window_us = window // MICROSECOND
+        if self.use_numpy:
+            return self._totals_per_window_numpy(ends_us, window_us)
+
+        totals = []
+        firsts = []
+        lasts = []
+        for timestamps, cumulative in zip(self._timestamps, self._cumulative_totals):
+            charity_totals = []
+            charity_firsts = []
+            charity_lasts = []
+            for end in ends_us:
+                lo = bisect.bisect_left(timestamps, end - window_us)
+                hi = bisect.bisect_right(timestamps, end)
+                charity_totals.append(cumulative[hi] - cumulative[lo])
+                charity_firsts.append(lo)
+                charity_lasts.append(hi)
+            totals.append(charity_totals)
+            firsts.append(charity_firsts)
+            lasts.append(charity_lasts)
+        return totals, firsts, lasts
+
+    def _totals_per_window_numpy(self, ends_us:List[int], window_us:int):
+        ends = np.array(ends_us, dtype=np.int64)
+        starts = ends - window_us
+        totals = np.zeros((len(self.charities), len(ends)), dtype=np.float64)
+        firsts = np.zeros((len(self.charities), len(ends)), dtype=np.int64)
+        lasts = np.zeros((len(self.charities), len(ends)), dtype=np.int64)
+        for charity_id, (timestamps, cumulative) in enumerate(zip(self._timestamps, self._cumulative_totals)):
+            firsts[charity_id] = np.searchsorted(timestamps, starts, side="left")
+            lasts[charity_id] = np.searchsorted(timestamps, ends, side="right")
+            totals[charity_id] = cumulative[lasts[charity_id]] - cumulative[firsts[charity_id]]
+        return totals, firsts, lasts
+
+    def highest_charity_per_window(self, ends:Sequence[datetime], window:timedelta = timedelta(days=1),
+                                   latest:int = 5) -> List[Tuple[str, float, List[Donation]]]:
+        """
+        For every end, the highest grossing charity over [end - window, end], its total
+        and its latest donations in that window, like get_highest_charity_over_24_hours.
+        Ties go to the charity whose first donation is the oldest.
+        """
+        if not self.charities or not ends:
+            return [(None, 0, []) for _ in ends]
+        totals, firsts, lasts = self.totals_per_window(ends, window)
+
+        if self.use_numpy:
+            # a charity with no donations in the window has a total of 0, but so can one
+            # with donations that sum to 0, so windows are told apart by their counts
+            counts = lasts - firsts
+            masked = np.where(counts > 0, totals, -np.inf)
+            winners = np.argmax(masked, axis=0).tolist()
+            has_donations = (counts.max(axis=0) > 0).tolist()
+        else:
+            winners = []
+            has_donations = []
+            for i in range(len(ends)):
+                best = None
+                for charity_id in range(len(self.charities)):
+                    if lasts[charity_id][i] > firsts[charity_id][i] and (best is None or totals[charity_id][i] > totals[best][i]):
+                        best = charity_id
+                winners.append(best if best is not None else 0)
+                has_donations.append(best is not None)
+
+        results = []
+        for i, charity_id in enumerate(winners):
+            if not has_donations[i]:
+                results.append((None, 0, []))
+                continue
+            lo, hi = int(firsts[charity_id][i]), int(lasts[charity_id][i])
+            latest_donations = self._donations_per_charity[charity_id][max(lo, hi - latest):hi]
+            results.append((self.charities[charity_id], float(totals[charity_id][i]), latest_donations))
+        return results
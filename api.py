@@ -1,12 +1,14 @@
 from donation_service import DonationService
+from metrics import timed
 from models import Donator, Charity
-from datetime import datetime
-from typing import Dict
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
 
 class Api:
     def __init__(self, donation_service:DonationService):
         self.donation_service = donation_service
 
+    @timed()
     def get_highest_grossing_charity_over_24_hours(self, end:datetime = None) -> Charity:
         """Get the highest grossing charity over the last 24 hours. Can pass in a custom date."""
         charity, total, donations = self.donation_service.get_highest_charity_over_24_hours(end)
@@ -16,18 +18,97 @@ class Api:
             "donations" : donations
         }
 
+    @timed()
+    def get_highest_grossing_charities_over_24_hours(self, ends:Sequence[datetime]) -> List[Dict]:
+        """Batch version of get_highest_grossing_charity_over_24_hours, one result per end. Uses NumPy when installed."""
+        return [
+            {
+                "charity" : charity,
+                "total" : total,
+                "donations" : donations
+            }
+            for charity, total, donations in self.donation_service.get_highest_charities_over_24_hours(ends)
+        ]
+
+    @timed()
     def get_most_generous_donator(self) -> Dict:
         """API endpoint to get the most generous donator."""
+        donator = self.donation_service.get_totals().most_generous_donator
+        if donator is None:
+            return {"donator_id": None, "total_eur": 0}
+        return {
+            "donator_id": donator.donator_id,
+            "total_eur": donator.total_eur
+        }
+
+    @timed()
+    def get_top_donators(self, k:int = 100) -> List[Dict]:
+        """API endpoint to get the k most generous donators, most generous first."""
+        return [
+            {
+                "donator_id": donator_id,
+                "total_eur": total_eur
+            }
+            # totals as ranked, the Donator objects keep changing while a writer runs
+            for donator_id, total_eur in self.donation_service.get_top_donator_totals(k)
+        ]
+
+    @timed()
+    def get_top_donators_over_window(self, window:timedelta = timedelta(days=1), k:int = 10) -> Dict:
+        """API endpoint to get the k most generous donators over a window ending at the latest donation, most generous first."""
+        end, top = self.donation_service.get_top_donators_over(window, k)
         return {
-            "donator_id": self.donation_service.most_generous_donator.donator_id,
-            "total_eur": self.donation_service.most_generous_donator.total_eur
+            "start": end - window if end is not None else None,
+            "end": end,
+            "top_donators": [
+                {
+                    "donator_id": donator_id,
+                    "total_eur": total_eur
+                }
+                for donator_id, total_eur in top
+            ]
         }
 
+    @timed()
+    def get_top_charities(self, k:int = 10) -> List[Dict]:
+        """API endpoint to get the k highest grossing charities over their lifetime, highest first."""
+        return [
+            {
+                "charity": name,
+                "total": total
+            }
+            for name, total in self.donation_service.get_top_charity_totals(k)
+        ]
+
+    @timed()
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> Dict:
+        """API endpoint to get the total of every charity with donations between start and end (inclusive), and their sum"""
+        totals = self.donation_service.get_charity_totals_between(start, end)
+        return {
+            "start": start,
+            "end": end,
+            "total_donations": sum(totals.values()),
+            "total_per_charity": totals
+        }
+
+    @timed()
+    def get_charity_totals_over_24_hours(self, end:datetime = None) -> Dict:
+        """API endpoint to get the charity totals over the last 24 hours. Can pass in a custom date."""
+        end = end if end is not None else datetime.now()
+        return self.get_charity_totals_between(end - timedelta(days=1), end)
+
+    @timed()
+    def get_charity_totals_over_7_days(self, end:datetime = None) -> Dict:
+        """API endpoint to get the charity totals over the last 7 days. Can pass in a custom date."""
+        end = end if end is not None else datetime.now()
+        return self.get_charity_totals_between(end - timedelta(days=7), end)
+
+    @timed()
     def get_running_totals_for_all_charities(self) -> Dict:
         """API endpoint to get the running total for all charities and the global total"""
+        # one published copy, so the global total always matches the per charity totals
+        totals = self.donation_service.get_totals()
         return {
-            "total_donations": self.donation_service.total_donations,
-            "total_per_charity": {
-                charity : self.donation_service.charities[charity].total_donations for charity in self.donation_service.charities
-            }
+            "total_donations": totals.total_donations,
+            "total_per_charity": dict(totals.charity_totals)
         }
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Compare ingesting donations one by one through add_donation with the add_donations batch API.
+Run from the repository root: python -m benchmarks.bench_add_donations --rows 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+
+def make_exchange_rate_service(start:datetime, days:int) -> ExchangeRateService:
+    service = ExchangeRateService()
+    for day in range(days):
+        date = start + timedelta(days=day)
+        service.add_exchange_rate(ExchangeRate("GBP", "USD", 1.22, 0.5, date))
+        service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, date))
+    return service
+
+def make_donations(rows:int, start:datetime, days:int, seed:int = 42):
+    rng = random.Random(seed)
+    symbols = ["$", "£", "€"]
+    for _ in range(rows):
+        amount = f"{rng.choice(symbols)}{rng.randint(1, 500)}"
+        timestamp = start + timedelta(minutes=rng.randrange(days * 24 * 60))
+        yield Donation(f"User{rng.randrange(10000)}", amount, f"Charity{rng.randrange(100)}", timestamp)
+
+def run(rows:int, batch_size:int):
+    start = datetime(2023, 1, 1)
+    days = 30
+    # the donations are built up front so only ingestion is measured
+    donations = list(make_donations(rows, start, days))
+
+    service = DonationService(make_exchange_rate_service(start, days))
+    began = time.perf_counter()
+    for donation in donations:
+        donation.amount_eur = None if donation.currency != "EUR" else donation.amount
+        service.add_donation(donation)
+    one_by_one = time.perf_counter() - began
+
+    service = DonationService(make_exchange_rate_service(start, days))
+    began = time.perf_counter()
+    for i in range(0, rows, batch_size):
+        batch = donations[i:i + batch_size]
+        for donation in batch:
+            donation.amount_eur = None if donation.currency != "EUR" else donation.amount
+        service.add_donations(batch)
+    batched = time.perf_counter() - began
+
+    print(f"add_donation  : {one_by_one:.2f}s ({rows / one_by_one:,.0f} donations/s)")
+    print(f"add_donations : {batched:.2f}s ({rows / batched:,.0f} donations/s), batches of {batch_size}")
+    print(f"speedup       : {one_by_one / batched:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+    run(args.rows, args.batch_size)
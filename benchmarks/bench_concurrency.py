@@ -0,0 +1,95 @@
+"""
+Stress test of concurrent reads and writes: reader threads run Api queries while a writer
+ingests, and their latency is compared with the same readers on an idle service.
+Every read also checks that the global total matches the per charity totals.
+Run from the repository root: python -m benchmarks.bench_concurrency --readers 4 --seconds 5
+"""
+import argparse
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from models import Donation
+from donation_service import DonationService
+from api import Api
+from benchmarks.bench_add_donations import make_exchange_rate_service
+
+START = datetime(2023, 1, 1)
+DAYS = 30
+
+def make_batches(batch_size:int):
+    """Endless batches of in-order donations, one every 30 seconds like a live stream"""
+    count = 0
+    while True:
+        batch = []
+        for i in range(batch_size):
+            timestamp = START + timedelta(seconds=30 * count)
+            batch.append(Donation(f"User{count % 10000}", f"€{1 + count % 50}", f"Charity{count % 100}", timestamp))
+            count += 1
+        yield batch
+
+def read_loop(api:Api, stop:threading.Event, latencies:list, errors:list):
+    queries = [
+        lambda: api.get_running_totals_for_all_charities(),
+        lambda: api.get_top_donators(100),
+        lambda: api.get_top_charities(10),
+        lambda: api.get_highest_grossing_charity_over_24_hours(START + timedelta(days=1)),
+    ]
+    i = 0
+    while not stop.is_set():
+        began = time.perf_counter()
+        result = queries[i % len(queries)]()
+        latencies.append(time.perf_counter() - began)
+        if i % len(queries) == 0 and abs(result["total_donations"] - sum(result["total_per_charity"].values())) > 1e-6 * max(1, result["total_donations"]):
+            errors.append(result["total_donations"])
+        i += 1
+
+def measure(service:DonationService, readers:int, seconds:float, batches=None):
+    """Reader latencies over seconds, with the writer adding the next of batches in a loop unless batches is None"""
+    api = Api(service)
+    stop = threading.Event()
+    latencies = [[] for _ in range(readers)]
+    errors = []
+    threads = [threading.Thread(target=read_loop, args=(api, stop, latencies[i], errors)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    written = 0
+    began = time.perf_counter()
+    while time.perf_counter() - began < seconds:
+        if batches is not None:
+            written += service.add_donations(next(batches))
+        else:
+            time.sleep(0.01)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    merged = sorted(latency for reader in latencies for latency in reader)
+    return {
+        "reads": len(merged),
+        "p50_ms": merged[len(merged) // 2] * 1000 if merged else 0,
+        "p99_ms": merged[int(len(merged) * 0.99)] * 1000 if merged else 0,
+        "mean_ms": statistics.fmean(merged) * 1000 if merged else 0,
+        "writes_per_second": written / seconds,
+        "torn_reads": len(errors),
+    }
+
+def run(readers:int, seconds:float, batch_size:int, preload:int):
+    service = DonationService(make_exchange_rate_service(START, DAYS))
+    batches = make_batches(batch_size)
+    while len(service.donations) < preload:
+        service.add_donations(next(batches))
+
+    # the writer carries on from the preloaded donations, so its batches arrive in order
+    for name, writer_batches in (("idle writer", None), ("busy writer", batches)):
+        result = measure(service, readers, seconds, writer_batches)
+        print(f"{name:12}: {result['reads']:,} reads, p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+              f"{result['writes_per_second']:,.0f} donations/s written, {result['torn_reads']} torn reads")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--preload", type=int, default=100_000)
+    args = parser.parse_args()
+    run(args.readers, args.seconds, args.batch_size, args.preload)
@@ -0,0 +1,57 @@
+"""
+Compare loading a donations CSV with stream_donations and with load_donations_parallel
+for a growing number of worker processes. Throughput only scales with the cores available.
+Run from the repository root: python -m benchmarks.bench_parallel_load --rows 500000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from donation_service import DonationService
+from main import DataLoader
+from benchmarks.bench_add_donations import make_exchange_rate_service
+
+START = datetime(2023, 1, 1)
+DAYS = 30
+
+def write_csv(path:str, rows:int, seed:int = 42):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write("donator,amount,charity,timestamp\n")
+        for i in range(rows):
+            # mostly in time order, like an export of a live stream
+            timestamp = START + timedelta(seconds=i * DAYS * 86400 // rows)
+            f.write(f"User{rng.randrange(10000)},{rng.choice('$£€')}{rng.randint(1, 500)},Charity{rng.randrange(100)},"
+                    f"{timestamp.day} {timestamp.strftime('%b %Y %H:%M')} {rng.choice(['EST', 'CET', 'GMT'])}\n")
+
+def run(rows:int, max_workers:int):
+    exchange_rate_service = make_exchange_rate_service(START - timedelta(days=1), DAYS + 2)
+    exchange_rate_service.precompute_paths("EUR")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "donations.csv")
+        write_csv(path, rows)
+
+        service = DonationService(exchange_rate_service)
+        began = time.perf_counter()
+        DataLoader.stream_donations(path, service)
+        sequential = time.perf_counter() - began
+        print(f"stream_donations     : {sequential:.2f}s ({rows / sequential:,.0f} rows/s)")
+
+        workers = 1
+        while workers <= max_workers:
+            parallel_service = DonationService(exchange_rate_service)
+            began = time.perf_counter()
+            DataLoader.load_donations_parallel(path, parallel_service, workers)
+            elapsed = time.perf_counter() - began
+            assert abs(parallel_service.total_donations - service.total_donations) < 1e-6 * service.total_donations
+            print(f"{workers:>2} worker(s)         : {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), speedup {sequential / elapsed:.1f}x")
+            workers *= 2
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    run(args.rows, args.max_workers)
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of timestamp and amount parsing against the previous regex + strptime implementation.
+Run from the repository root: python -m benchmarks.bench_parsing --rows 200000
+"""
+import argparse
+import random
+import re
+import timeit
+from datetime import datetime, timedelta
+from models import Donation
+from main import DataLoader
+
+def legacy_parse_timestamp(timestamp_str:str) -> datetime:
+    """parse_timestamp before the fast path, without its print"""
+    timezone_pattern = r'(EST|GMT|CET)$'
+    timezone_match = re.search(timezone_pattern, timestamp_str)
+    timezone = timezone_match.group(1) if timezone_match else None
+    timestamp_clean = re.sub(timezone_pattern, '', timestamp_str).strip()
+    timestamp = datetime.strptime(timestamp_clean, "%d %b %Y %H:%M")
+    utc_offset_hours = {"EST": -5, "CET": 1, "GMT": 0}.get(timezone, 0)
+    return timestamp + timedelta(hours=-utc_offset_hours)
+
+def legacy_parse_amount(amount:str):
+    """Donation amount parsing before the patterns were precompiled"""
+    match = re.match(r'^([£$€])(\d+(\.\d+)?)$', amount)
+    if match:
+        currency_map = {'$': 'USD', '£': 'GBP', '€': 'EUR'}
+        return currency_map.get(match.group(1), 'USD'), float(match.group(2))
+    num_match = re.search(r'(\d+(\.\d+)?)', amount)
+    return 'USD', float(num_match.group(1))
+
+def make_rows(rows:int, seed:int = 42):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    timestamps = []
+    amounts = []
+    for _ in range(rows):
+        timestamp = start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+        timestamps.append(f"{timestamp.day} {timestamp.strftime('%b %Y %H:%M')} {rng.choice(['EST', 'CET', 'GMT'])}")
+        amounts.append(f"{rng.choice('$£€')}{rng.randint(1, 500)}")
+    return timestamps, amounts
+
+def report(name:str, legacy:float, current:float, rows:int):
+    print(f"{name:<16} legacy {rows / legacy:>12,.0f} rows/s   current {rows / current:>12,.0f} rows/s   speedup {legacy / current:.1f}x")
+
+def run(rows:int):
+    timestamps, amounts = make_rows(rows)
+    assert all(DataLoader._parse_fixed_layout_timestamp(t) == legacy_parse_timestamp(t) for t in timestamps[:1000])
+
+    legacy = timeit.timeit(lambda: [legacy_parse_timestamp(t) for t in timestamps], number=1)
+    current = timeit.timeit(lambda: [DataLoader._parse_fixed_layout_timestamp(t) for t in timestamps], number=1)
+    report("timestamps", legacy, current, rows)
+
+    legacy = timeit.timeit(lambda: [legacy_parse_amount(a) for a in amounts], number=1)
+    current = timeit.timeit(lambda: [Donation("User", a, "Charity", None) for a in amounts], number=1)
+    report("amounts", legacy, current, rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    run(args.rows)
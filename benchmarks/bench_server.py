@@ -0,0 +1,168 @@
+"""
+Load test of the HTTP server. A server process preloaded with synthetic donations is started
+on a free local port, or --url points at one already running, and client threads send a mix
+of GET queries, and POST batches with --post-share, over keep-alive connections.
+Reports requests/s and p50/p99/p99.9/max latency per endpoint.
+Run from the repository root: python -m benchmarks.bench_server --connections 8 --seconds 10
+Compare with --no-keep-alive, which opens a connection per request.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from api import Api
+from server import ApiServer
+from benchmarks.generators import make_exchange_rates, make_donations
+
+START = datetime(2023, 1, 1)
+
+def run_server(rows:int, days:int, urls:multiprocessing.Queue):
+    """Server process: preload the donations, report the URL and serve until terminated"""
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rates(make_exchange_rates(START, days + 1))
+    service = DonationService(exchange_rate_service)
+    donations = make_donations(rows, START, days)
+    for i in range(0, len(donations), 10_000):
+        service.add_donations(donations[i:i + 10_000])
+    with ApiServer(Api(service), ("127.0.0.1", 0)) as server:
+        urls.put(server.url)
+        server.serve_forever()
+
+def make_requests(seed:int, days:int, post_share:float, batch_size:int):
+    """Endless (endpoint, method, path, body) requests: the three GET endpoints, and POST batches of later donations"""
+    rng = random.Random(seed)
+    # a dashboard polling the last day hour by hour, so most window queries repeat
+    ends = [START + timedelta(days=days) - timedelta(hours=hour) for hour in range(24)]
+    count = 0
+    while True:
+        if rng.random() < post_share:
+            batch = []
+            for _ in range(batch_size):
+                timestamp = START + timedelta(days=days, seconds=count)
+                batch.append({"donator": f"User{rng.randrange(100_000)}", "amount": f"€{rng.randint(1, 100)}",
+                              "charity": f"Charity{rng.randrange(500)}", "timestamp": timestamp.isoformat()})
+                count += 1
+            yield "POST /donations", "POST", "/donations", json.dumps(batch).encode("utf-8")
+        else:
+            choice = rng.randrange(3)
+            if choice == 0:
+                yield "GET /charities/totals", "GET", "/charities/totals", None
+            elif choice == 1:
+                yield "GET /donators/most-generous", "GET", "/donators/most-generous", None
+            else:
+                yield "GET /charities/highest-24h", "GET", f"/charities/highest-24h?end={rng.choice(ends).isoformat()}", None
+
+def client_loop(host:str, port:int, requests, keep_alive:bool, deadline:float, latencies:Dict[str, List[float]], errors:List[str]):
+    connection = None
+    for endpoint, method, path, body in requests:
+        if time.perf_counter() >= deadline:
+            break
+        began = time.perf_counter()
+        if connection is None:
+            connection = http.client.HTTPConnection(host, port)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if not keep_alive:
+            headers["Connection"] = "close"
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(f"{endpoint}: {e!r}")
+            connection.close()
+            connection = None
+            continue
+        latencies.setdefault(endpoint, []).append(time.perf_counter() - began)
+        if response.status != 200:
+            errors.append(f"{endpoint}: HTTP {response.status}")
+        if not keep_alive:
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+
+def percentile(ordered:List[float], fraction:float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def load(url:str, connections:int, seconds:float, keep_alive:bool = True, days:int = 30,
+         post_share:float = 0.0, batch_size:int = 100, seed:int = 42) -> Tuple[Dict[str, Dict], List[str]]:
+    """Run the load for seconds, returning the stats per endpoint (and "total") and the errors"""
+    address = urlsplit(url)
+    deadline = time.perf_counter() + seconds
+    latencies = [{} for _ in range(connections)]
+    errors : List[str] = []
+    threads = [threading.Thread(target=client_loop, args=(address.hostname, address.port,
+                                                          make_requests(seed + i, days, post_share, batch_size),
+                                                          keep_alive, deadline, latencies[i], errors))
+               for i in range(connections)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    per_endpoint : Dict[str, List[float]] = {}
+    for client in latencies:
+        for endpoint, samples in client.items():
+            per_endpoint.setdefault(endpoint, []).extend(samples)
+    per_endpoint["total"] = [latency for samples in list(per_endpoint.values()) for latency in samples]
+    stats = {}
+    for endpoint, samples in sorted(per_endpoint.items()):
+        samples.sort()
+        stats[endpoint] = {
+            "requests": len(samples),
+            "requests_per_second": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 0.5) * 1000 if samples else 0.0,
+            "p99_ms": percentile(samples, 0.99) * 1000 if samples else 0.0,
+            "p999_ms": percentile(samples, 0.999) * 1000 if samples else 0.0,
+            "max_ms": samples[-1] * 1000 if samples else 0.0,
+        }
+    return stats, errors
+
+def run(args:argparse.Namespace) -> Dict[str, Dict]:
+    server = None
+    url = args.url
+    if url is None:
+        urls = multiprocessing.Queue()
+        server = multiprocessing.Process(target=run_server, args=(args.rows, args.days, urls), daemon=True)
+        server.start()
+        url = urls.get(timeout=600)
+    try:
+        stats, errors = load(url, args.connections, args.seconds, not args.no_keep_alive, args.days,
+                             args.post_share, args.batch_size, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+    print(f"{url}, {args.connections} connections, {'no ' if args.no_keep_alive else ''}keep-alive, {args.seconds}s")
+    for endpoint, result in stats.items():
+        print(f"{endpoint:30} {result['requests']:>9,} requests {result['requests_per_second']:>9,.0f} req/s  "
+              f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  p99.9 {result['p999_ms']:7.2f} ms  max {result['max_ms']:7.2f} ms")
+    if errors:
+        print(f"{len(errors)} errors, first: {errors[0]}")
+    return stats
+
+def parse_args(argv:Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load an already running server instead of starting one")
+    parser.add_argument("--rows", type=int, default=100_000, help="Donations preloaded into the started server")
+    parser.add_argument("--days", type=int, default=30, help="Days the preloaded donations span")
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--no-keep-alive", action="store_true", help="Open a new connection for every request")
+    parser.add_argument("--post-share", type=float, default=0.0, help="Share of the requests that POST a batch of donations")
+    parser.add_argument("--batch-size", type=int, default=100, help="Donations per POST")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,73 @@
+"""
+Compare a single DonationService with a ShardedDonationService: batch ingestion throughput,
+then the latency of the three scatter-gather queries.
+Run from the repository root: python -m benchmarks.bench_sharding --rows 500000 --shards 1 2 4
+Shards only pay off with as many free cores: on one core, they add the cost of sending
+every donation to another process.
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from sharding import ShardedDonationService
+from benchmarks.generators import make_exchange_rates, make_donations
+
+START = datetime(2023, 1, 1)
+
+def fresh(donations:List[Donation]) -> List[Donation]:
+    """Unconverted copies, so every run converts like a first load"""
+    return [Donation.from_record(d.donator, d.charity, d.timestamp, d.currency, d.amount, None) for d in donations]
+
+def measure(service, donations:List[Donation], batch_size:int, queries:int):
+    batches = [fresh(donations[i:i + batch_size]) for i in range(0, len(donations), batch_size)]
+    began = time.perf_counter()
+    for batch in batches:
+        service.add_donations(batch)
+    # the totals are gathered lazily, so the last gather is part of the ingestion
+    service.get_totals()
+    ingest = len(donations) / (time.perf_counter() - began)
+
+    end = max(donation.timestamp for donation in donations)
+    latencies = {"highest_24h": [], "totals": [], "most_generous": []}
+    for i in range(queries):
+        # one new donation per round, so the totals are gathered again every time
+        service.add_donation(fresh(donations[i:i + 1])[0])
+        for name, query in (("highest_24h", lambda: service.get_highest_charity_over_24_hours(end - timedelta(hours=i % 24))),
+                            ("totals", lambda: service.get_totals().charity_totals),
+                            ("most_generous", lambda: service.get_totals().most_generous_donator)):
+            began = time.perf_counter()
+            query()
+            latencies[name].append(time.perf_counter() - began)
+    return ingest, {name: statistics.median(samples) * 1000 for name, samples in latencies.items()}
+
+def run(rows:int, days:int, shard_counts:List[int], batch_size:int, queries:int):
+    rates = make_exchange_rates(START, days + 1)
+    donations = make_donations(rows, START, days)
+    print(f"{rows:,} donations, {os.cpu_count()} cores")
+    for shards in shard_counts:
+        exchange_rate_service = ExchangeRateService()
+        exchange_rate_service.add_exchange_rates(rates)
+        if shards == 1:
+            name, service = "single service", DonationService(exchange_rate_service)
+        else:
+            name, service = f"{shards} shards", ShardedDonationService(exchange_rate_service, shards)
+        ingest, latencies = measure(service, donations, batch_size, queries)
+        print(f"{name:15}: {ingest:>9,.0f} donations/s, median highest_24h {latencies['highest_24h']:.3f} ms, "
+              f"totals {latencies['totals']:.3f} ms, most_generous {latencies['most_generous']:.3f} ms")
+        if shards > 1:
+            service.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="Shard counts to compare, 1 is a single service")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    run(args.rows, args.days, args.shards, args.batch_size, args.queries)
@@ -0,0 +1,77 @@
+"""
+Seeded generators of synthetic exchange rates and donation streams, for the benchmarks.
+The same seed always gives the same data, so runs can be compared with each other.
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+from models import Donation, ExchangeRate
+from main import DataLoader
+
+TIMEZONES = ["EST", "CET", "GMT"]
+# share of donations per currency symbol
+CURRENCY_WEIGHTS = {"$": 0.45, "£": 0.2, "€": 0.35}
+
+def make_exchange_rates(start:datetime, days:int, seed:int = 42) -> List[ExchangeRate]:
+    """
+    Daily GBP->EUR and GBP->USD rates following a random walk, over any number of days
+    (e.g. several years). A direct USD->EUR rate is only published on two days out of
+    three, so the other days convert USD through GBP.
+    """
+    rng = random.Random(seed)
+    gbp_eur, gbp_usd = 1.15, 1.25
+    rates = []
+    for day in range(days):
+        date = start + timedelta(days=day)
+        gbp_eur = min(1.4, max(0.9, gbp_eur * (1 + rng.gauss(0, 0.004))))
+        gbp_usd = min(1.6, max(1.0, gbp_usd * (1 + rng.gauss(0, 0.005))))
+        rates.append(ExchangeRate("GBP", "EUR", round(gbp_eur, 4), 0.3, date))
+        rates.append(ExchangeRate("GBP", "USD", round(gbp_usd, 4), 0.5, date))
+        if rng.random() < 2 / 3:
+            rates.append(ExchangeRate("USD", "EUR", round(gbp_eur / gbp_usd, 4), 0.4, date))
+    return rates
+
+def zipf_cumulative_weights(count:int, exponent:float) -> List[float]:
+    """Cumulative weights of ranks 1..count under a Zipf law, for random.choices"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+def make_donation_rows(rows:int, start:datetime, days:int, seed:int = 42, charities:int = 500,
+                       donators:int = 100_000, skew:float = 1.1, late_share:float = 0.05,
+                       max_delay:timedelta = timedelta(hours=6)) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    (donator, amount, charity, timestamp) rows as they appear in a donations CSV.
+    Charity popularity follows a Zipf law with the given exponent, donators are uniform,
+    amounts are mostly small with a long tail, and timestamps are local times in a mix of
+    timezones. Rows mostly arrive in time order, but late_share of them arrive up to
+    max_delay late, like a stream fed by several sources.
+    """
+    rng = random.Random(seed)
+    charity_weights = zipf_cumulative_weights(charities, skew)
+    symbols = list(CURRENCY_WEIGHTS)
+    symbol_weights = list(itertools.accumulate(CURRENCY_WEIGHTS.values()))
+    step = days * 86400 / max(rows, 1)
+    for i in range(rows):
+        timestamp = start + timedelta(seconds=int(i * step))
+        if rng.random() < late_share:
+            timestamp -= timedelta(seconds=rng.randrange(int(max_delay.total_seconds())))
+        timezone = rng.choice(TIMEZONES)
+        # the CSV holds local time, which parse_timestamp turns back into UTC
+        local = timestamp + timedelta(hours={"EST": -5, "CET": 1, "GMT": 0}[timezone])
+        amount = min(100_000, int(rng.lognormvariate(3, 1.2)) + 1)
+        cents = f".{rng.randrange(100):02}" if rng.random() < 0.3 else ""
+        yield (f"User{rng.randrange(donators)}",
+               f"{rng.choices(symbols, cum_weights=symbol_weights)[0]}{amount}{cents}",
+               f"Charity{rng.choices(range(charities), cum_weights=charity_weights)[0]}",
+               f"{local.day} {local.strftime('%b %Y %H:%M')} {timezone}")
+
+def make_donations(rows:int, start:datetime, days:int, seed:int = 42, **kwargs) -> List[Donation]:
+    """Donations parsed from make_donation_rows, with UTC timestamps"""
+    return [Donation(donator, amount, charity, DataLoader.parse_timestamp(timestamp))
+            for donator, amount, charity, timestamp in make_donation_rows(rows, start, days, seed, **kwargs)]
+
+def write_donations_csv(path:str, rows:int, start:datetime, days:int, seed:int = 42, **kwargs):
+    with open(path, 'w') as f:
+        f.write("donator,amount,charity,timestamp\n")
+        for row in make_donation_rows(rows, start, days, seed, **kwargs):
+            f.write(",".join(row) + "\n")
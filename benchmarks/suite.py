@@ -0,0 +1,244 @@
+"""
+Benchmark suite of ingestion, conversion and every Api endpoint on synthetic data from
+benchmarks.generators. Each case reports throughput, p50/p99 latency per call and the
+peak memory it allocated (measured in a second, untimed run under tracemalloc).
+Results can be saved as a JSON baseline and compared with a later run:
+
+    python -m benchmarks.suite --rows 200000 --save baseline.json
+    python -m benchmarks.suite --rows 200000 --compare baseline.json
+
+Run from the repository root. With --compare, the exit status is 1 when a case regressed
+by more than --tolerance.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from api import Api
+from main import DataLoader
+from benchmarks.generators import make_exchange_rates, make_donations, write_donations_csv
+
+START = datetime(2021, 1, 1)
+# the arguments that shape the generated data, which must match for two runs to be comparable
+DATA_ARGUMENTS = ("rows", "days", "rate_years", "queries", "batch_size", "seed")
+
+class Case:
+    """
+    A benchmark case. setup() returns a fresh state, and operation(state, i) runs the i-th
+    call and returns the number of items it processed (donations, conversions or queries).
+    """
+    def __init__(self, name:str, calls:int, setup:Callable[[], object], operation:Callable[[object, int], int]):
+        self.name = name
+        self.calls = calls
+        self.setup = setup
+        self.operation = operation
+
+def percentile(sorted_values:List[float], fraction:float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] if sorted_values else 0.0
+
+def run_case(case:Case, memory:bool = True) -> Dict:
+    state = case.setup()
+    operation = case.operation
+    latencies = []
+    items = 0
+    began = time.perf_counter()
+    for i in range(case.calls):
+        call_began = time.perf_counter()
+        items += operation(state, i)
+        latencies.append(time.perf_counter() - call_began)
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    result = {
+        "calls": case.calls,
+        "items": items,
+        "seconds": elapsed,
+        "ops_per_second": items / elapsed if elapsed else 0.0,
+        "p50_us": percentile(latencies, 0.5) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "peak_memory_kb": None,
+    }
+    if memory:
+        state = case.setup()
+        tracemalloc.start()
+        try:
+            for i in range(case.calls):
+                operation(state, i)
+            result["peak_memory_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+def reset(donations:List[Donation]) -> List[Donation]:
+    """Forget the conversions of a previous run, so every run converts the same donations"""
+    for donation in donations:
+        donation.amount_eur = donation.amount if donation.currency == "EUR" else None
+    return donations
+
+def make_cases(rows:int, days:int, rate_years:int, queries:int, batch_size:int, seed:int, directory:str) -> List[Case]:
+    rate_days = rate_years * 365
+    rates = make_exchange_rates(START, rate_days, seed)
+    # donations cover the last days of the rate table
+    donations_start = START + timedelta(days=rate_days - days)
+    donations_end = donations_start + timedelta(days=days)
+    donations = make_donations(rows, donations_start, days, seed)
+    csv_path = os.path.join(directory, "donations.csv")
+    write_donations_csv(csv_path, rows, donations_start, days, seed)
+
+    def exchange_rate_service() -> ExchangeRateService:
+        service = ExchangeRateService()
+        service.add_exchange_rates(rates)
+        return service
+
+    loaded = DonationService(exchange_rate_service())
+    loaded.add_donations(reset(list(donations)))
+    api = Api(loaded)
+
+    def query_setup():
+        # each run starts with the same empty window cache
+        loaded.window_cache.clear()
+        return api
+
+    rng = random.Random(seed)
+    window = (donations_end - donations_start - timedelta(days=1)).total_seconds()
+    # query ends spread over the donations, and ends advancing by a second like a dashboard polling
+    random_ends = [donations_start + timedelta(days=1, seconds=rng.uniform(0, window)) for _ in range(queries)]
+    dashboard_ends = [donations_end - timedelta(hours=1) + timedelta(seconds=i) for i in range(queries)]
+    conversions = [(rng.uniform(1, 500), rng.choice(["USD", "GBP"]), START + timedelta(seconds=rng.uniform(0, rate_days * 86400)))
+                   for _ in range(queries * 10)]
+    batches = (rows + batch_size - 1) // batch_size
+
+    def add_donation(state, i):
+        state[0].add_donation(state[1][i])
+        return 1
+
+    def add_donations(state, i):
+        return state[0].add_donations(state[1][i * batch_size:(i + 1) * batch_size])
+
+    def parse_csv(state, i):
+        return sum(1 for _ in itertools.islice(state, batch_size))
+
+    def convert_to_eur(state, i):
+        for amount, currency, date in conversions[i * 10:(i + 1) * 10]:
+            state.convert_to_eur(amount, currency, date)
+        return 10
+
+    def query(call:Callable[[Api, int], object]) -> Callable[[Api, int], int]:
+        def operation(state, i):
+            call(state, i)
+            return 1
+        return operation
+
+    return [
+        Case("ingest.add_donation", rows, lambda: (DonationService(exchange_rate_service()), reset(donations)), add_donation),
+        Case("ingest.add_donations", batches, lambda: (DonationService(exchange_rate_service()), reset(donations)), add_donations),
+        Case("ingest.parse_csv", batches, lambda: DataLoader.iter_donations(csv_path), parse_csv),
+        Case("convert.convert_to_eur", queries, exchange_rate_service, convert_to_eur),
+        Case("api.highest_grossing_charity_over_24_hours", queries, query_setup,
+             query(lambda api, i: api.get_highest_grossing_charity_over_24_hours(random_ends[i]))),
+        Case("api.highest_grossing_charity_over_24_hours.dashboard", queries, query_setup,
+             query(lambda api, i: api.get_highest_grossing_charity_over_24_hours(dashboard_ends[i]))),
+        # one call answers 24 window ends, counted as 24 items
+        Case("api.highest_grossing_charities_over_24_hours", max(1, queries // 100), query_setup,
+             lambda api, i: len(api.get_highest_grossing_charities_over_24_hours(random_ends[i * 24:(i + 1) * 24]))),
+        Case("api.running_totals_for_all_charities", queries, query_setup,
+             query(lambda api, i: api.get_running_totals_for_all_charities())),
+        Case("api.most_generous_donator", queries, query_setup, query(lambda api, i: api.get_most_generous_donator())),
+        Case("api.top_donators", queries, query_setup, query(lambda api, i: api.get_top_donators(100))),
+        Case("api.top_charities", queries, query_setup, query(lambda api, i: api.get_top_charities(10))),
+        Case("api.top_donators_over_24_hours", queries, query_setup,
+             query(lambda api, i: api.get_top_donators_over_window(timedelta(days=1), 10))),
+        Case("api.top_donators_over_7_days", queries, query_setup,
+             query(lambda api, i: api.get_top_donators_over_window(timedelta(days=7), 10))),
+        Case("api.charity_totals_over_24_hours", queries, query_setup,
+             query(lambda api, i: api.get_charity_totals_over_24_hours(random_ends[i]))),
+        Case("api.charity_totals_over_7_days", queries, query_setup,
+             query(lambda api, i: api.get_charity_totals_over_7_days(random_ends[i]))),
+    ]
+
+def compare(baseline:Dict, results:Dict, tolerance:float) -> List[str]:
+    """Print each case against the baseline, and return the cases that regressed by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<55} new")
+            continue
+        speed = result["ops_per_second"] / before["ops_per_second"] if before["ops_per_second"] else 1.0
+        p99 = result["p99_us"] / before["p99_us"] if before["p99_us"] else 1.0
+        line = f"{name:<55} ops/s {speed - 1:+7.1%}  p99 {p99 - 1:+7.1%}"
+        regressed = speed < 1 - tolerance
+        if result["peak_memory_kb"] is not None and before.get("peak_memory_kb"):
+            memory = result["peak_memory_kb"] / before["peak_memory_kb"]
+            line += f"  peak memory {memory - 1:+7.1%}"
+            regressed = regressed or memory > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+            line += "  REGRESSION"
+        print(line)
+    return regressions
+
+def run(args:argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        cases = make_cases(args.rows, args.days, args.rate_years, args.queries, args.batch_size, args.seed, directory)
+        results = {}
+        for case in cases:
+            if args.only and not any(case.name.startswith(prefix) for prefix in args.only):
+                continue
+            result = results[case.name] = run_case(case, memory=not args.no_memory)
+            memory = f"{result['peak_memory_kb']:>10,.0f} KiB" if result["peak_memory_kb"] is not None else ""
+            print(f"{case.name:<55} {result['ops_per_second']:>12,.0f} ops/s  p50 {result['p50_us']:>9,.1f} us  "
+                  f"p99 {result['p99_us']:>9,.1f} us  {memory}")
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": {name: getattr(args, name) for name in DATA_ARGUMENTS},
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["arguments"] != report["meta"]["arguments"]:
+            print("Warning: the baseline was recorded with different arguments", baseline["meta"]["arguments"])
+        print(f"Compared with {args.compare} ({baseline['meta']['created']}):")
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+def parse_args(argv:Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000, help="donations to generate")
+    parser.add_argument("--days", type=int, default=90, help="days the donations span")
+    parser.add_argument("--rate-years", type=int, default=3, help="years of daily exchange rates")
+    parser.add_argument("--queries", type=int, default=2_000, help="calls per conversion and Api case")
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="run only the cases whose name starts with one of these prefixes")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each case")
+    parser.add_argument("--save", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", help="compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown or memory growth reported as a regression")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+import threading
+
+T = TypeVar("T")
+
+class ReadWriteLock:
+    """
+    Many readers or one writer, phase fair: once a writer waits, new readers queue behind it,
+    and readers queued during a write go before the next writer. A steady stream of queries
+    can't starve ingestion, and a writer adding batch after batch can't starve queries.
+    Not reentrant, a thread holding the lock must not acquire it again.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+        # number of writes done, a queued reader goes in as soon as it changes
+        self._writes = 0
+        # odd while a writer holds the lock, bumped on every acquire and release
+        self._epoch = 0
+
+    def optimistic_read(self, read:Callable[[], T], attempts:int = 3) -> T:
+        """
+        Run read without taking the lock, and retry if a write started or ended meanwhile,
+        like a seqlock. Blocking on the lock makes a reader wait for the writer to give up
+        the GIL, so this keeps reads fast while a writer is busy. After attempts
+        overlapping writes the read lock is taken. read must not change any state.
+        """
+        for _ in range(attempts):
+            epoch = self._epoch
+            if epoch % 2:
+                continue
+            try:
+                result = read()
+            except (IndexError, KeyError, RuntimeError):
+                # torn by a concurrent write, the epoch check below retries it
+                result = None
+            if self._epoch == epoch:
+                return result
+        with self.read():
+            return read()
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            writes = self._writes
+            while self._writing or (self._waiting_writers and self._writes == writes):
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+            self._epoch += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._writes += 1
+                self._epoch += 1
+                self._condition.notify_all()
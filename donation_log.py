@@ -0,0 +1,316 @@
+from models import Donation, Donator
+from storage import DonationStore
+from ranking import RankedIndex
+from analytics import to_microseconds, from_microseconds
+from concurrency import ReadWriteLock
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, columns are also readable as memoryviews
+    np = None
+
+# One fixed-width little endian record per donation, 40 bytes so every field stays aligned:
+#   int64 timestamp (UTC microseconds), float64 amount, float64 amount_eur,
+#   int32 currency, int32 charity, int32 donator (ids in the string dictionary), 4 bytes padding
+RECORD = struct.Struct("<qddiii4x")
+# The string dictionary next to the log: uint32 length then the UTF-8 bytes, one entry per id
+STRING_LENGTH = struct.Struct("<I")
+if np is not None:
+    RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("amount", "<f8"), ("amount_eur", "<f8"), ("currency", "<i4"),
+                             ("charity", "<i4"), ("donator", "<i4"), ("padding", "V4")])
+
+class DonationLog(DonationStore):
+    """
+    Append-only binary donation log, with its string dictionary in path + ".strings".
+    The log is memory-mapped and read as columns through strided memoryviews (or numpy.memmap),
+    so full history scans never build a Donation object. Aggregates and leaderboards are
+    rebuilt from the columns when the log is opened and kept up to date on every append, from the
+    appended donations: the log is only remapped by the next query that reads the columns.
+    Queries from several threads run together, and wait for an append in progress.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.strings_path = path + ".strings"
+        self.strings : List[str] = []
+        self._string_ids : Dict[str, int] = {}
+        if os.path.exists(self.strings_path):
+            self._read_strings()
+        if os.path.exists(path):
+            # a crash can leave a partial record at the end, drop it so appends stay aligned
+            size = os.path.getsize(path)
+            if size % RECORD.size:
+                os.truncate(path, size - size % RECORD.size)
+        self._records = open(path, 'ab')
+        self._strings_file = open(self.strings_path, 'ab')
+
+        # per string id totals, only charities and donators get entries
+        self._charity_totals : Dict[int, List] = {}  # Dict[id, [total, count]]
+        self._donator_totals : Dict[int, List] = {}
+        self._donator_ranking = RankedIndex()
+        self._charity_ranking = RankedIndex()
+        # permutation of the records in timestamp order and the matching timestamps, only built once
+        # a donation arrives out of order, then kept up to date on every append
+        self._order : Optional[List[int]] = None
+        self._sorted_timestamps : Optional[List[int]] = None
+        # latest timestamp logged, and timestamp of the last record, in microseconds
+        self._latest : Optional[int] = None
+        self._last : Optional[int] = None
+        self._in_order = True
+        # appends take it for writing, queries for reading
+        self._lock = ReadWriteLock()
+        # appends don't remap the log, the first query after them does, under this lock
+        self._map_lock = threading.Lock()
+        self._mapped_count = 0
+        self._map()
+        self._count = self._mapped_count
+        self._aggregate(0, self.timestamps, self.amounts_eur, self.charities, self.donators)
+
+    def close(self):
+        self._release()
+        self._records.close()
+        self._strings_file.close()
+
+    def __len__(self):
+        return self._count
+
+    def add_donations(self, donations:List[Donation]):
+        new_strings = []
+        records = []
+        # the columns of the batch, aggregated without mapping the records just written
+        timestamps, amounts_eur, charities, donators = [], [], [], []
+        for d in donations:
+            ids = [self._string_id(value, new_strings) for value in (d.currency, d.charity, d.donator)]
+            timestamp = to_microseconds(d.timestamp)
+            records.append(RECORD.pack(timestamp, d.amount, d.amount_eur, *ids))
+            timestamps.append(timestamp)
+            amounts_eur.append(d.amount_eur)
+            charities.append(ids[1])
+            donators.append(ids[2])
+        # strings go first, so a record never refers to an id missing from the dictionary
+        with self._lock.write():
+            if new_strings:
+                self._strings_file.write(b"".join(STRING_LENGTH.pack(len(data)) + data for data in new_strings))
+                self._strings_file.flush()
+            self._records.write(b"".join(records))
+            self._records.flush()
+            start = self._count
+            self._count += len(records)
+            self._aggregate(start, timestamps, amounts_eur, charities, donators)
+
+    def get_donation_count(self) -> int:
+        return len(self)
+
+    def get_charity_totals(self) -> List[Tuple[str, float, int]]:
+        with self._lock.read():
+            return [(self.strings[charity], total, count) for charity, (total, count) in self._charity_totals.items()]
+
+    def get_donator(self, donator_id:str) -> Optional[Donator]:
+        with self._lock.read():
+            totals = self._donator_totals.get(self._string_ids.get(donator_id))
+            return self._donator(donator_id, totals) if totals is not None else None
+
+    def get_top_donators(self, k:int) -> List[Donator]:
+        with self._lock.read():
+            return [self._donator(self.strings[donator], self._donator_totals[donator]) for donator, _ in self._donator_ranking.top(k)]
+
+    def get_top_charities(self, k:int) -> List[Tuple[str, float]]:
+        with self._lock.read():
+            return [(self.strings[charity], total) for charity, total in self._charity_ranking.top(k)]
+
+    def get_donations_between(self, start:datetime, end:datetime) -> List[Donation]:
+        with self._lock.read():
+            return [self._donation(i) for i in self._positions_between(start, end)]
+
+    def get_highest_charity_between(self, start:datetime, end:datetime, latest:int = 5) -> Tuple[Optional[str], float, List[Donation]]:
+        with self._lock.read():
+            positions = self._positions_between(start, end)
+            totals = {}
+            for i in positions:
+                charity = self.charities[i]
+                totals[charity] = totals.get(charity, 0) + self.amounts_eur[i]
+            if not totals:
+                return (None, 0, [])
+            # ties go to the charity with the oldest donation in the window, like the in-memory query
+            charity = max(totals, key=totals.get)
+            latest_positions = [i for i in positions if self.charities[i] == charity][-latest:]
+            return (self.strings[charity], totals[charity], [self._donation(i) for i in latest_positions])
+
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> List[Tuple[str, float]]:
+        with self._lock.read():
+            totals = {}
+            for i in self._positions_between(start, end):
+                charity = self.charities[i]
+                totals[charity] = totals.get(charity, 0) + self.amounts_eur[i]
+            return [(self.strings[charity], total) for charity, total in totals.items()]
+
+    def get_top_donators_between(self, start:datetime, end:datetime, k:int) -> List[Tuple[str, float]]:
+        with self._lock.read():
+            totals = {}
+            for i in self._positions_between(start, end):
+                donator = self.donators[i]
+                totals[donator] = totals.get(donator, 0) + self.amounts_eur[i]
+            return [(self.strings[donator], total) for donator, total in heapq.nlargest(k, totals.items(), key=lambda item: item[1])]
+
+    def get_latest_timestamp(self) -> Optional[datetime]:
+        latest = self._latest
+        return from_microseconds(latest) if latest is not None else None
+
+    def donation(self, i:int) -> Donation:
+        """Build the Donation of record i"""
+        with self._lock.read():
+            self._remap()
+            return self._donation(i)
+
+    def _donation(self, i:int) -> Donation:
+        return Donation.from_record(self.strings[self.donators[i]], self.strings[self.charities[i]], from_microseconds(self.timestamps[i]),
+                                    self.strings[self.currencies[i]], self.amounts[i], self.amounts_eur[i])
+
+    def as_numpy(self):
+        """The log as a read-only numpy.memmap of RECORD_DTYPE records"""
+        if np is None:
+            raise ImportError("NumPy is not installed")
+        if not len(self):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', shape=(len(self),))
+
+    def _positions_between(self, start:datetime, end:datetime) -> range|List[int]:
+        """Record positions with start <= timestamp <= end, in timestamp then insertion order. Called under the read lock."""
+        self._remap()
+        start_us, end_us = to_microseconds(start), to_microseconds(end)
+        if self._in_order:
+            return range(bisect.bisect_left(self.timestamps, start_us), bisect.bisect_right(self.timestamps, end_us))
+        lo = bisect.bisect_left(self._sorted_timestamps, start_us)
+        hi = bisect.bisect_right(self._sorted_timestamps, end_us)
+        return self._order[lo:hi]
+
+    def _remap(self):
+        """
+        Map the records appended since the last query. Called under the read lock: readers racing
+        the remap keep the previous columns, which hold the same values for the records they cover.
+        """
+        if self._mapped_count < self._count:
+            with self._map_lock:
+                if self._mapped_count < self._count:
+                    self._map()
+
+    def _map(self):
+        """Map the whole records of the log and expose every field as a strided memoryview column"""
+        self._release()
+        size = os.path.getsize(self.path)
+        if size == 0:
+            self.timestamps = self.amounts = self.amounts_eur = memoryview(b"")
+            self.currencies = self.charities = self.donators = memoryview(b"")
+            return
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        # a record is 5 int64/float64 slots, or 10 int32 slots
+        int64s, float64s, int32s = view.cast("q"), view.cast("d"), view.cast("i")
+        self.timestamps = int64s[0::5]
+        self.amounts = float64s[1::5]
+        self.amounts_eur = float64s[2::5]
+        self.currencies = int32s[6::10]
+        self.charities = int32s[7::10]
+        self.donators = int32s[8::10]
+        self._mapped_count = size // RECORD.size
+
+    def _release(self):
+        # old views are dropped rather than released, callers may still read them,
+        # and the previous mmap is closed when the last of them goes
+        self._mmap = None
+
+    def _aggregate(self, start:int, timestamps:Sequence[int], amounts_eur:Sequence[float],
+                   charity_ids:Sequence[int], donator_ids:Sequence[int]):
+        """Add the records from position start on, given as columns, to the totals and rankings"""
+        charities = {}
+        donators = {}
+        last = self._last
+        for i in range(len(timestamps)):
+            amount_eur = amounts_eur[i]
+            for totals, changed, key in ((self._charity_totals, charities, charity_ids[i]),
+                                         (self._donator_totals, donators, donator_ids[i])):
+                entry = totals.get(key)
+                if entry is None:
+                    entry = totals[key] = [0.0, 0]
+                entry[0] += amount_eur
+                entry[1] += 1
+                changed[key] = entry
+            timestamp = timestamps[i]
+            if last is not None and timestamp < last:
+                self._in_order = False
+            if self._latest is None or timestamp > self._latest:
+                self._latest = timestamp
+            last = timestamp
+        self._last = last
+        for charity, (total, _) in charities.items():
+            self._charity_ranking.update(charity, total)
+        for donator, (total, _) in donators.items():
+            self._donator_ranking.update(donator, total)
+        if not self._in_order:
+            if self._order is None:
+                # the first record out of order: index the whole log, mapped up to this batch
+                self._remap()
+                self._index(0, self.timestamps)
+            else:
+                self._index(start, timestamps)
+
+    def _index(self, start:int, timestamps:Sequence[int]):
+        """Merge the records from position start on, given their timestamps, into the timestamp order, in O(n) rather than a full sort"""
+        # sorted() is stable, so equal timestamps keep the order they were logged in
+        new = sorted(range(start, start + len(timestamps)), key=lambda i: timestamps[i - start])
+        new_timestamps = [timestamps[i - start] for i in new]
+        if start == 0:
+            self._order, self._sorted_timestamps = new, new_timestamps
+        elif not new or new_timestamps[0] >= self._sorted_timestamps[-1]:
+            self._order.extend(new)
+            self._sorted_timestamps.extend(new_timestamps)
+        elif len(new) < 16:
+            # a few late donations, each inserted after the equal timestamps already logged
+            for i, timestamp in zip(new, new_timestamps):
+                position = bisect.bisect_right(self._sorted_timestamps, timestamp)
+                self._order.insert(position, i)
+                self._sorted_timestamps.insert(position, timestamp)
+        else:
+            # ordering by (timestamp, position) is the stable order, and the new positions are the highest
+            merged = list(heapq.merge(zip(self._sorted_timestamps, self._order), zip(new_timestamps, new)))
+            self._sorted_timestamps = [timestamp for timestamp, _ in merged]
+            self._order = [i for _, i in merged]
+
+    def _string_id(self, value:str, new_strings:List[bytes]) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+            new_strings.append(value.encode('utf-8'))
+        return string_id
+
+    def _read_strings(self):
+        with open(self.strings_path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + STRING_LENGTH.size <= len(data):
+            (length,) = STRING_LENGTH.unpack_from(data, position)
+            if position + STRING_LENGTH.size + length > len(data):
+                break
+            value = sys.intern(data[position + STRING_LENGTH.size:position + STRING_LENGTH.size + length].decode('utf-8'))
+            self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+            position += STRING_LENGTH.size + length
+        if position < len(data):
+            # partial entry left by a crash, none of the records can refer to it
+            os.truncate(self.strings_path, position)
+
+    @staticmethod
+    def _donator(donator_id:str, totals:List) -> Donator:
+        donator = Donator(donator_id)
+        donator.total_eur, donator.donation_count = totals
+        return donator
@@ -1,12 +1,77 @@
 from models import Donation, Charity, Donator
-from exchange_rate_service import ExchangeRateService
-from datetime import datetime, timedelta
-from typing import List, Tuple  
+from exchange_rate_service import ExchangeRateService, rate_day
+from analytics import WindowAnalytics, to_microseconds, from_microseconds
+from ranking import RankedIndex, WindowedRanking
+from rollups import CharityRollups
+from window_cache import WindowResultCache
+from storage import DonationStore
+from snapshot import Snapshot, SnapshotDonations
+from concurrency import ReadWriteLock
+from metrics import REGISTRY, Stages
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import bisect
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+def convert_donations(exchange_rate_service:ExchangeRateService, donations:List[Donation]):
+    """
+    Set amount_eur on every donation that isn't converted yet, resolving each conversion once per
+    (currency, day). All or nothing: raises ValueError before changing any donation if one can't be converted.
+    """
+    multipliers = {}
+    for donation in donations:
+        if donation.amount_eur is not None:
+            continue
+        key = (donation.currency,) + rate_day(donation.timestamp)
+        if key not in multipliers:
+            multipliers[key] = exchange_rate_service.get_conversion_multiplier(donation.currency, "EUR", donation.timestamp)
+            if multipliers[key] is None:
+                raise ValueError(f"No exchange rate available for {donation.currency} to EUR at {donation.timestamp})")
+    for donation in donations:
+        if donation.amount_eur is None:
+            donation.amount_eur = donation.amount * multipliers[(donation.currency,) + rate_day(donation.timestamp)]
+
+class ServiceTotals:
+    """Immutable copy of the aggregates, published by the writer after every change"""
+    __slots__ = ("version", "total_donations", "charity_totals", "most_generous_donator")
+
+    def __init__(self, version:int, total_donations:float, charity_totals:Dict[str, float], most_generous_donator:Optional[Donator]):
+        self.version = version
+        self.total_donations = total_donations
+        self.charity_totals = charity_totals
+        self.most_generous_donator = most_generous_donator
 
 class DonationService:
-    """A class representing a donation service."""
-    def __init__(self, exchange_rate_service:ExchangeRateService):
+    """
+    A class representing a donation service.
+    Safe for one writer and many reader threads: writers are serialized, the aggregates
+    are read from an immutable ServiceTotals published after each change, and the indexes
+    behind window and leaderboard queries are guarded by a readers-writer lock that
+    writers only hold while applying an already converted batch. Readers go through it
+    optimistically and only block when a write keeps overlapping their read.
+    With a retention horizon, raw donations older than the horizon (counted back from the
+    latest donation, rounded down to midnight) are dropped from memory once per day of
+    donations. Running totals are untouched and range totals keep per charity, per day
+    buckets, so memory plateaus instead of growing with the lifetime volume.
+    """
+    def __init__(self, exchange_rate_service:ExchangeRateService, store:Optional[DonationStore] = None,
+                 retention:Optional[timedelta] = None,
+                 leaderboard_windows:Sequence[timedelta] = (timedelta(days=1), timedelta(days=7))):
         self.exchange_rate_service = exchange_rate_service
+        if retention is not None and retention < timedelta(days=1):
+            raise ValueError("The retention horizon must cover at least the 24 hour window")
+        self.retention = retention
+        # Donations before this midnight were compacted: only their totals are kept
+        self.retained_since : Optional[datetime] = None
+        self._latest_timestamp : Optional[datetime] = None
+        # Optional persistent storage. When set, every donation is written through to it,
+        # and the window and leaderboard queries run against it: the raw donations, their
+        # time index, rollups and Charity.donations are only kept in memory without a store.
+        self.store = store
         "This is a global list of donations for all charities"
         self.donations = []
 
@@ -17,68 +82,511 @@ class DonationService:
         self.most_generous_donator : Donator = None 
         # Total donations throught the service's lifetime
         self.total_donations = 0
+        # Leaderboards of donators and charities by lifetime total in EUR
+        self.donator_ranking = RankedIndex()
+        self.charity_ranking = RankedIndex()
+        # Leaderboards of donators over sliding windows ending at the latest donation.
+        # With a store they are seeded from the stored donations of the widest window.
+        self.windowed_donator_rankings : Dict[timedelta, WindowedRanking] = {
+            window: WindowedRanking(window) for window in leaderboard_windows}
+        # Per charity totals in minute, hour and day buckets, for range totals
+        self.rollups = CharityRollups()
+
+        # Time-ordered index over all donations, used by the window queries.
+        # Both lists are kept in the same order so a bisect on the timestamps
+        # gives the position of the matching donation.
+        self._donation_timestamps : List[datetime] = []
+        self._donations_by_time : List[Donation] = []
+        # Donations restored from a snapshot, read in place from the file. The lists above
+        # only hold donations added after the restore.
+        self._history : Optional[SnapshotDonations] = None
+
+        # Bumped on every change, so snapshots built from the donations know when they are stale
+        self._version = 0
+        # Snapshot used by the batch window queries, as (version it was built at, engine),
+        # one tuple so a reader never pairs an engine with the wrong version
+        self._analytics : Optional[Tuple[int, WindowAnalytics]] = None
+        # Results of get_highest_charity_over_24_hours per window end, dropped by donations inside the window
+        self.window_cache = WindowResultCache(timedelta(days=1))
+
+        # held by a writer for a whole add, so conversions and store writes are serialized
+        self._writer_lock = threading.Lock()
+        # guards the indexes and rankings while a writer applies a batch
+        self._rw_lock = ReadWriteLock()
+        self.totals = ServiceTotals(0, 0, {}, None)
+
+        if self.store is not None:
+            self._restore_from_store()
+            self._publish_totals()
     
     def add_donation(self, donation:Donation):
+        # None unless metrics are enabled, then every stage of the add is timed
+        stages = REGISTRY.stages("donation_service.add_donation")
+        with self._writer_lock:
+            self._add_donation(donation, stages)
+            self._publish_totals()
+        if stages:
+            stages.lap("publish")
+            REGISTRY.increment("donation_service.donations_added")
+
+    def _add_donation(self, donation:Donation, stages:Optional[Stages] = None):
         if donation.amount_eur is None:
             # the original donation isn't in EUR so we need to convert it
             eur = self.exchange_rate_service.convert_to_eur(donation.amount, donation.currency, donation.timestamp)
             if eur is None:
                 raise ValueError(f"No exchange rate available for {donation.currency} to EUR at {donation.timestamp})")
             donation.amount_eur = eur
-        self.donations.append(donation)
-        print(f"Added donation: {donation}")
+        charity = self._get_charity(donation.charity)
+        donator = self._get_donator(donation.donator)
+        if stages:
+            stages.lap("convert")
+        if self.store is not None:
+            self.store.add_donations([donation])
+            if stages:
+                stages.lap("store")
+        with self._rw_lock.write():
+            if stages:
+                stages.lap("lock_wait")
+            if self.store is None:
+                self.donations.append(donation)
+                self._index_donation(donation)
+                self.rollups.add_donations((donation,))
+                self.window_cache.invalidate((donation,))
+            self._apply_windows((donation,))
+            self._version += 1
+            logger.debug("Added donation: %s", donation)
 
-        # Update running total
-        # O(1) to keep total donations updates
-        self.total_donations += donation.amount_eur
+            # Update running total
+            # O(1) to keep total donations updates
+            self.total_donations += donation.amount_eur
 
-        # update charities
-        # O(1) to keep total donations per charity updated
-        if donation.charity not in self.charities:
-            self.charities[donation.charity] = Charity(donation.charity)
-        self.charities[donation.charity].add_donation(donation)
+            # update charities
+            # O(1) to keep total donations per charity updated
+            if self.store is None:
+                charity.add_donation(donation)
+            else:
+                charity.add_total(donation.amount_eur)
+            # O(log n) to keep the charity leaderboard updated
+            self.charity_ranking.update(charity.name, charity.total_donations)
 
-        # update donators
-        if donation.donator not in self.donators:
-            self.donators[donation.donator] = Donator(donation.donator)
-        self.donators[donation.donator].add_donation(donation)
+            # update donators
+            donator.add_donation(donation)
+            self.donator_ranking.update(donator.donator_id, donator.total_eur)
 
-        # update statistics for donatos
-        if self.most_generous_donator is None or self.most_generous_donator.total_eur < self.donators[donation.donator].total_eur:
-            self.most_generous_donator = self.donators[donation.donator]
+            # update statistics for donatos
+            if self.most_generous_donator is None or self.most_generous_donator.total_eur < donator.total_eur:
+                self.most_generous_donator = donator
+        if stages:
+            stages.lap("apply")
+
+    def add_donations(self, donations:Iterable[Donation]) -> int:
+        """
+        Add a batch of donations. Returns the number of donations added.
+        Conversions are resolved once per (currency, day), aggregates are applied in one
+        pass and the most generous donator is updated once for the whole batch.
+        The batch is all or nothing: if a donation can't be converted nothing is added.
+        """
+        donations = list(donations)
+        if not donations:
+            return 0
+        stages = REGISTRY.stages("donation_service.add_donations")
+        with self._writer_lock:
+            self._add_donations(donations, stages)
+            self._publish_totals()
+        if stages:
+            stages.lap("publish")
+            REGISTRY.increment("donation_service.batches_added")
+            REGISTRY.increment("donation_service.donations_added", len(donations))
+        return len(donations)
+
+    def _add_donations(self, donations:List[Donation], stages:Optional[Stages] = None):
+        # resolve every conversion before touching any state
+        convert_donations(self.exchange_rate_service, donations)
+        if stages:
+            stages.lap("convert")
+
+        donations_per_charity : Dict[str, List[Donation]] = {}
+        donations_per_donator : Dict[str, List[Donation]] = {}
+        for donation in donations:
+            donations_per_charity.setdefault(donation.charity, []).append(donation)
+            donations_per_donator.setdefault(donation.donator, []).append(donation)
+        # looked up before the store is written, so restored totals don't include this batch
+        charities = [self._get_charity(name) for name in donations_per_charity]
+        donators = [self._get_donator(name) for name in donations_per_donator]
+        if stages:
+            stages.lap("group")
+
+        if self.store is not None:
+            self.store.add_donations(donations)
+            if stages:
+                stages.lap("store")
+        with self._rw_lock.write():
+            if stages:
+                stages.lap("lock_wait")
+            if self.store is None:
+                self.donations.extend(donations)
+                self._index_donations(donations)
+                self.rollups.add_donations(donations)
+                self.window_cache.invalidate(donations)
+            self._apply_windows(donations)
+            self._version += 1
+
+            self.total_donations += sum(donation.amount_eur for donation in donations)
+            for charity in charities:
+                if self.store is None:
+                    charity.add_donations(donations_per_charity[charity.name])
+                else:
+                    charity.add_total(sum(donation.amount_eur for donation in donations_per_charity[charity.name]))
+                self.charity_ranking.update(charity.name, charity.total_donations)
+            for donator in donators:
+                donator.add_donations(donations_per_donator[donator.donator_id])
+                self.donator_ranking.update(donator.donator_id, donator.total_eur)
+
+            # only donators of this batch can overtake the current most generous one
+            candidate = max(donators, key=lambda donator: donator.total_eur)
+            if self.most_generous_donator is None or self.most_generous_donator.total_eur < candidate.total_eur:
+                self.most_generous_donator = candidate
+        if stages:
+            stages.lap("apply")
+
+        logger.debug("Added %d donations", len(donations))
+
+    def add_aggregated(self, donations:List[Donation], charity_totals:Dict[str, Tuple[float, int]],
+                       donator_totals:Dict[str, Tuple[float, int]]) -> int:
+        """
+        Add a batch of donations already converted to EUR, with their (total, count) per charity
+        and per donator computed elsewhere, e.g. by the DataLoader.load_donations_parallel workers.
+        Skips the conversion and the per donator pass of add_donations. Returns the number of donations added.
+        """
+        if not donations:
+            return 0
+        stages = REGISTRY.stages("donation_service.add_aggregated")
+        with self._writer_lock:
+            charities = [self._get_charity(name) for name in charity_totals]
+            donators = [self._get_donator(name) for name in donator_totals]
+            # Charity.donations still needs the donations of each charity, in order, unless they are in the store
+            donations_per_charity : Dict[str, List[Donation]] = {name: [] for name in charity_totals}
+            if self.store is None:
+                for donation in donations:
+                    donations_per_charity[donation.charity].append(donation)
+            if stages:
+                stages.lap("group")
+
+            if self.store is not None:
+                self.store.add_donations(donations)
+                if stages:
+                    stages.lap("store")
+            with self._rw_lock.write():
+                if stages:
+                    stages.lap("lock_wait")
+                if self.store is None:
+                    self.donations.extend(donations)
+                    self._index_donations(donations)
+                    self.rollups.add_donations(donations)
+                    self.window_cache.invalidate(donations)
+                self._apply_windows(donations)
+                self._version += 1
+
+                self.total_donations += sum(total for total, _ in charity_totals.values())
+                for charity in charities:
+                    charity.add_donations(donations_per_charity[charity.name], charity_totals[charity.name][0])
+                    self.charity_ranking.update(charity.name, charity.total_donations)
+                for donator in donators:
+                    donator.add_total(*donator_totals[donator.donator_id])
+                    self.donator_ranking.update(donator.donator_id, donator.total_eur)
+
+                candidate = max(donators, key=lambda donator: donator.total_eur)
+                if self.most_generous_donator is None or self.most_generous_donator.total_eur < candidate.total_eur:
+                    self.most_generous_donator = candidate
+            if stages:
+                stages.lap("apply")
+            self._publish_totals()
+        if stages:
+            stages.lap("publish")
+            REGISTRY.increment("donation_service.batches_added")
+            REGISTRY.increment("donation_service.donations_added", len(donations))
+        logger.debug("Added %d aggregated donations", len(donations))
+        return len(donations)
+
+    def get_totals(self) -> ServiceTotals:
+        """
+        The running totals and most generous donator, consistent with each other.
+        Lock free: readers get the last copy published by the writer.
+        """
+        return self.totals
+
+    def _publish_totals(self):
+        """Publish a copy of the aggregates for readers. O(charities)"""
+        most_generous = None
+        if self.most_generous_donator is not None:
+            most_generous = Donator(self.most_generous_donator.donator_id)
+            most_generous.total_eur = self.most_generous_donator.total_eur
+            most_generous.donation_count = self.most_generous_donator.donation_count
+        charity_totals = {name: charity.total_donations for name, charity in self.charities.items()}
+        # a single attribute assignment, readers see either the old or the new totals
+        self.totals = ServiceTotals(self._version, self.total_donations, charity_totals, most_generous)
+
+    def _get_charity(self, name:str) -> Charity:
+        """Get a charity, creating it on its first donation"""
+        charity = self.charities.get(name)
+        if charity is None:
+            charity = self.charities[name] = Charity(name)
+        return charity
+
+    def _get_donator(self, donator_id:str) -> Donator:
+        """Get a donator, loading their totals from the store or creating them on their first donation"""
+        donator = self.donators.get(donator_id)
+        if donator is None:
+            if self.store is not None:
+                donator = self.store.get_donator(donator_id)
+            if donator is None:
+                donator = Donator(donator_id)
+            self.donators[donator_id] = donator
+        return donator
+
+    def _restore_from_store(self):
+        """
+        Restore the aggregates from the store instead of replaying every donation.
+        Charities are few and loaded up front, donators are loaded on demand.
+        Raw donations stay in the store, where the window queries read them.
+        """
+        for name, total, _ in self.store.get_charity_totals():
+            charity = self._get_charity(name)
+            charity.total_donations = total
+            self.total_donations += total
+        top = self.store.get_top_donators(1)
+        if top:
+            self.most_generous_donator = self.donators[top[0].donator_id] = top[0]
+        latest = self.store.get_latest_timestamp()
+        if latest is not None:
+            self._seed_windows(latest, self.store.get_donations_between)
+
+    def restore_snapshot(self, snapshot:Snapshot):
+        """
+        Restore the aggregates and rankings saved in a snapshot, without replaying donations.
+        The saved donations stay in the memory-mapped file and are read by the window queries,
+        so donations and Charity.donations only hold what is added after the restore.
+        """
+        if self.store is not None:
+            raise ValueError("A service with a store restores its state from the store")
+        if self.donations or self._history is not None:
+            raise ValueError("A snapshot can only be restored into an empty service")
+        self._history = snapshot.donations
+        self.window_cache.clear()
+        history = self._history
+        self.rollups.restore(snapshot.iter_rollups())
+        for name, total in snapshot.iter_charity_totals():
+            charity = self._get_charity(name)
+            charity.total_donations = total
+            self.charity_ranking.update(name, total)
+        for name, total, count in snapshot.iter_donator_totals():
+            donator = self._get_donator(name)
+            donator.total_eur = total
+            donator.donation_count = count
+            self.donator_ranking.update(name, total)
+        self.total_donations = snapshot.total_donations
+        if snapshot.most_generous_donator is not None:
+            self.most_generous_donator = self.donators[snapshot.most_generous_donator]
+        if len(history):
+            self._seed_windows(from_microseconds(history.timestamps[len(history) - 1]), history.between)
+        # the raw donations the saved service had compacted aren't in the snapshot either
+        self.retained_since = snapshot.retained_since
+        if self.retention is not None and self._latest_timestamp is not None:
+            cutoff = datetime.combine((self._latest_timestamp - self.retention).date(), time())
+            if self.retained_since is None or cutoff > self.retained_since:
+                # the saved donations stay in the file, only the rollups are dropped
+                self._compact(cutoff)
+        self._version += 1
+        self._publish_totals()
+
+    def _seed_windows(self, latest:datetime, donations_between:Callable[[datetime, datetime], Sequence[Donation]]):
+        """Fill the windowed leaderboards with the donations restored up to latest"""
+        self._latest_timestamp = latest
+        # only the donations of the widest window can be in any windowed leaderboard
+        widest = max(self.windowed_donator_rankings, default=None)
+        if widest is None:
+            return
+        recent = donations_between(latest - widest, latest)
+        for ranking in self.windowed_donator_rankings.values():
+            ranking.add((donation.timestamp, donation.donator, donation.amount_eur) for donation in recent)
+
+    def _apply_windows(self, donations:Sequence[Donation]):
+        """
+        Slide the windowed leaderboards, and compact the donations that fell out of the retention
+        horizon, after adding donations. Called by writers holding the write lock.
+        """
+        for ranking in self.windowed_donator_rankings.values():
+            ranking.add((donation.timestamp, donation.donator, donation.amount_eur) for donation in donations)
+        latest = max(donation.timestamp for donation in donations)
+        if self._latest_timestamp is not None and latest <= self._latest_timestamp:
+            return
+        self._latest_timestamp = latest
+        if self.retention is None:
+            return
+        cutoff = datetime.combine((latest - self.retention).date(), time())
+        if self.retained_since is None or cutoff > self.retained_since:
+            self._compact(cutoff)
+
+    def _compact(self, cutoff:datetime):
+        """
+        Drop the raw donations before cutoff, a midnight, and the minute and hour rollups before it.
+        O(retained donations), once per day of donations. Late donations older than the cutoff
+        are counted in the totals and the day rollups, and dropped at the next compaction.
+        """
+        position = bisect.bisect_left(self._donation_timestamps, cutoff)
+        del self._donation_timestamps[:position]
+        del self._donations_by_time[:position]
+        self.donations = [donation for donation in self.donations if donation.timestamp >= cutoff]
+        for charity in self.charities.values():
+            charity.donations = [donation for donation in charity.donations if donation.timestamp >= cutoff]
+        self.rollups.compact(to_microseconds(cutoff))
+        self.retained_since = cutoff
+        logger.debug("Compacted donations before %s, %d left", cutoff, len(self.donations))
+
+    def _check_retained(self, start:datetime):
+        """Raise a ValueError if raw donations from start on were compacted"""
+        retained_since = self.retained_since
+        if self.store is None and retained_since is not None and start < retained_since:
+            raise ValueError(f"Donations before {retained_since} were compacted, only their daily totals are kept")
+
+    def get_history(self) -> Sequence[Donation]:
+        """Donations restored from a snapshot, in timestamp order"""
+        return self._history if self._history is not None else []
+
+    def _index_donations(self, donations:List[Donation]):
+        """Insert a batch of donations in the time-ordered index."""
+        batch = sorted(donations, key=lambda d: d.timestamp)
+        if not self._donation_timestamps or self._donation_timestamps[-1] <= batch[0].timestamp:
+            self._donations_by_time.extend(batch)
+            self._donation_timestamps.extend(d.timestamp for d in batch)
+            return
+        # the index and the batch are two sorted runs, which sorted() merges in linear time.
+        # It is stable, so donations with equal timestamps stay in insertion order.
+        self._donations_by_time = sorted(self._donations_by_time + batch, key=lambda d: d.timestamp)
+        self._donation_timestamps = [d.timestamp for d in self._donations_by_time]
+
+    def _index_donation(self, donation:Donation):
+        """Insert a donation in the time-ordered index."""
+        # Donations usually arrive in order, so this is an append in the common case.
+        # bisect_right keeps donations with equal timestamps in insertion order.
+        position = bisect.bisect_right(self._donation_timestamps, donation.timestamp)
+        self._donation_timestamps.insert(position, donation.timestamp)
+        self._donations_by_time.insert(position, donation)
+
+    def get_donations_between(self, start:datetime, end:datetime) -> List[Donation]:
+        """Get all donations with start <= timestamp <= end, ordered by timestamp. O(log n + k)"""
+        if self.store is not None:
+            return self.store.get_donations_between(start, end)
+        self._check_retained(start)
+        return self._rw_lock.optimistic_read(lambda: self._donations_between(start, end))
+
+    def _donations_between(self, start:datetime, end:datetime) -> List[Donation]:
+        """get_donations_between without the store or locking, for callers already in an optimistic read"""
+        lo = bisect.bisect_left(self._donation_timestamps, start)
+        hi = bisect.bisect_right(self._donation_timestamps, end)
+        donations = self._donations_by_time[lo:hi]
+        if self._history is not None:
+            # restored donations are older on equal timestamps, merge keeps them first
+            return list(heapq.merge(self._history.between(start, end), donations, key=lambda d: d.timestamp))
+        return donations
+
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> Dict[str, float]:
+        """
+        Total per charity of the donations with start <= timestamp <= end, from the rollups:
+        a few day, hour and minute buckets plus the raw donations of the partial minutes at the edges.
+        Before retained_since, only whole days can be answered: start must be a midnight,
+        and so must end + 1 microsecond if it is before retained_since too.
+        """
+        if self.store is not None:
+            return dict(self.store.get_charity_totals_between(start, end))
+        retained_since = self.retained_since
+        if retained_since is not None:
+            for edge in (start, end + timedelta(microseconds=1)):
+                if edge < retained_since and edge.time() != time():
+                    raise ValueError(f"Donations before {retained_since} were compacted, ranges before it must cover whole days")
+        return self._rw_lock.optimistic_read(lambda: self.rollups.totals_between(start, end, self._donations_between))
 
-    
     def get_highest_charity_over_24_hours(self, end:datetime = None) -> Tuple[Charity, float, List[Donation]]:
-        """Get the highest grossing charity over the last 24 hours. Can pass in a custom date."""
-        window_start: datetime = end - timedelta(days=1) if end is not None else datetime.now() - timedelta(days=1)
-        print(f"Getting highest charity over the last 24 hours starting from {window_start}")
-        # filter donations in the last 24 hours
-        total_donations_per_charity = {}
-        donations_per_charity = {}
-        for donation in self.donations:
-            #print(f"Checking donation: {donation.timestamp} vs {window_start} and {end}")
-            if donation.timestamp >= window_start and donation.timestamp <= end:
-                total_donations_per_charity[donation.charity] = total_donations_per_charity.get(donation.charity, 0) + donation.amount_eur
-                donations_per_charity[donation.charity] = donations_per_charity.get(donation.charity, []) + [donation]
-                #print(f"Donations for {donation.charity}: {total_donations_per_charity[donation.charity]}")
-
-        # get the highest grossing charity
-        if total_donations_per_charity == {}:
-            return (None, 0, [])
-        
-        highest_charity = max(total_donations_per_charity, key=total_donations_per_charity.get)
-        #print(f"Highest charity: {highest_charity} with {total_donations_per_charity[highest_charity]}")
-        # Sort the donations for the highest charity by timestamp
-        donations_per_charity[highest_charity].sort(key=lambda d: d.timestamp)
-        #print(f"Donations for {highest_charity}: {donations_per_charity[highest_charity]}")
-
-        # Get the latest 5 donations
-        latest_5_donations = donations_per_charity[highest_charity][-5:]
-        #print(f"Latest 5 donations: {latest_5_donations}")
-        return (highest_charity, total_donations_per_charity[highest_charity], latest_5_donations)
-    
+        """
+        Get the highest grossing charity over the last 24 hours. Can pass in a custom date.
+        Served from the window cache: repeated ends are hits, and a slightly later end
+        slides a cached window instead of recomputing it.
+        """
+        if end is None:
+            end = datetime.now()
+        window_start: datetime = end - timedelta(days=1)
+        logger.debug("Getting highest charity over the last 24 hours starting from %s", window_start)
+        if self.store is not None:
+            # pushed down to the store, which has every donation and not only this session's
+            return self.store.get_highest_charity_between(window_start, end)
+        self._check_retained(window_start)
+        return self.window_cache.get(end, self.get_donations_between)
+
+    def get_top_donators(self, k:int) -> List[Donator]:
+        """The k donators with the highest lifetime totals, highest first. O(k log k)"""
+        if self.store is not None:
+            return [self.donators.get(d.donator_id, d) for d in self.store.get_top_donators(k)]
+        return self._rw_lock.optimistic_read(lambda: [self.donators[name] for name, _ in self.donator_ranking.top(k)])
+
+    def get_top_donators_over(self, window:timedelta, k:int) -> Tuple[Optional[datetime], List[Tuple[str, float]]]:
+        """
+        The k donators who gave the most over the window ending at the latest donation, as
+        (end of the window, [(donator_id, total EUR)]), most generous first. Windows in
+        leaderboard_windows are maintained as donations arrive and read in O(k log k),
+        others are summed from the time index in O(log n + donations in the window), or by the store.
+        """
+        ranking = self.windowed_donator_rankings.get(window)
+        if ranking is not None:
+            return self._rw_lock.optimistic_read(lambda: (ranking.end, ranking.top(k)))
+        end = self._latest_timestamp
+        if end is None:
+            return (None, [])
+        if self.store is not None:
+            return (end, self.store.get_top_donators_between(end - window, end, k))
+        totals = {}
+        for donation in self.get_donations_between(end - window, end):
+            totals[donation.donator] = totals.get(donation.donator, 0) + donation.amount_eur
+        return (end, heapq.nlargest(k, totals.items(), key=lambda item: item[1]))
+
+    def get_top_charities(self, k:int) -> List[Charity]:
+        """The k charities with the highest lifetime totals, highest first. O(k log k)"""
+        if self.store is not None:
+            return [self.charities[name] for name, _ in self.store.get_top_charities(k)]
+        return self._rw_lock.optimistic_read(lambda: [self.charities[name] for name, _ in self.charity_ranking.top(k)])
+
+    def get_top_donator_totals(self, k:int) -> List[Tuple[str, float]]:
+        """(donator_id, total EUR) of the k most generous donators, with the totals as ranked, for readers racing a writer"""
+        if self.store is not None:
+            return [(donator.donator_id, donator.total_eur) for donator in self.store.get_top_donators(k)]
+        return self._rw_lock.optimistic_read(lambda: self.donator_ranking.top(k))
+
+    def get_top_charity_totals(self, k:int) -> List[Tuple[str, float]]:
+        """(name, total EUR) of the k highest grossing charities, with the totals as ranked, for readers racing a writer"""
+        if self.store is not None:
+            return list(self.store.get_top_charities(k))
+        return self._rw_lock.optimistic_read(lambda: self.charity_ranking.top(k))
+
+    def get_window_analytics(self) -> WindowAnalytics:
+        """Analytics engine over the current donations. Rebuilt only after donations were added."""
+        cached = self._analytics
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        version, donations = self._rw_lock.optimistic_read(lambda: (self._version, list(self._donations_by_time)))
+        if self._history is not None:
+            donations = list(heapq.merge(self._history, donations, key=lambda d: d.timestamp))
+        analytics = WindowAnalytics(donations)
+        self._analytics = (version, analytics)
+        return analytics
 
+    def get_highest_charities_over_24_hours(self, ends:Sequence[datetime]) -> List[Tuple[Charity, float, List[Donation]]]:
+        """Batch version of get_highest_charity_over_24_hours, answering every end in one pass."""
+        if self.store is not None:
+            return [self.get_highest_charity_over_24_hours(end) for end in ends]
+        if ends:
+            self._check_retained(min(ends) - timedelta(days=1))
+        return self.get_window_analytics().highest_charity_per_window(ends, timedelta(days=1))
 
+    def window_cache_info(self) -> Dict:
+        """Hit, slide and miss counters of the window result cache"""
+        return self.window_cache.info()
 
-        
-    
\ No newline at end of file
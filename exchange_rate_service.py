@@ -1,103 +1,381 @@
 from models import ExchangeRate
-from datetime import datetime
+from storage import ExchangeRateStore
+from metrics import REGISTRY
+from datetime import datetime, time
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import OrderedDict
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A rate lookup depends on the day and, for the closest date fallback, on whether
+# the requested datetime has a time component. (date ordinal, partial day)
+RateDay = Tuple[int, bool]
+
+_MISSING = object()
+# Metrics label of a conversion path by its number of rates
+PATH_LENGTHS = {0: "same_currency", 1: "one_hop", 2: "two_hop"}
+
+def rate_day(date:datetime) -> RateDay:
+    """The day a conversion on this date resolves to. Dates on the same RateDay always convert the same way."""
+    return (date.toordinal(), date.time() != time())
+
+class ConversionCache:
+    """
+    Bounded LRU cache of resolved conversions.
+    Each entry stores what was resolved for a key (the effective multiplier of a conversion,
+    or the table of best paths for a day) along with the dependencies it was resolved from:
+    date ordinals and currency pairs. A new rate only evicts the entries that depend on it.
+    """
+    def __init__(self, maxsize:int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries : OrderedDict = OrderedDict() # OrderedDict[key, value]
+        self._dependencies_per_entry : Dict[Hashable, List[Hashable]] = {}
+        self._entries_per_dependency : Dict[Hashable, Set[Hashable]] = {}
+
+    def get(self, key:Hashable):
+        """Return the cached value for key, or _MISSING if it isn't cached"""
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key:Hashable, value, dependencies:Iterable[Hashable]):
+        """Cache a resolved value along with what was used to resolve it"""
+        if self.maxsize <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        elif len(self._entries) >= self.maxsize:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        dependencies = list(dependencies)
+        self._entries[key] = value
+        self._dependencies_per_entry[key] = dependencies
+        for dependency in dependencies:
+            self._entries_per_dependency.setdefault(dependency, set()).add(key)
+
+    def invalidate(self, dependencies:Iterable[Hashable]):
+        """Evict every entry that depends on any of the given dependencies"""
+        for dependency in dependencies:
+            for key in list(self._entries_per_dependency.get(dependency, ())):
+                self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._dependencies_per_entry.clear()
+        self._entries_per_dependency.clear()
+
+    def info(self) -> Dict:
+        """Cache statistics, to help size the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key:Hashable):
+        del self._entries[key]
+        for dependency in self._dependencies_per_entry.pop(key):
+            keys = self._entries_per_dependency[dependency]
+            keys.discard(key)
+            if not keys:
+                del self._entries_per_dependency[dependency]
+
+class RateGraph:
+    """
+    Directed graph of currencies for a single day.
+    Edges are weighted by the multiplier of the conversion, fees included, so the
+    cheapest path between two currencies is the one with the highest product.
+    """
+    def __init__(self):
+        self.edges : Dict[Tuple[str, str], float] = {}
+        # how each edge's rate was found: direct, inverse or closest_date
+        self.kinds : Dict[Tuple[str, str], str] = {}
+        self.currencies : Set[str] = set()
+
+    def add_edge(self, source:str, target:str, multiplier:float, kind:str = "direct"):
+        self.edges[(source, target)] = multiplier
+        self.kinds[(source, target)] = kind
+        self.currencies.add(source)
+        self.currencies.add(target)
+
+    def best_paths_to(self, target:str) -> Dict[str, Tuple[float, Tuple[str, ...]]]:
+        """
+        Find the cheapest path from every currency to target. O(V * E)
+        Returns Dict[source, (multiplier, path)] with path starting at source and ending at target.
+        This is Bellman-Ford run backwards from the target. Paths never visit a currency twice,
+        so an arbitrage cycle in the rates can't make a conversion grow without bounds.
+        """
+        best = {target: (1.0, (target,))}
+        for _ in range(len(self.currencies) - 1):
+            changed = False
+            for (source, hop), multiplier in self.edges.items():
+                if hop not in best:
+                    continue
+                hop_multiplier, hop_path = best[hop]
+                if source in hop_path:
+                    continue
+                candidate = multiplier * hop_multiplier
+                if source not in best or candidate > best[source][0]:
+                    best[source] = (candidate, (source,) + hop_path)
+                    changed = True
+            if not changed:
+                break
+        return best
+
+class ConversionPaths:
+    """The cheapest conversion paths to a target currency on a day"""
+    def __init__(self, paths:Dict[str, Tuple[float, Tuple[str, ...]]], dependencies:List[Hashable],
+                 kinds:Dict[str, Tuple[str, ...]]):
+        self.paths = paths
+        # date ordinal and currency pairs resolved with the closest date fallback
+        self.dependencies = dependencies
+        # per source, how each rate of its path was found (direct, inverse or closest_date), for metrics
+        self.kinds = kinds
 
 class ExchangeRateService:
     """Class that represents a service that provides exchange rates"""
-    def __init__(self):
+    def __init__(self, conversion_cache_size:int = 4096, path_cache_size:int = 4096, store:Optional[ExchangeRateStore] = None):
         self.exchange_rates = {}
-    
+        # Optional persistent storage, every rate added is written through to it
+        self.store = store
+        # Resolved conversions per (currency, target, day)
+        self.conversion_cache = ConversionCache(conversion_cache_size)
+        # Precomputed ConversionPaths per (target, day)
+        self.path_cache = ConversionCache(path_cache_size)
+
+        # Per currency pair index used for lookups, keyed by date ordinal so we
+        # don't need to build date strings on the hot path.
+        # Dict[(source, target), Dict[ordinal, ExchangeRate]]
+        self._rates_by_pair : Dict[Tuple[str, str], Dict[int, ExchangeRate]] = {}
+        # Dict[(source, target), sorted list of ordinals]
+        self._dates_by_pair : Dict[Tuple[str, str], List[int]] = {}
+        # Order in which each date was first seen, used to break ties in the closest date lookup
+        self._date_order : Dict[int, int] = {}
+
+        if self.store is not None:
+            # rate tables are small, so they are simply reloaded
+            for exchange_rate in self.store.iter_exchange_rates():
+                self._add_exchange_rate(exchange_rate)
+
     def add_exchange_rate(self, exchange_rate:ExchangeRate):
         """Add an exchange rate to the service"""
+        self.add_exchange_rates([exchange_rate])
+
+    def add_exchange_rates(self, exchange_rates:List[ExchangeRate]):
+        """Add a batch of exchange rates, written to the store in a single transaction"""
+        if self.store is not None:
+            self.store.add_exchange_rates(exchange_rates)
+        for exchange_rate in exchange_rates:
+            self._add_exchange_rate(exchange_rate)
+
+    def _add_exchange_rate(self, exchange_rate:ExchangeRate):
         date_str = exchange_rate.date.strftime("%Y-%m-%d")
         source_target = f"{exchange_rate.source}_{exchange_rate.target}"
         if date_str not in self.exchange_rates:
             self.exchange_rates[date_str] = {}
-        
+
         self.exchange_rates[date_str][source_target] = exchange_rate
-        print(f"Added [{date_str}][{source_target}] exchange rate= {exchange_rate}")
-    
+
+        ordinal = exchange_rate.date.toordinal()
+        pair = (exchange_rate.source, exchange_rate.target)
+        self._date_order.setdefault(ordinal, len(self._date_order))
+        if pair not in self._rates_by_pair:
+            # a new pair adds an edge to the graph of every day
+            self.conversion_cache.clear()
+            self.path_cache.clear()
+        else:
+            # the rates of this day change, and so can the closest date of this pair for any day
+            self.conversion_cache.invalidate([ordinal, pair])
+            self.path_cache.invalidate([ordinal, pair])
+        rates = self._rates_by_pair.setdefault(pair, {})
+        if ordinal not in rates:
+            bisect.insort(self._dates_by_pair.setdefault(pair, []), ordinal)
+        rates[ordinal] = exchange_rate
+        logger.debug("Added [%s][%s] exchange rate= %s", date_str, source_target, exchange_rate)
+
+    def iter_exchange_rates(self) -> Iterator[ExchangeRate]:
+        """Every rate in the service, grouped by the date they were first added"""
+        for rates in self.exchange_rates.values():
+            yield from rates.values()
+
+    def restore_snapshot(self, snapshot):
+        """Load the rates saved in a snapshot.Snapshot"""
+        for exchange_rate in snapshot.iter_exchange_rates():
+            self._add_exchange_rate(exchange_rate)
+
+    def precompute_paths(self, target:str = "EUR"):
+        """
+        Build the conversion paths to target for every day from the first to the last rate date,
+        both at midnight and with a time of day, since the closest date fallback rounds them differently.
+        Days outside that range are still resolved on their first conversion. The path cache grows
+        to hold the whole range, so the precomputed days never evict each other.
+        """
+        if not self._date_order:
+            return
+        first, last = min(self._date_order), max(self._date_order)
+        self.path_cache.maxsize = max(self.path_cache.maxsize, len(self.path_cache) + 2 * (last - first + 1))
+        for ordinal in range(first, last + 1):
+            for partial_day in (False, True):
+                self._get_conversion_paths(target, (ordinal, partial_day))
+
     def convert_to_eur(self, amount:float, currency:str, date:datetime) -> float:
         """Convert an amount from a currency to EUR based on the exchange rate of that date"""
         if currency == "EUR":
             return amount
-    
-        rate = self.get_exchange_rate(currency, "EUR", date)
-        if rate is not None:
-            return rate.convert(amount)
-        else:
-            #print(f"Could not convert {amount} {currency} to EUR on {date}. Trying hops.")
-            # it means we didn't find a direct rate so let's try transitive conversion
-            if currency == "USD":
-                # first fgo USD to GBP
-                rate1 = self.get_exchange_rate("USD", "GBP", date)
-                if rate1 is not None:
-                    amount_gbp = rate1.convert(amount)
-                    # then go GBP to EUR
-                    rate2 = self.get_exchange_rate("GBP", "EUR", date)
-                    if rate2 is not None:
-                        return rate2.convert(amount_gbp)
-            elif currency == "GBP":
-                # first go GBP to USD
-                rate1 = self.get_exchange_rate("GBP", "USD", date)
-                if rate1 is not None:
-                    amount_usd = rate1.convert(amount)
-                    # then go USD to EUR
-                    rate2 = self.get_exchange_rate("USD", "EUR", date)
-                    if rate2 is not None:
-                        return rate2.convert(amount_usd)
-            print(f"[FATAL]:Could not convert {amount} {currency} to EUR on {date}")
+
+        multiplier = self.get_conversion_multiplier(currency, "EUR", date)
+        if multiplier is None:
+            logger.error("Could not convert %s %s to EUR on %s", amount, currency, date)
             return None
+        return amount * multiplier
+
+    def get_conversion_multiplier(self, source:str, target:str, date:datetime) -> Optional[float]:
+        """
+        Get the factor that converts an amount from source to target on a date, fees included.
+        Returns None if there is no conversion path. Results are cached per (source, target, day).
+        """
+        # latency per lookup case, when metrics are enabled
+        timer = REGISTRY.stages("exchange_rate_service.conversion")
+        day = rate_day(date)
+        key = (source, target) + day
+        # (multiplier, how the rates of its path were found), or (None, None) without a path
+        cached = self.conversion_cache.get(key)
+        if cached is _MISSING:
+            conversion_paths = self._get_conversion_paths(target, day)
+            best = conversion_paths.paths.get(source)
+            cached = (best[0], conversion_paths.kinds[source]) if best is not None else (None, None)
+            self.conversion_cache.put(key, cached, conversion_paths.dependencies)
+            if timer:
+                # same names as the path counters of _count_conversion
+                timer.lap("no_path" if best is None else PATH_LENGTHS.get(len(best[1]) - 1, "multi_hop"))
+        elif timer:
+            timer.lap("cached")
+        multiplier, kinds = cached
+        if timer:
+            self._count_conversion(kinds)
+        return multiplier
+
+    @staticmethod
+    def _count_conversion(kinds:Optional[Tuple[str, ...]]):
+        """Count a conversion by path length, and each rate of its path by how it was found"""
+        if kinds is None:
+            REGISTRY.increment("exchange_rate_service.path.no_path")
+            return
+        REGISTRY.increment("exchange_rate_service.path." + PATH_LENGTHS.get(len(kinds), "multi_hop"))
+        for kind in kinds:
+            REGISTRY.increment("exchange_rate_service.rate." + kind)
+
+    def get_conversion_path(self, source:str, target:str, date:datetime) -> Optional[List[str]]:
+        """Get the currencies of the cheapest conversion path from source to target, or None if there is none"""
+        best = self._get_conversion_paths(target, rate_day(date)).paths.get(source)
+        return list(best[1]) if best is not None else None
+
+    def cache_info(self) -> Dict:
+        """Hit/miss counters of the conversion cache"""
+        return self.conversion_cache.info()
+
+    def _get_conversion_paths(self, target:str, day:RateDay) -> ConversionPaths:
+        key = (target,) + day
+        conversion_paths = self.path_cache.get(key)
+        if conversion_paths is _MISSING:
+            if REGISTRY.enabled:
+                REGISTRY.increment("exchange_rate_service.graphs_built")
+            graph, fallback_pairs = self._build_graph(day)
+            paths = graph.best_paths_to(target)
+            kinds = {source: tuple(graph.kinds[edge] for edge in zip(path, path[1:])) for source, (_, path) in paths.items()}
+            conversion_paths = ConversionPaths(paths, [day[0]] + fallback_pairs, kinds)
+            self.path_cache.put(key, conversion_paths, conversion_paths.dependencies)
+        return conversion_paths
+
+    def _build_graph(self, day:RateDay) -> Tuple[RateGraph, List[Tuple[str, str]]]:
+        """
+        Build the graph of a day with the same rules as get_exchange_rate for every pair and its inverse.
+        Also returns the pairs that were resolved with the closest date fallback.
+        """
+        graph = RateGraph()
+        fallback_pairs = []
+        for source, target in self._rates_by_pair:
+            for edge in ((source, target), (target, source)):
+                if edge in graph.edges:
+                    continue
+                rate, kind = self._find_rate(edge[0], edge[1], day)
+                if rate is None:
+                    continue
+                graph.add_edge(edge[0], edge[1], rate.convert(1.0), kind)
+                if kind == "closest_date":
+                    fallback_pairs.append(edge)
+        return graph, fallback_pairs
 
-    
     def get_exchange_rate(self, source:str, target:str, date:datetime) -> ExchangeRate:
         """
         Get exchange rate for a specific date, source and target currency.
         If a rate isn't available for the specific date, the closest one is returned.
         """
-        date_str = date.strftime("%Y-%m-%d")
-        source_target = f"{source}_{target}"
-        target_source = f"{target}_{source}" # For reverse rate
-        #print(f"Searching direct rate for {source_target} on {date_str} ")
-
         # Case 1
         # if source and target are the same, return a rate of 1 (no fee)
         if source == target:
-            #print(f"[case 1] : {source} == {target} so returning 1.0 (no fee)")
             return ExchangeRate(source, target, 1.0, 0.0, date)
-        
-        #print(f"[Case 2 checking] Trying to get exchange rate for {source} to {target} on {date_str}")
+        rate, _ = self._find_rate(source, target, rate_day(date))
+        return rate
+
+    def _find_rate(self, source:str, target:str, day:RateDay) -> Tuple[Optional[ExchangeRate], str]:
+        """Find the rate of a pair on a day. Also returns how it was found: direct, inverse, closest_date or missing."""
         # Case 2
         # if I have a direct rate, return it
-        if date_str in self.exchange_rates:
-            #print(f"We have exchange rates for {date_str}")
-            if source_target in self.exchange_rates[date_str]:
-                #print(f"[Case 2.1] : Found direct rate for {source_target} on {date_str} : {self.exchange_rates[date_str][source_target]}")
-                return self.exchange_rates[date_str][source_target]
-            elif target_source in self.exchange_rates[date_str]:
-                #print(f"[Case 2.2] : Found direct rate for {target_source} on {date_str} : {self.exchange_rates[date_str][target_source]}")
-                # Get the inverse rate
-                inverse_rate = self.exchange_rates[date_str][target_source]
-                # Create a new rate with inverted calculation
-                # For inverted rate: 
-                # - New rate is 1/old rate
-                # - Fee needs special handling since it applies before conversion
-                inverted_rate = 1 / inverse_rate.rate
-                # We'll use the same fee for simplicity
-                return ExchangeRate(source, target, inverted_rate, inverse_rate.fee, inverse_rate.date)
-            #print(f"[Case 2.3] : No direct rate for {source_target} or {target_source} on {date_str}")
-        
+        ordinal, partial_day = day
+        direct_rates = self._rates_by_pair.get((source, target))
+        if direct_rates is not None and ordinal in direct_rates:
+            return direct_rates[ordinal], "direct"
+        inverse_rates = self._rates_by_pair.get((target, source))
+        if inverse_rates is not None and ordinal in inverse_rates:
+            # Get the inverse rate
+            inverse_rate = inverse_rates[ordinal]
+            # Create a new rate with inverted calculation
+            # For inverted rate:
+            # - New rate is 1/old rate
+            # - Fee needs special handling since it applies before conversion
+            inverted_rate = 1 / inverse_rate.rate
+            # We'll use the same fee for simplicity
+            return ExchangeRate(source, target, inverted_rate, inverse_rate.fee, inverse_rate.date), "inverse"
+
         # Case 3
         # what if I have no data for the specific date?
         # I could return the latest rate available
-        closest_date = None
-        for d in self.exchange_rates:
-            d_date = datetime.strptime(d, "%Y-%m-%d")
-            if source_target in self.exchange_rates[d]:
-                if closest_date is None or abs((d_date - date).days) < abs((datetime.strptime(closest_date, "%Y-%m-%d") - date).days):
-                    closest_date = d
-        
-        if closest_date is not None:
-            return self.exchange_rates[closest_date][source_target]
-        #print(f"[Case 3] : No exchange rate found for {source} to {target} on {date_str}")
-        return None
+        if direct_rates is None:
+            return None, "missing"
+        closest_date = self._closest_date(self._dates_by_pair[(source, target)], ordinal, partial_day)
+        return direct_rates[closest_date], "closest_date"
 
+    def _closest_date(self, dates:List[int], ordinal:int, partial_day:bool) -> int:
+        """
+        Binary search the sorted ordinals of a pair for the one closest to a day. O(log d)
+        Distances are whole days as given by timedelta.days, so a partial day is
+        rounded down, and ties go to the date that was added to the service first.
+        """
+        # (d - date).days == d - ordinal - 1 when date has a time component
+        target = ordinal + (1 if partial_day else 0)
+        i = bisect.bisect_left(dates, target)
+        if i == len(dates):
+            return dates[-1]
+        if i == 0 or dates[i] == target:
+            return dates[i]
+        before, after = dates[i - 1], dates[i]
+        if target - before != after - target:
+            return before if target - before < after - target else after
+        return min(before, after, key=self._date_order.get)
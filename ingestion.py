@@ -0,0 +1,166 @@
+from models import Donation
+from donation_service import DonationService
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_BATCH_SIZE = 1_000
+# Number of recent acknowledgements kept for the latency percentiles
+LATENCY_SAMPLES = 4096
+
+class AsyncIngestor:
+    """
+    asyncio front end for DonationService, for many concurrent submissions.
+    Submissions go through a bounded queue, so producers wait when the service falls
+    behind instead of growing memory. A single writer task drains the queue in micro-batches
+    through DonationService.add_donations, which resolves conversions once per batch and
+    is the only code touching the service, so its counters stay consistent. Batches are
+    added in a worker thread, so store writes don't block the event loop.
+    """
+    def __init__(self, donation_service:DonationService, max_queue_size:int = DEFAULT_QUEUE_SIZE,
+                 max_batch_size:int = DEFAULT_BATCH_SIZE):
+        if max_queue_size < 1 or max_batch_size < 1:
+            raise ValueError("max_queue_size and max_batch_size must be positive")
+        self.donation_service = donation_service
+        self.max_batch_size = max_batch_size
+        # items are (donation, acknowledgement future, time enqueued), None stops the writer
+        self._queue : asyncio.Queue = asyncio.Queue(max_queue_size)
+        self._writer : Optional[asyncio.Task] = None
+
+        self.submitted = 0
+        self.ingested = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        """Start the writer task, on the running event loop"""
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Ingest everything already queued, then stop the writer task"""
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        stop = asyncio.ensure_future(self._queue.put(None))
+        # a writer that died can't make room in a full queue
+        await asyncio.wait((stop, writer), return_when=asyncio.FIRST_COMPLETED)
+        try:
+            await writer
+        finally:
+            stop.cancel()
+            self._fail_queued(RuntimeError("The ingestor stopped before the donation was ingested"))
+
+    async def __aenter__(self) -> 'AsyncIngestor':
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def enqueue(self, donation:Donation) -> asyncio.Future:
+        """
+        Queue a donation, waiting while the queue is full.
+        Returns a future resolved with the donation once it is ingested, or with the
+        ValueError raised if it can't be converted.
+        """
+        if self._writer is None:
+            raise RuntimeError("The ingestor isn't started")
+        acknowledgement = asyncio.get_running_loop().create_future()
+        await self._queue.put((donation, acknowledgement, time.perf_counter()))
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return acknowledgement
+
+    async def submit(self, donation:Donation) -> Donation:
+        """Queue a donation and wait until it is ingested"""
+        return await (await self.enqueue(donation))
+
+    def metrics(self) -> Dict[str, float]:
+        """Queue depth, throughput counters and acknowledgement latencies in seconds"""
+        latencies = sorted(self._latencies)
+        def percentile(p:float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_capacity": self._queue.maxsize,
+            "submitted": self.submitted,
+            "ingested": self.ingested,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": (self.ingested + self.failed) / self.batches if self.batches else 0.0,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            batch : List[Tuple[Donation, asyncio.Future, float]] = []
+            # take whatever else is already waiting, up to a batch
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+            if batch:
+                await self._ingest(batch)
+                # let producers blocked on a full queue and waiting acknowledgements run
+                await asyncio.sleep(0)
+
+    async def _ingest(self, batch:List[Tuple[Donation, asyncio.Future, float]]):
+        self.batches += 1
+        try:
+            errors = await asyncio.to_thread(self._add, [donation for donation, _, _ in batch])
+        except Exception as error:
+            # e.g. the store failed, every donation of the batch is rejected and the writer goes on
+            errors = [error] * len(batch)
+
+        now = time.perf_counter()
+        for (donation, acknowledgement, enqueued), error in zip(batch, errors):
+            self._latencies.append(now - enqueued)
+            if error is None:
+                self.ingested += 1
+                if not acknowledgement.done():
+                    acknowledgement.set_result(donation)
+            else:
+                self.failed += 1
+                logger.warning("Rejected donation %s: %s", donation, error)
+                if not acknowledgement.done():
+                    acknowledgement.set_exception(error)
+        logger.debug("Ingested a batch of %d donations, %d queued", len(batch), self._queue.qsize())
+
+    def _add(self, donations:List[Donation]) -> List[Optional[Exception]]:
+        """Add a batch to the service, in the worker thread. Returns the error of each donation, or None."""
+        try:
+            self.donation_service.add_donations(donations)
+            return [None] * len(donations)
+        except ValueError:
+            # the batch is all or nothing, add one by one to find which donations failed
+            errors = []
+            for donation in donations:
+                try:
+                    self.donation_service.add_donation(donation)
+                    errors.append(None)
+                except ValueError as error:
+                    errors.append(error)
+            return errors
+
+    def _fail_queued(self, error:Exception):
+        """Reject the donations left in the queue"""
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and not item[1].done():
+                self.failed += 1
+                item[1].set_exception(error)
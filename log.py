@@ -0,0 +1,37 @@
+import logging
+import sys
+from typing import Optional, TextIO
+
+# Every module logs through logging.getLogger(__name__). Messages use %-style arguments
+# so nothing is formatted unless the level is enabled.
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+class SampleFilter(logging.Filter):
+    """Let through only one in every `every` DEBUG records. Records above DEBUG always pass."""
+    def __init__(self, every:int):
+        super().__init__()
+        if every < 1:
+            raise ValueError(f"every must be positive, got {every}")
+        self.every = every
+        self._seen = 0
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        self._seen += 1
+        return (self._seen - 1) % self.every == 0
+
+def configure_logging(level:int = logging.WARNING, sample_every:int = 1, stream:Optional[TextIO] = None) -> logging.Handler:
+    """
+    Send log records of level and above to stream (stderr by default).
+    With sample_every > 1 only one in every sample_every DEBUG records is written.
+    Returns the installed handler.
+    """
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if sample_every > 1:
+        handler.addFilter(SampleFilter(sample_every))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    return handler
@@ -2,15 +2,51 @@ import csv
 from datetime import datetime, timedelta
 import re
 from models import Donation, ExchangeRate
-from exchange_rate_service import ExchangeRateService
+from exchange_rate_service import ExchangeRateService, rate_day
 from donation_service import DonationService
 from api import Api
-from typing import List
+from storage import SqliteStore
+from donation_log import DonationLog
+from snapshot import Snapshot, save_snapshot
+from metrics import REGISTRY, capture
+from server import serve
+from sharding import ShardedDonationService
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from itertools import islice
+import time
+import argparse
+import atexit
+import multiprocessing
+import os
+import sys
+import logging
+from log import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Number of rows handed to the services at once when streaming CSV files
+DEFAULT_CHUNK_SIZE = 10_000
+
+# Fixed UTC offsets in hours of the supported timezones
+TIMEZONE_OFFSETS = {
+    "EST": -5,  # Eastern Standard Time is UTC-5
+    "CET": 1,   # Central European Time is UTC+1
+    "GMT": 0,   # Greenwich Mean Time is UTC
+}
+MONTHS = {month: i for i, month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
+TIMEZONE_PATTERN = re.compile(r'(EST|GMT|CET)$')
 
 class DataLoader:
     @staticmethod
     def parse_date(date_str:str)->datetime:
         """Parse date string in format '21 Jan 2023' to datetime object"""
+        parts = date_str.split(" ")
+        if len(parts) == 3 and parts[1] in MONTHS and (parts[0] + parts[2]).isdigit():
+            try:
+                return datetime(int(parts[2]), MONTHS[parts[1]], int(parts[0]))
+            except ValueError:
+                pass
         return datetime.strptime(date_str, "%d %b %Y")
 
     @staticmethod
@@ -20,77 +56,323 @@ class DataLoader:
         Handles formats like '21 Jan 2023 10:15 EST'
         Supports EST, CET, and GMT timezones
         """
+        utc_timestamp = DataLoader._parse_fixed_layout_timestamp(timestamp_str)
+        if utc_timestamp is None:
+            utc_timestamp = DataLoader._parse_timestamp_strptime(timestamp_str)
+        logger.debug("Converted %s to UTC: %s", timestamp_str, utc_timestamp)
+        return utc_timestamp
+
+    @staticmethod
+    def _parse_fixed_layout_timestamp(timestamp_str:str)->Optional[datetime]:
+        """
+        Fast path for the exact 'DD Mon YYYY HH:MM TZ' layout, without regexes or strptime.
+        Returns None if the string doesn't follow that layout.
+        """
+        parts = timestamp_str.split(" ")
+        if len(parts) != 5 or parts[1] not in MONTHS or parts[4] not in TIMEZONE_OFFSETS:
+            return None
+        hour_minute = parts[3].split(":")
+        if len(hour_minute) != 2 or not (parts[0] + parts[2] + hour_minute[0] + hour_minute[1]).isdigit():
+            return None
+        try:
+            timestamp = datetime(int(parts[2]), MONTHS[parts[1]], int(parts[0]), int(hour_minute[0]), int(hour_minute[1]))
+        except ValueError:
+            return None
+        return timestamp - timedelta(hours=TIMEZONE_OFFSETS[parts[4]])
+
+    @staticmethod
+    def _parse_timestamp_strptime(timestamp_str:str)->datetime:
+        """Slow path that handles any layout strptime accepts, with an optional timezone at the end"""
         # Extract timezone if present
-        timezone_pattern = r'(EST|GMT|CET)$'
-        timezone_match = re.search(timezone_pattern, timestamp_str)
+        timezone_match = TIMEZONE_PATTERN.search(timestamp_str)
         timezone = timezone_match.group(1) if timezone_match else None
-    
+
         # Remove timezone from string for parsing
-        timestamp_clean = re.sub(timezone_pattern, '', timestamp_str).strip()
+        timestamp_clean = TIMEZONE_PATTERN.sub('', timestamp_str).strip()
         timestamp = datetime.strptime(timestamp_clean, "%d %b %Y %H:%M")
-    
-        # Convert to UTC based on timezone
-        if timezone == "EST":  # Eastern Standard Time is UTC-5
-            utc_offset_hours = -5
-        elif timezone == "CET":  # Central European Time is UTC+1
-            utc_offset_hours = 1
-        elif timezone == "GMT":  # Greenwich Mean Time is UTC
-            utc_offset_hours = 0
-        else:
-            utc_offset_hours = 0  # Default to UTC if no timezone
-    
+
+        # Convert to UTC based on timezone, default to UTC if no timezone
+        utc_offset_hours = TIMEZONE_OFFSETS.get(timezone, 0)
+
         # Use timedelta to correctly handle date rollovers
-        utc_timestamp = timestamp + timedelta(hours=-utc_offset_hours)
-    
-        print(f"Converted {timestamp_str} ({timestamp}) to UTC: {utc_timestamp}")
-        return utc_timestamp
+        return timestamp + timedelta(hours=-utc_offset_hours)
+
+    @staticmethod
+    def iter_csv_rows(file_path:str, offset:int = 0, end:Optional[int] = None)->Iterator[Dict[str, str]]:
+        """
+        Stream the rows of a CSV file as dicts, starting at byte offset (0 or the offset
+        of a line start) and stopping at byte end. The header is always read from the top,
+        so a file can be resumed from where a previous load stopped.
+        """
+        with open(file_path, 'rb') as f:
+            fieldnames = next(csv.reader([f.readline().decode('utf-8')]))
+            f.seek(max(offset, f.tell()))
+            position = f.tell()
+            while end is None or position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                text = line.decode('utf-8')
+                if not text.strip():
+                    continue
+                # only go through the csv module when a field is quoted
+                values = next(csv.reader([text])) if '"' in text else text.rstrip('\r\n').split(',')
+                yield dict(zip(fieldnames, values))
+
+    @staticmethod
+    def iter_exchange_rates(file_path:str, offset:int = 0, end:Optional[int] = None)->Iterator[ExchangeRate]:
+        """Stream exchange rates from CSV file, one row at a time"""
+        for row in DataLoader.iter_csv_rows(file_path, offset, end):
+            source = row['source']
+            target = row['target']
+            rate = float(row['rate'])
+            fee = float(row['fee'])
+            date = DataLoader.parse_date(row['date'])
+            yield ExchangeRate(source, target, rate, fee, date)
+
+    @staticmethod
+    def iter_donations(file_path:str, offset:int = 0, end:Optional[int] = None)->Iterator[Donation]:
+        """Stream donations from CSV file, one row at a time"""
+        for row in DataLoader.iter_csv_rows(file_path, offset, end):
+            donator = row['donator']
+            amount = row['amount']
+            charity = row['charity']
+            timestamp = DataLoader.parse_timestamp(row['timestamp'])
+            yield Donation(donator, amount, charity, timestamp)
 
     @staticmethod
     def load_exchange_rates(file_path:str)->List[ExchangeRate]:
         """Load exchange rates from CSV file"""
-        exchange_rates = []
-        with open(file_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                source = row['source']
-                target = row['target']
-                rate = float(row['rate'])
-                fee = float(row['fee'])
-                date = DataLoader.parse_date(row['date'])
-                exchange_rates.append(ExchangeRate(source, target, rate, fee, date))
-        return exchange_rates
+        return list(DataLoader.iter_exchange_rates(file_path))
 
     @staticmethod
     def load_donations(file_path:str)->List[Donation]:
         """Load donations from CSV file"""
-        donations = []
-        with open(file_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                donator = row['donator']
-                amount = row['amount']
-                charity = row['charity']
-                timestamp = DataLoader.parse_timestamp(row['timestamp'])
-                donations.append(Donation(donator, amount, charity, timestamp))
-        return donations
-
-def main():
+        return list(DataLoader.iter_donations(file_path))
+
+    @staticmethod
+    def stream_exchange_rates(file_path:str, exchange_rate_service:ExchangeRateService, chunk_size:int = DEFAULT_CHUNK_SIZE,
+                              offset:int = 0, end:Optional[int] = None)->int:
+        """
+        Stream exchange rates from CSV file straight into the service without building a list.
+        Reports progress every chunk_size rows. Returns the number of rows loaded.
+        """
+        return DataLoader._stream(DataLoader.iter_exchange_rates(file_path, offset, end), exchange_rate_service.add_exchange_rates, chunk_size, "exchange rates")
+
+    @staticmethod
+    def stream_donations(file_path:str, donation_service:DonationService, chunk_size:int = DEFAULT_CHUNK_SIZE,
+                         offset:int = 0, end:Optional[int] = None)->int:
+        """
+        Stream donations from CSV file into the service in chunks of chunk_size rows,
+        so memory used by the loader doesn't grow with the file size.
+        Reports progress every chunk. Returns the number of rows loaded.
+        """
+        return DataLoader._stream(DataLoader.iter_donations(file_path, offset, end), donation_service.add_donations, chunk_size, "donations")
+
+    @staticmethod
+    def _stream(rows:Iterator, add_chunk:Callable[[List], object], chunk_size:int, name:str)->int:
+        """Feed rows to add_chunk in chunks of chunk_size rows and report rows/sec as we go"""
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        started = time.perf_counter()
+        loaded = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            add_chunk(chunk)
+            loaded += len(chunk)
+            elapsed = time.perf_counter() - started
+            logger.info("Loaded %d %s (%.0f rows/sec)", loaded, name, loaded / elapsed if elapsed > 0 else 0)
+        return loaded
+
+    @staticmethod
+    def split_byte_ranges(file_path:str, parts:int)->List[Tuple[int, int]]:
+        """
+        Split the rows of a CSV file in up to parts (start, end) byte ranges of about the same
+        size. Every range starts at the start of a line, and the header is never in one.
+        """
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            f.readline()
+            bounds = [f.tell()]
+            for i in range(1, parts):
+                target = bounds[0] + (size - bounds[0]) * i // parts
+                if target <= bounds[-1]:
+                    continue
+                # the line holding the byte before target ends where the next range starts
+                f.seek(target - 1)
+                f.readline()
+                if f.tell() >= size:
+                    break
+                if f.tell() > bounds[-1]:
+                    bounds.append(f.tell())
+        bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    @staticmethod
+    def load_donations_parallel(file_path:str, donation_service:DonationService, workers:Optional[int] = None,
+                                ranges_per_worker:int = 4)->int:
+        """
+        Load donations with a pool of worker processes, for files where parsing and conversion
+        bound a single core. The file is split in byte ranges on line boundaries, each worker
+        parses and converts its ranges against a read-only copy of the exchange rate service and
+        aggregates them per charity and per donator, and the parent merges the ranges in file order
+        through DonationService.add_aggregated. Returns the number of rows loaded.
+        """
+        workers = workers or os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError(f"workers must be positive, got {workers}")
+        # more ranges than workers, so a slow range doesn't leave the other workers idle
+        tasks = [(file_path, start, end) for start, end in DataLoader.split_byte_ranges(file_path, workers * ranges_per_worker)]
+        started = time.perf_counter()
+        loaded = 0
+        # the rates rather than the service, which can hold a store connection that can't be pickled
+        exchange_rates = list(donation_service.exchange_rate_service.iter_exchange_rates())
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(exchange_rates,)) as pool:
+            # imap keeps file order while later ranges are still being parsed
+            for records, charity_totals, donator_totals in pool.imap(_load_donation_range, tasks):
+                donations = [Donation.from_record(*record) for record in records]
+                loaded += donation_service.add_aggregated(donations, charity_totals, donator_totals)
+                elapsed = time.perf_counter() - started
+                logger.info("Loaded %d donations with %d workers (%.0f rows/sec)", loaded, workers, loaded / elapsed if elapsed > 0 else 0)
+        return loaded
+
+# Exchange rate service of a load_donations_parallel worker process, set once by _init_worker
+_worker_exchange_rate_service : Optional[ExchangeRateService] = None
+
+def _init_worker(exchange_rates:List[ExchangeRate]):
+    global _worker_exchange_rate_service
+    _worker_exchange_rate_service = ExchangeRateService()
+    _worker_exchange_rate_service.add_exchange_rates(exchange_rates)
+
+def _load_donation_range(task:Tuple[str, int, int]):
+    """
+    Parse and convert the donations of one byte range in a worker process.
+    Returns them as from_record tuples, with their (total, count) per charity and per donator.
+    """
+    file_path, start, end = task
+    multipliers = {}
+    records = []
+    charity_totals : Dict[str, List] = {}
+    donator_totals : Dict[str, List] = {}
+    for donation in DataLoader.iter_donations(file_path, start, end):
+        amount_eur = donation.amount_eur
+        if amount_eur is None:
+            # resolved once per (currency, day), like DonationService.add_donations
+            key = (donation.currency,) + rate_day(donation.timestamp)
+            multiplier = multipliers.get(key)
+            if multiplier is None:
+                multiplier = multipliers[key] = _worker_exchange_rate_service.get_conversion_multiplier(donation.currency, "EUR", donation.timestamp)
+                if multiplier is None:
+                    raise ValueError(f"No exchange rate available for {donation.currency} to EUR at {donation.timestamp})")
+            amount_eur = donation.amount * multiplier
+        records.append((donation.donator, donation.charity, donation.timestamp, donation.currency, donation.amount, amount_eur))
+        for totals, name in ((charity_totals, donation.charity), (donator_totals, donation.donator)):
+            entry = totals.get(name)
+            if entry is None:
+                entry = totals[name] = [0.0, 0]
+            entry[0] += amount_eur
+            entry[1] += 1
+    return records, {name: tuple(entry) for name, entry in charity_totals.items()}, {name: tuple(entry) for name, entry in donator_totals.items()}
+
+def parse_args(argv:Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Charity Crowdfunding Transaction System")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Log records below this level are dropped before being formatted")
+    parser.add_argument("--debug-sample", type=int, default=1, metavar="N",
+                        help="With --log-level DEBUG, only write one in every N debug records")
+    parser.add_argument("--db", metavar="PATH",
+                        help="Persist to this SQLite database. CSV files are only loaded into an empty database")
+    parser.add_argument("--donation-log", metavar="PATH",
+                        help="Keep donations in this append-only binary log, read through mmap. donations.csv is only loaded into an empty log")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="Parse and convert donations.csv with N worker processes")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="Restore from this snapshot file if it exists, only load what was appended to the CSV files since, "
+                             "and save the new state to it on exit")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Count lookups and time every stage of ingestion and every API call, and print a report to stderr at exit")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Run the CSV loading under cProfile, save the stats to PATH and print the top functions to stderr")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Trace allocations while the CSV files load and print the top allocating lines and the peak to stderr")
+    parser.add_argument("--shards", type=int, default=1, metavar="N",
+                        help="Partition donations by charity across N worker processes, each with its own DonationService")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="After loading, serve the API over HTTP until interrupted, instead of printing the sample results")
+    return parser.parse_args(argv)
+
+def main(argv:Optional[List[str]] = None):
+    args = parse_args(argv)
+    configure_logging(getattr(logging, args.log_level), args.debug_sample)
+
+    if sum(bool(option) for option in (args.db, args.donation_log, args.snapshot)) > 1:
+        raise SystemExit("--db, --donation-log and --snapshot can't be used together")
+    if args.shards > 1 and (args.db or args.donation_log or args.snapshot or args.workers > 1):
+        raise SystemExit("--shards can't be used with --db, --donation-log, --snapshot or --workers")
+    if args.metrics:
+        REGISTRY.enable()
+        atexit.register(lambda: sys.stderr.write(REGISTRY.format_report()))
+
     # Initialize services
-    exchange_rate_service = ExchangeRateService()
-    donation_service = DonationService(exchange_rate_service)
-    
-    # Load exchange rates
-    exchange_rates = DataLoader.load_exchange_rates('exchange_rates.csv')
-    for rate in exchange_rates:
-        exchange_rate_service.add_exchange_rate(rate)
-    
-    # Load donations
-    donations = DataLoader.load_donations('donations.csv')
-    for donation in donations:
-        donation_service.add_donation(donation)
+    store = SqliteStore(args.db) if args.db else None
+    exchange_rate_service = ExchangeRateService(store=store)
+    donation_store = DonationLog(args.donation_log) if args.donation_log else store
+    if args.shards > 1:
+        donation_service = ShardedDonationService(exchange_rate_service, args.shards)
+        atexit.register(donation_service.close)
+    else:
+        donation_service = DonationService(exchange_rate_service, store=donation_store)
+
+    # Warm restart: restore the snapshot and only read the tails of the CSV files
+    rates_offset = donations_offset = 0
+    snapshot = None
+    if args.snapshot and os.path.exists(args.snapshot):
+        try:
+            snapshot = Snapshot(args.snapshot)
+        except ValueError as e:
+            # e.g. saved by an older version, it is overwritten on exit
+            logger.warning("Ignoring %s: %s", args.snapshot, e)
+    if snapshot is not None:
+        rates_offset = snapshot.source_offset("exchange_rates", 'exchange_rates.csv')
+        donations_offset = snapshot.source_offset("donations", 'donations.csv')
+        if donations_offset or not snapshot.donations:
+            exchange_rate_service.restore_snapshot(snapshot)
+            donation_service.restore_snapshot(snapshot)
+            logger.info("Restored %d donations from %s", len(snapshot.donations), args.snapshot)
+        else:
+            # donations.csv was rewritten, replaying it on top of the snapshot would count donations twice
+            logger.info("donations.csv changed since %s was saved, loading from scratch", args.snapshot)
+            rates_offset = 0
+    rates_end = os.path.getsize('exchange_rates.csv')
+    donations_end = os.path.getsize('donations.csv')
+
+    # a no-op unless --profile or --trace-memory is set
+    with capture(args.profile, args.trace_memory):
+        # Load exchange rates
+        if store is None or store.get_exchange_rate_count() == 0:
+            DataLoader.stream_exchange_rates('exchange_rates.csv', exchange_rate_service, offset=rates_offset, end=rates_end)
+        exchange_rate_service.precompute_paths("EUR")
+
+        # Load donations
+        if donation_store is None or donation_store.get_donation_count() == 0:
+            if args.workers > 1 and donations_offset == 0:
+                DataLoader.load_donations_parallel('donations.csv', donation_service, args.workers)
+            else:
+                DataLoader.stream_donations('donations.csv', donation_service, offset=donations_offset, end=donations_end)
+
+    if args.snapshot:
+        save_snapshot(args.snapshot, donation_service, {"exchange_rates": ('exchange_rates.csv', rates_end),
+                                                        "donations": ('donations.csv', donations_end)})
     
     # Create API and use it
     api = Api(donation_service)
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        serve(api, host or "127.0.0.1", int(port))
+        return
     print("\n=== API Results ===")
     print(f"Most generous donator: {api.get_most_generous_donator()}")
     print(f"Total donations: {api.get_running_totals_for_all_charities()}")
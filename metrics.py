@@ -0,0 +1,179 @@
+import cProfile
+import functools
+import io
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, TextIO, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+# Histogram buckets are powers of two microseconds: bucket i holds durations below 2**i us
+BUCKETS = 40
+
+class Histogram:
+    """Latency histogram with power of two buckets. Count, total, min and max are exact, percentiles are bucket upper bounds."""
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def observe(self, seconds:float):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+
+    def percentile(self, fraction:float) -> float:
+        """Upper bound in seconds of the bucket holding the given fraction of the observations"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(self.max, 2 ** i / 1e6)
+        return self.max
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "p50_us": self.percentile(0.5) * 1e6,
+            "p99_us": self.percentile(0.99) * 1e6,
+            "max_us": self.max * 1e6,
+        }
+
+class Stages:
+    """Times the consecutive stages of one call: each lap records the time since the previous one"""
+    __slots__ = ("registry", "prefix", "last")
+
+    def __init__(self, registry:'MetricsRegistry', prefix:str):
+        self.registry = registry
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def lap(self, stage:str):
+        now = time.perf_counter()
+        self.registry.observe(f"{self.prefix}.{stage}", now - self.last)
+        self.last = now
+
+class MetricsRegistry:
+    """
+    Named counters and latency histograms, disabled by default. Hot paths check enabled
+    before doing anything, so a disabled registry costs an attribute lookup per call site.
+    Updates aren't locked: with several threads, counts can be slightly off.
+    """
+    def __init__(self, enabled:bool = False):
+        self.enabled = enabled
+        self.counters : Dict[str, int] = {}
+        self.histograms : Dict[str, Histogram] = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name:str, amount:int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name:str, seconds:float):
+        if self.enabled:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def stages(self, prefix:str) -> Optional[Stages]:
+        """A Stages timer for one call, or None when disabled so call sites can skip their laps"""
+        return Stages(self, prefix) if self.enabled else None
+
+    def timed(self, name:Optional[str] = None) -> Callable[[F], F]:
+        """Decorator recording the latency of every call in a histogram named after the function, when enabled"""
+        def decorator(function:F) -> F:
+            histogram_name = name or f"{function.__module__}.{function.__qualname__}"
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                began = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(histogram_name, time.perf_counter() - began)
+            return wrapper
+        return decorator
+
+    def report(self) -> Dict:
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "histograms": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = ["=== Metrics ==="]
+        if report["counters"]:
+            width = max(len(name) for name in report["counters"])
+            lines += [f"{name:<{width}} {value:>12,}" for name, value in report["counters"].items()]
+        if report["histograms"]:
+            width = max(len(name) for name in report["histograms"])
+            lines.append(f"{'latency':<{width}} {'count':>10} {'total ms':>10} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}")
+            for name, s in report["histograms"].items():
+                lines.append(f"{name:<{width}} {s['count']:>10,} {s['total_ms']:>10,.1f} {s['mean_us']:>10,.1f} "
+                             f"{s['p50_us']:>10,.0f} {s['p99_us']:>10,.0f} {s['max_us']:>10,.0f}")
+        return "\n".join(lines) + "\n"
+
+# The registry the services and the Api report to
+REGISTRY = MetricsRegistry()
+timed = REGISTRY.timed
+
+@contextmanager
+def capture(profile_path:Optional[str] = None, trace_memory:bool = False, top:int = 20, stream:Optional[TextIO] = None) -> Iterator[None]:
+    """
+    Profile a block, e.g. an ingestion run. With profile_path, the block runs under cProfile,
+    the stats are saved there (readable with pstats or snakeviz) and the top functions by
+    cumulative time are written to stream. With trace_memory, the lines that allocated the
+    most memory still held at the end, and the peak, are written to stream (stderr by default).
+    """
+    stream = stream if stream is not None else sys.stderr
+    profiler = cProfile.Profile() if profile_path else None
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+            stream.write(f"=== Profile (saved to {profile_path}) ===\n{output.getvalue()}")
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            stream.write(f"=== Memory (peak {peak / 2 ** 20:.1f} MiB) ===\n")
+            for statistic in snapshot.statistics("lineno")[:top]:
+                stream.write(f"{statistic}\n")
@@ -1,8 +1,15 @@
 from datetime import datetime
+from typing import List
+import logging
 import re
+import sys
+
+logger = logging.getLogger(__name__)
 
 class ExchangeRate:
     """Class the represents a currency exchnage rate at a specific date"""
+    __slots__ = ("source", "target", "rate", "fee", "date")
+
     def __init__(self, source:str, target:str, rate:float, fee:float, date:datetime):
         self.source : str = source
         self.target : str = target
@@ -17,34 +24,35 @@ class ExchangeRate:
     def __repr__(self):
         return f"ExchangeRate({self.source}_{self.target}, {self.rate}, {self.fee}%, {self.date})"
     
+# Map currency symbol to currency code
+CURRENCY_SYMBOLS = {
+    '$': 'USD',
+    '£': 'GBP',
+    '€': 'EUR'
+}
+CURRENCY_PATTERN = re.compile(r'^([£$€])(\d+(\.\d+)?)$')
+NUMERIC_PATTERN = re.compile(r'(\d+(\.\d+)?)')
+
 class Donation:
     """A class representing a donation."""
+    # Donations are the bulk of what we keep in memory, so no per instance __dict__
+    __slots__ = ("donator", "charity", "timestamp", "currency", "amount", "amount_eur")
+
     def __init__(self, donator:str, amount:str, charity:str, timestamp:datetime):
-        self.donator : str = donator
-        self.charity : str = charity
+        # names repeat across many donations, interning keeps a single copy of each
+        self.donator : str = sys.intern(donator)
+        self.charity : str = sys.intern(charity)
         self.timestamp : datetime = timestamp
 
         # Parse amount string to extract currency and amount
-        currency_pattern = r'^([£$€])(\d+(\.\d+)?)$'
-        match = re.match(currency_pattern, amount)
+        match = CURRENCY_PATTERN.match(amount)
 
         if match:
-            currency_symbol = match.group(1)
-            amount_value = match.group(2)
-            
-            # Map currency symbol to currency code
-            currency_map = {
-                '$': 'USD',
-                '£': 'GBP',
-                '€': 'EUR'
-            }
-            
-            self.currency = currency_map.get(currency_symbol, 'USD')
-            self.amount = float(amount_value)
+            self.currency = CURRENCY_SYMBOLS[match.group(1)]
+            self.amount = float(match.group(2))
         else:
             # If no match, try to extract numeric value and assume USD
-            numeric_pattern = r'(\d+(\.\d+)?)'
-            num_match = re.search(numeric_pattern, amount)
+            num_match = NUMERIC_PATTERN.search(amount)
             
             if num_match:
                 self.amount = float(num_match.group(1))
@@ -54,6 +62,18 @@ class Donation:
         # will be updated from add_donation if we are not in EUR
         self.amount_eur : float|None = None if self.currency != 'EUR' else self.amount 
     
+    @classmethod
+    def from_record(cls, donator:str, charity:str, timestamp:datetime, currency:str, amount:float, amount_eur:float) -> 'Donation':
+        """Rebuild an already parsed and converted donation, e.g. when reading it back from storage"""
+        donation = cls.__new__(cls)
+        donation.donator = sys.intern(donator)
+        donation.charity = sys.intern(charity)
+        donation.timestamp = timestamp
+        donation.currency = currency
+        donation.amount = amount
+        donation.amount_eur = amount_eur
+        return donation
+
     def __repr__(self):
         if self.amount_eur is not None:
             return f"Donation({self.donator}, {self.amount} {self.currency} ({self.amount_eur} EUR), {self.charity}, {self.timestamp})"
@@ -62,6 +82,8 @@ class Donation:
         
 class Charity:
     """A class representing a charity."""
+    __slots__ = ("name", "total_donations", "donations")
+
     def __init__(self, name:str):
         self.name : str = name
         self.total_donations : float = 0
@@ -70,13 +92,24 @@ class Charity:
     def add_donation(self, donation:Donation):
         self.donations.append(donation)
         self.total_donations += donation.amount_eur
-        print(f"Total donations for {self.name}({len(self.donations)}): {self.total_donations}")
+        logger.debug("Total donations for %s(%d): %s", self.name, len(self.donations), self.total_donations)
+
+    def add_donations(self, donations:List[Donation], total:float = None):
+        """Add a batch of donations to this charity. total is their sum in EUR if it is already known."""
+        self.donations.extend(donations)
+        self.total_donations += sum(donation.amount_eur for donation in donations) if total is None else total
+
+    def add_total(self, total:float) -> None:
+        """Add donations kept elsewhere, e.g. in a store, by their sum in EUR"""
+        self.total_donations += total
     
     def __repr__(self):
         return f"Charity({self.name}, {self.total_donations})"
 
 class Donator:
     """Represents a donator with a running total of donations."""
+    __slots__ = ("donator_id", "total_eur", "donation_count")
+
     def __init__(self, donator_id: str):
         self.donator_id = donator_id
         self.total_eur : float = 0
@@ -86,6 +119,16 @@ class Donator:
         """Add a donation from this donator and update the running total."""
         self.total_eur += donation.amount_eur
         self.donation_count += 1
+
+    def add_donations(self, donations:List['Donation']) -> None:
+        """Add a batch of donations from this donator."""
+        self.total_eur += sum(donation.amount_eur for donation in donations)
+        self.donation_count += len(donations)
+
+    def add_total(self, total_eur:float, count:int) -> None:
+        """Add count donations summing to total_eur, aggregated elsewhere."""
+        self.total_eur += total_eur
+        self.donation_count += count
     
     def __repr__(self):
         return f"Donator({self.donator_id}, {self.total_eur} EUR, {self.donation_count} donations)"
@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+import heapq
+import itertools
+
+class RankedIndex:
+    """
+    Indexed binary max-heap of keys ordered by score, for leaderboards.
+    Setting the score of a key is O(log n) (increase and decrease key), and the top k
+    keys are read in O(k log k) without sorting everything. Ties go to the key added first.
+    """
+    def __init__(self):
+        # heap of (score, -insertion order), with the key at the same position in _keys
+        self._priorities : List[Tuple[float, int]] = []
+        self._keys : List[Hashable] = []
+        self._positions : Dict[Hashable, int] = {}
+        self._added = 0
+
+    def update(self, key:Hashable, score:float):
+        """Set the score of key, adding it if it isn't ranked yet. O(log n)"""
+        position = self._positions.get(key)
+        if position is None:
+            self._priorities.append((score, -self._added))
+            self._keys.append(key)
+            self._added += 1
+            position = self._positions[key] = len(self._keys) - 1
+            self._sift_up(position)
+            return
+        old = self._priorities[position]
+        self._priorities[position] = (score, old[1])
+        if score > old[0]:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def remove(self, key:Hashable):
+        """Stop ranking key. O(log n)"""
+        position = self._positions.pop(key)
+        last = len(self._keys) - 1
+        last_key = self._keys.pop()
+        last_priority = self._priorities.pop()
+        if position == last:
+            return
+        self._keys[position] = last_key
+        self._priorities[position] = last_priority
+        self._positions[last_key] = position
+        self._sift_up(position)
+        self._sift_down(self._positions[last_key])
+
+    def score(self, key:Hashable) -> float:
+        return self._priorities[self._positions[key]][0]
+
+    def top(self, k:int) -> List[Tuple[Hashable, float]]:
+        """The k keys with the highest scores as (key, score), highest first. O(k log k)"""
+        result = []
+        if k <= 0 or not self._keys:
+            return result
+        # walk the heap from the root, always expanding the best node seen so far
+        candidates = [(-self._priorities[0][0], -self._priorities[0][1], 0)]
+        while candidates and len(result) < k:
+            _, _, position = heapq.heappop(candidates)
+            result.append((self._keys[position], self._priorities[position][0]))
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self._keys):
+                    score, order = self._priorities[child]
+                    heapq.heappush(candidates, (-score, -order, child))
+        return result
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key:Hashable):
+        return key in self._positions
+
+    def _swap(self, i:int, j:int):
+        self._priorities[i], self._priorities[j] = self._priorities[j], self._priorities[i]
+        self._keys[i], self._keys[j] = self._keys[j], self._keys[i]
+        self._positions[self._keys[i]] = i
+        self._positions[self._keys[j]] = j
+
+    def _sift_up(self, position:int):
+        while position > 0:
+            parent = (position - 1) // 2
+            if self._priorities[position] <= self._priorities[parent]:
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position:int):
+        size = len(self._keys)
+        while True:
+            largest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self._priorities[child] > self._priorities[largest]:
+                    largest = child
+            if largest == position:
+                break
+            self._swap(position, largest)
+            position = largest
+
+class WindowedRanking:
+    """
+    Leaderboard of keys by their total over a sliding window that ends at the latest timestamp
+    seen, e.g. donators by what they gave over the last 24 hours. Amounts are added as they
+    arrive, in any order, and subtracted when the window slides past them, O(log n) each.
+    Reading the top k is O(k log k), however many keys are ranked.
+    """
+    def __init__(self, window:timedelta):
+        self.window = window
+        # latest timestamp seen, the end of the window
+        self.end : Optional[datetime] = None
+        self.ranking = RankedIndex()
+        self._totals : Dict[Hashable, List] = {} # Dict[key, [total, count]] over the window
+        # amounts in the window as (timestamp, sequence, key, amount), oldest first
+        self._entries : List[Tuple[datetime, int, Hashable, float]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def start(self) -> Optional[datetime]:
+        return self.end - self.window if self.end is not None else None
+
+    def add(self, entries:Iterable[Tuple[datetime, Hashable, float]]):
+        """Add (timestamp, key, amount) entries, slide the window to the latest one and expire what fell out"""
+        entries = list(entries)
+        if not entries:
+            return
+        latest = max(timestamp for timestamp, _, _ in entries)
+        if self.end is None or latest > self.end:
+            self.end = latest
+        start = self.end - self.window
+        # the ranking is updated once per key that changed, not once per entry
+        changed = {}
+        for timestamp, key, amount in entries:
+            if timestamp < start:
+                continue
+            heapq.heappush(self._entries, (timestamp, next(self._sequence), key, amount))
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0.0, 0]
+            totals[0] += amount
+            totals[1] += 1
+            changed[key] = totals
+        while self._entries and self._entries[0][0] < start:
+            _, _, key, amount = heapq.heappop(self._entries)
+            totals = self._totals[key]
+            totals[0] -= amount
+            totals[1] -= 1
+            changed[key] = totals
+        for key, (total, count) in changed.items():
+            if count:
+                self.ranking.update(key, total)
+            else:
+                # counted rather than compared with 0, which float subtraction rarely lands on
+                del self._totals[key]
+                if key in self.ranking:
+                    self.ranking.remove(key)
+
+    def top(self, k:int) -> List[Tuple[Hashable, float]]:
+        """The k keys with the highest totals over the window as (key, total), highest first"""
+        return self.ranking.top(k)
+
+    def __len__(self):
+        return len(self._totals)
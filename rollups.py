@@ -0,0 +1,116 @@
+from models import Donation
+from analytics import to_microseconds, from_microseconds, MICROSECOND
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Bucket sizes in microseconds, finest first. Each is a whole number of the previous one.
+GRANULARITIES : List[Tuple[str, int]] = [
+    ("minute", timedelta(minutes=1) // MICROSECOND),
+    ("hour", timedelta(hours=1) // MICROSECOND),
+    ("day", timedelta(days=1) // MICROSECOND),
+]
+
+class CharityRollups:
+    """
+    Per charity totals pre-aggregated in minute, hour and day buckets (UTC), kept up to date
+    as donations arrive, like materialized views. The total over any range is the sum of
+    whole days, whole hours at both ends, whole minutes at both ends, and the donations of
+    the partial minutes at the edges, which the caller reads from the raw donations.
+    A 7 day range touches at most 7 + 2*23 + 2*59 buckets whatever the number of donations.
+    Memory grows with the number of (minute, charity) pairs that received a donation.
+    """
+    def __init__(self):
+        # per granularity: bucket index (start // size) -> {charity: total EUR}
+        self._buckets : List[Dict[int, Dict[str, float]]] = [{} for _ in GRANULARITIES]
+
+    def add_donations(self, donations:Iterable[Donation]):
+        levels = [(buckets, size) for buckets, (_, size) in zip(self._buckets, GRANULARITIES)]
+        for donation in donations:
+            timestamp_us = to_microseconds(donation.timestamp)
+            charity = donation.charity
+            for buckets, size in levels:
+                bucket = buckets.get(timestamp_us // size)
+                if bucket is None:
+                    bucket = buckets[timestamp_us // size] = {}
+                bucket[charity] = bucket.get(charity, 0) + donation.amount_eur
+
+    def iter_buckets(self) -> Iterator[Tuple[int, int, str, float]]:
+        """(level, bucket index, charity, total EUR) of every bucket, finest level first, for snapshots"""
+        for level, buckets in enumerate(self._buckets):
+            for index, bucket in buckets.items():
+                for charity, total in bucket.items():
+                    yield level, index, charity, total
+
+    def restore(self, entries:Iterable[Tuple[int, int, str, float]]):
+        """Add back entries saved from iter_buckets. O(buckets) rather than O(donations)."""
+        for level, index, charity, total in entries:
+            buckets = self._buckets[level]
+            bucket = buckets.get(index)
+            if bucket is None:
+                bucket = buckets[index] = {}
+            bucket[charity] = bucket.get(charity, 0) + total
+
+    def compact(self, before_us:int):
+        """
+        Drop the minute and hour buckets before before_us, which must be a day boundary.
+        The day buckets keep the totals, so ranges that start or end before it must be whole days.
+        """
+        for buckets, (_, size) in zip(self._buckets[:-1], GRANULARITIES[:-1]):
+            for index in [index for index in buckets if index * size < before_us]:
+                del buckets[index]
+
+    def bucket_count(self, granularity:str) -> int:
+        """Number of non empty buckets of a granularity"""
+        return len(self._buckets[[name for name, _ in GRANULARITIES].index(granularity)])
+
+    def totals_between(self, start:datetime, end:datetime,
+                       donations_between:Callable[[datetime, datetime], List[Donation]]) -> Dict[str, float]:
+        """
+        Total per charity of the donations with start <= timestamp <= end.
+        donations_between(start, end) must return the raw donations of a range shorter than a
+        minute, with the same inclusive bounds. It is called for the partial minutes at the edges.
+        """
+        totals : Dict[str, float] = {}
+        # half open range in microseconds, and the whole minutes [first, last) inside it
+        lo, hi = to_microseconds(start), to_microseconds(end) + 1
+        minute = GRANULARITIES[0][1]
+        first, last = -(-lo // minute), hi // minute
+        if first >= last:
+            self._add_raw(totals, lo, hi, donations_between)
+            return totals
+        self._add_raw(totals, lo, first * minute, donations_between)
+        self._add_bucket_range(totals, 0, first, last)
+        self._add_raw(totals, last * minute, hi, donations_between)
+        return totals
+
+    def _add_bucket_range(self, totals:Dict[str, float], level:int, first:int, last:int):
+        """Add buckets [first, last) of level, through the coarser levels wherever they cover them"""
+        if level + 1 == len(GRANULARITIES):
+            self._add_buckets(totals, level, first, last)
+            return
+        per_coarse = GRANULARITIES[level + 1][1] // GRANULARITIES[level][1]
+        coarse_first, coarse_last = -(-first // per_coarse), last // per_coarse
+        if coarse_first >= coarse_last:
+            self._add_buckets(totals, level, first, last)
+            return
+        self._add_buckets(totals, level, first, coarse_first * per_coarse)
+        self._add_bucket_range(totals, level + 1, coarse_first, coarse_last)
+        self._add_buckets(totals, level, coarse_last * per_coarse, last)
+
+    def _add_buckets(self, totals:Dict[str, float], level:int, first:int, last:int):
+        buckets = self._buckets[level]
+        # buckets are sparse: walk whichever is shorter, the range or the non empty buckets
+        indexes = range(first, last) if last - first <= len(buckets) else [i for i in buckets if first <= i < last]
+        for index in indexes:
+            bucket = buckets.get(index)
+            if bucket is not None:
+                for charity, total in bucket.items():
+                    totals[charity] = totals.get(charity, 0) + total
+
+    @staticmethod
+    def _add_raw(totals:Dict[str, float], lo:int, hi:int, donations_between:Callable[[datetime, datetime], List[Donation]]):
+        """Add the raw donations of [lo, hi), shorter than a minute"""
+        if hi <= lo:
+            return
+        for donation in donations_between(from_microseconds(lo), from_microseconds(hi - 1)):
+            totals[donation.charity] = totals.get(donation.charity, 0) + donation.amount_eur
@@ -0,0 +1,212 @@
+"""
+HTTP/JSON front end for the Api, on the standard library http.server.
+
+    GET  /charities/highest-24h[?end=2023-01-21T10:15:00]
+    GET  /charities/totals
+    GET  /donators/most-generous
+    POST /donations   [{"donator": "User1", "amount": "€10", "charity": "Cancer Research", "timestamp": "2023-01-21T10:15:00"}, ...]
+
+Connections are kept alive (HTTP/1.1). Responses are encoded to JSON once per version of
+the aggregates and served as cached bytes, with an ETag, until a donation changes them.
+"""
+from models import Donation, Charity, Donator
+from api import Api
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import hashlib
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Largest POST body accepted, clients send bigger batches in several requests
+MAX_BODY_SIZE = 8 * 2 ** 20
+
+def _json_value(value):
+    """json default hook for the objects the Api returns"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Donation):
+        return {
+            "donator": value.donator,
+            "charity": value.charity,
+            "timestamp": value.timestamp.isoformat(),
+            "currency": value.currency,
+            "amount": value.amount,
+            "amount_eur": value.amount_eur,
+        }
+    if isinstance(value, Charity):
+        return {"name": value.name, "total_eur": value.total_donations}
+    if isinstance(value, Donator):
+        return {"donator_id": value.donator_id, "total_eur": value.total_eur, "donation_count": value.donation_count}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+_encoder = json.JSONEncoder(default=_json_value, separators=(",", ":"), ensure_ascii=False)
+
+def to_json(value) -> bytes:
+    """Compact UTF-8 JSON of an Api result, Donation, Charity, Donator and datetime values included"""
+    return _encoder.encode(value).encode("utf-8")
+
+def parse_timestamp(value:str) -> datetime:
+    """ISO 8601 timestamp as a naive UTC datetime, like the timestamps the services keep"""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def parse_donations(body:bytes) -> List[Donation]:
+    """Donations of a POST body: a JSON object or a list of them, with the fields of a donations.csv row"""
+    try:
+        payload = json.loads(body)
+        rows = payload if isinstance(payload, list) else [payload]
+        return [Donation(row["donator"], row["amount"], row["charity"], parse_timestamp(row["timestamp"])) for row in rows]
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid donation: {e!r}") from e
+
+class ResponseCache:
+    """
+    Encoded responses per key, each valid for one version of the aggregates. Bounded LRU,
+    the key of a query with parameters includes them.
+    """
+    def __init__(self, maxsize:int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries : OrderedDict = OrderedDict() # OrderedDict[key, (version, body, etag)]
+        self._lock = threading.Lock()
+
+    def get(self, key:Hashable, version:int, compute:Callable[[], object]) -> Tuple[bytes, str]:
+        """(body, etag) cached for key at version, or compute() encoded and cached"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == version:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return cached[1], cached[2]
+            self.misses += 1
+        # encoded outside the lock, two threads missing together both compute it
+        body = to_json(compute())
+        # from the content, so it holds across versions and server restarts that didn't change it
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        with self._lock:
+            self._entries[key] = (version, body, etag)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return body, etag
+
+    def info(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive: a client reuses its connection for as many requests as it wants
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, Nagle would hold the body back for the ACK
+    disable_nagle_algorithm = True
+    server : 'ApiServer'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        route = self.server.get_routes.get(url.path)
+        if route is None:
+            return self._send_error(404, f"Unknown endpoint {url.path}")
+        # read before computing, so a cached body is never older than the version it is cached for
+        version = self.server.api.donation_service.get_totals().version
+        try:
+            key, compute = route(parse_qs(url.query))
+        except ValueError as e:
+            return self._send_error(400, str(e))
+        try:
+            body, etag = self.server.responses.get(key, version, compute)
+        except ValueError as e:
+            return self._send_error(400, str(e))
+        except Exception:
+            logger.exception("Failed to serve %s", self.path)
+            return self._send_error(500, "Internal error")
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, b"", etag)
+        self._send(200, body, etag)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/donations":
+            return self._send_error(404, f"Unknown endpoint {self.path}")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            return self._send_error(413, f"Bodies are limited to {MAX_BODY_SIZE} bytes, send smaller batches")
+        body = self.rfile.read(length)
+        try:
+            # the batch is all or nothing, like DonationService.add_donations
+            added = self.server.api.donation_service.add_donations(parse_donations(body))
+        except ValueError as e:
+            return self._send_error(400, str(e))
+        except Exception:
+            logger.exception("Failed to ingest a batch of %d bytes", length)
+            return self._send_error(500, "Internal error")
+        self._send(200, to_json({"added": added}))
+
+    def _send_error(self, status:int, message:str):
+        self._send(status, to_json({"error": message}))
+
+    def _send(self, status:int, body:bytes, etag:Optional[str] = None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format:str, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+class ApiServer(ThreadingHTTPServer):
+    """Serves an Api over HTTP, one thread per connection"""
+    daemon_threads = True
+    # the default backlog of 5 drops connections opened in bursts, which then wait a second to retry
+    request_queue_size = 128
+
+    def __init__(self, api:Api, address:Tuple[str, int] = ("127.0.0.1", 8000), cache_size:int = 1024):
+        self.api = api
+        self.responses = ResponseCache(cache_size)
+        # path -> function of the query parameters returning (cache key, compute the result)
+        self.get_routes : Dict[str, Callable] = {
+            "/charities/highest-24h": self._highest_charity,
+            "/charities/totals": lambda query: ("totals", api.get_running_totals_for_all_charities),
+            "/donators/most-generous": lambda query: ("most_generous", api.get_most_generous_donator),
+        }
+        super().__init__(address, ApiRequestHandler)
+
+    def _highest_charity(self, query:Dict[str, List[str]]):
+        if "end" in query:
+            end = parse_timestamp(query["end"][0])
+        else:
+            # to the second, so clients polling without an end share cached responses
+            end = datetime.now().replace(microsecond=0)
+        return ("highest_24h", end), lambda: self.api.get_highest_grossing_charity_over_24_hours(end)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def serve(api:Api, host:str = "127.0.0.1", port:int = 8000):
+    """Serve api until interrupted"""
+    with ApiServer(api, (host, port)) as server:
+        logger.info("Serving on %s", server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
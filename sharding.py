@@ -0,0 +1,304 @@
+"""
+Sharded deployment: donations are partitioned by charity across worker processes, each owning
+a DonationService, behind a coordinator with the query interface the Api uses.
+"""
+from models import Donation, Donator
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService, ServiceTotals, convert_donations
+from ranking import RankedIndex
+from datetime import datetime, timedelta
+from multiprocessing.connection import Connection
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+def shard_of(charity:str, shards:int) -> int:
+    """The shard owning a charity. crc32 rather than hash(), which changes with every process."""
+    return zlib.crc32(charity.encode("utf-8")) % shards
+
+def _to_record(donation:Donation) -> Tuple:
+    """Donation as a Donation.from_record tuple, cheaper to pickle than the object"""
+    return (donation.donator, donation.charity, donation.timestamp, donation.currency, donation.amount, donation.amount_eur)
+
+class Shard:
+    """The DonationService of one worker process, with the commands the coordinator sends it"""
+    def __init__(self):
+        # donations arrive converted; the sliding leaderboards would only hold partial donator totals
+        self.service = DonationService(ExchangeRateService(), leaderboard_windows=())
+        # donators whose totals changed since the coordinator last collected them
+        self.changed_donators : Set[str] = set()
+
+    def add(self, records:List[Tuple]) -> int:
+        donations = [Donation.from_record(*record) for record in records]
+        added = self.service.add_donations(donations)
+        self.changed_donators.update(donation.donator for donation in donations)
+        return added
+
+    def highest_charity(self, end:datetime) -> Tuple[Optional[str], float, List[Tuple], Optional[datetime]]:
+        """(charity, total, latest donations as records, oldest donation of the charity in the window)"""
+        charity, total, donations = self.service.get_highest_charity_over_24_hours(end)
+        return charity, total, [_to_record(donation) for donation in donations], self._oldest_in_window(charity, end)
+
+    def highest_charities(self, ends:Sequence[datetime]) -> List[Tuple[Optional[str], float, List[Tuple], Optional[datetime]]]:
+        """highest_charity for every end, in one pass"""
+        return [(charity, total, [_to_record(donation) for donation in donations], self._oldest_in_window(charity, end))
+                for end, (charity, total, donations) in zip(ends, self.service.get_highest_charities_over_24_hours(ends))]
+
+    def charity_totals_between(self, start:datetime, end:datetime) -> Dict[str, float]:
+        return self.service.get_charity_totals_between(start, end)
+
+    def donator_totals_between(self, start:datetime, end:datetime) -> Dict[str, float]:
+        """Total EUR per donator of this shard's donations with start <= timestamp <= end"""
+        totals = {}
+        for donation in self.service.get_donations_between(start, end):
+            totals[donation.donator] = totals.get(donation.donator, 0) + donation.amount_eur
+        return totals
+
+    def _oldest_in_window(self, charity:Optional[str], end:datetime) -> Optional[datetime]:
+        """Timestamp of the charity's first donation over the 24 hours before end, which ties are broken on"""
+        if charity is None:
+            return None
+        return next(d.timestamp for d in self.service.get_donations_between(end - timedelta(days=1), end) if d.charity == charity)
+
+    def totals(self) -> Tuple[float, Dict[str, float], Dict[str, Tuple[float, int]]]:
+        """(total EUR, total per charity, donator_partials()), in one round trip"""
+        totals = self.service.get_totals()
+        return totals.total_donations, totals.charity_totals, self.donator_partials()
+
+    def donator_partials(self) -> Dict[str, Tuple[float, int]]:
+        """(total EUR, count) in this shard of the donators that changed since the last call"""
+        donators = self.service.donators
+        partials = {name: (donators[name].total_eur, donators[name].donation_count) for name in self.changed_donators}
+        self.changed_donators = set()
+        return partials
+
+def _run_shard(connection:Connection):
+    """Worker process: run (command, args) messages against a Shard until None is received"""
+    shard = Shard()
+    commands = {
+        "add": shard.add,
+        "highest_charity": shard.highest_charity,
+        "highest_charities": shard.highest_charities,
+        "charity_totals_between": shard.charity_totals_between,
+        "donator_totals_between": shard.donator_totals_between,
+        "totals": shard.totals,
+    }
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command, args = message
+        try:
+            connection.send((True, commands[command](*args)))
+        except Exception as e:
+            connection.send((False, e))
+    connection.close()
+
+class ShardedDonationService:
+    """
+    Coordinator of a sharded deployment on one machine. Charities are hashed to shards, so each
+    charity's donations, totals and windows live in a single worker process, and the workers
+    index and aggregate their donations in parallel.
+    Donations are converted here, so a batch is all or nothing across shards. Queries are
+    scattered to every shard and gathered:
+    - the highest charity over 24 hours is the highest of the per shard maxima, ties going to the
+      charity with the oldest donation in the window like in a single DonationService;
+    - the running totals are the sums of the per shard totals, and the charity totals over a range
+      are the union of the per shard totals;
+    - the top donators over a window are summed from every shard's donator totals in that window;
+    - a donator's total is spread over the shards of the charities they gave to. Shards report
+      the partial totals that changed since the last query, merged here into a leaderboard.
+    get_totals() is cached until the next add. One request to the shards runs at a time.
+    """
+    def __init__(self, exchange_rate_service:ExchangeRateService, shards:Optional[int] = None):
+        shards = shards or os.cpu_count() or 1
+        if shards < 1:
+            raise ValueError(f"shards must be positive, got {shards}")
+        self.exchange_rate_service = exchange_rate_service
+        self.shards = shards
+        self._connections : List[Connection] = []
+        self._processes : List[multiprocessing.Process] = []
+        for _ in range(shards):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_shard, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._lock = threading.Lock()
+        # bumped on every add, like DonationService._version
+        self._version = 0
+        self._totals = ServiceTotals(0, 0, {}, None)
+        self._latest_timestamp : Optional[datetime] = None
+        # Dict[donator_id, [[total EUR, count] per shard]]
+        self._donator_partials : Dict[str, List[List]] = {}
+        self.donator_ranking = RankedIndex()
+
+    def add_donation(self, donation:Donation):
+        self.add_donations([donation])
+
+    def add_donations(self, donations:Iterable[Donation]) -> int:
+        """Convert a batch and send each shard its part of it. Returns the number of donations added."""
+        donations = list(donations)
+        if not donations:
+            return 0
+        with self._lock:
+            # the shards can't fail a batch once every conversion is resolved
+            convert_donations(self.exchange_rate_service, donations)
+            records_per_shard : List[List[Tuple]] = [[] for _ in range(self.shards)]
+            for donation in donations:
+                records_per_shard[shard_of(donation.charity, self.shards)].append(_to_record(donation))
+            self._scatter([("add", (records,)) if records else None for records in records_per_shard])
+            self._version += 1
+            latest = max(donation.timestamp for donation in donations)
+            if self._latest_timestamp is None or latest > self._latest_timestamp:
+                self._latest_timestamp = latest
+        logger.debug("Added %d donations to %d shards", len(donations), self.shards)
+        return len(donations)
+
+    def get_highest_charity_over_24_hours(self, end:datetime = None) -> Tuple[Optional[str], float, List[Donation]]:
+        """The highest of the charities with the highest total over the 24 hours before end, in each shard"""
+        if end is None:
+            # chosen once, so every shard answers the same window
+            end = datetime.now()
+        with self._lock:
+            results = self._scatter([("highest_charity", (end,))] * self.shards)
+        return self._highest_of(results)
+
+    def get_highest_charities_over_24_hours(self, ends:Sequence[datetime]) -> List[Tuple[Optional[str], float, List[Donation]]]:
+        """Batch version of get_highest_charity_over_24_hours, one round trip for every end"""
+        ends = list(ends)
+        with self._lock:
+            results = self._scatter([("highest_charities", (ends,))] * self.shards)
+        return [self._highest_of(results_per_end) for results_per_end in zip(*results)]
+
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> Dict[str, float]:
+        """Total per charity of the donations with start <= timestamp <= end"""
+        with self._lock:
+            results = self._scatter([("charity_totals_between", (start, end))] * self.shards)
+        charity_totals = {}
+        for shard_charity_totals in results:
+            charity_totals.update(shard_charity_totals)
+        return charity_totals
+
+    def get_top_donators_over(self, window:timedelta, k:int) -> Tuple[Optional[datetime], List[Tuple[str, float]]]:
+        """
+        The k donators who gave the most over the window ending at the latest donation, as
+        (end of the window, [(donator_id, total EUR)]), most generous first.
+        """
+        with self._lock:
+            end = self._latest_timestamp
+            if end is None:
+                return (None, [])
+            results = self._scatter([("donator_totals_between", (end - window, end))] * self.shards)
+        totals = {}
+        for shard_totals in results:
+            for name, total in shard_totals.items():
+                totals[name] = totals.get(name, 0) + total
+        return (end, heapq.nlargest(k, totals.items(), key=lambda item: item[1]))
+
+    def get_totals(self) -> ServiceTotals:
+        """The running totals and most generous donator, gathered from the shards once per version"""
+        with self._lock:
+            if self._totals.version == self._version:
+                return self._totals
+            totals = self._scatter([("totals", ())] * self.shards)
+            self._merge_donator_partials([partials for _, _, partials in totals])
+            charity_totals = {}
+            for _, shard_charity_totals, _ in totals:
+                # shards own disjoint charities
+                charity_totals.update(shard_charity_totals)
+            top = self._top_donators(1)
+            self._totals = ServiceTotals(self._version, sum(total for total, _, _ in totals), charity_totals, top[0] if top else None)
+            return self._totals
+
+    def get_top_donator_totals(self, k:int) -> List[Tuple[str, float]]:
+        """(donator_id, total EUR) of the k most generous donators"""
+        self.get_totals()
+        with self._lock:
+            return self.donator_ranking.top(k)
+
+    def get_top_charity_totals(self, k:int) -> List[Tuple[str, float]]:
+        """(name, total EUR) of the k highest grossing charities"""
+        return heapq.nlargest(k, self.get_totals().charity_totals.items(), key=lambda item: item[1])
+
+    @staticmethod
+    def _highest_of(results:Sequence[Tuple]) -> Tuple[Optional[str], float, List[Donation]]:
+        """The highest of the per shard maxima of one window"""
+        found = [result for result in results if result[0] is not None]
+        if not found:
+            return (None, 0, [])
+        # exact ties across shards go to the charity with the oldest donation in the window
+        charity, total, records, _ = min(found, key=lambda result: (-result[1], result[3]))
+        return charity, total, [Donation.from_record(*record) for record in records]
+
+    def _merge_donator_partials(self, partials_per_shard:Sequence[Dict[str, Tuple[float, int]]]):
+        changed = set()
+        for shard, partials in enumerate(partials_per_shard):
+            for name, (total_eur, count) in partials.items():
+                partials_of_donator = self._donator_partials.get(name)
+                if partials_of_donator is None:
+                    partials_of_donator = self._donator_partials[name] = [[0.0, 0] for _ in range(self.shards)]
+                partials_of_donator[shard] = [total_eur, count]
+                changed.add(name)
+        # O(log n) per donator that gave since the last query
+        for name in changed:
+            self.donator_ranking.update(name, sum(total for total, _ in self._donator_partials[name]))
+
+    def _top_donators(self, k:int) -> List[Donator]:
+        donators = []
+        for name, total_eur in self.donator_ranking.top(k):
+            donator = Donator(name)
+            donator.total_eur = total_eur
+            donator.donation_count = sum(count for _, count in self._donator_partials[name])
+            donators.append(donator)
+        return donators
+
+    def _scatter(self, requests:Sequence[Optional[Tuple[str, Tuple]]]) -> List:
+        """
+        Send each shard its (command, args) request, or nothing for None, and gather the results in
+        shard order. The shards run in parallel. The first error is raised once every shard answered.
+        """
+        for connection, request in zip(self._connections, requests):
+            if request is not None:
+                connection.send(request)
+        results = []
+        error = None
+        for connection, request in zip(self._connections, requests):
+            if request is None:
+                results.append(None)
+                continue
+            ok, result = connection.recv()
+            if not ok and error is None:
+                error = result
+            results.append(result if ok else None)
+        if error is not None:
+            raise error
+        return results
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+            for connection, process in zip(self._connections, self._processes):
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+                connection.close()
+            self._connections = []
+
+    def __enter__(self) -> 'ShardedDonationService':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
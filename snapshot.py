@@ -0,0 +1,235 @@
+from models import Donation, ExchangeRate
+from analytics import to_microseconds, from_microseconds
+from array import array
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import zlib
+
+# Snapshot file layout, all little endian and every section aligned on 8 bytes:
+#   header       HEADER struct below
+#   strings      uint64 offsets[string_count + 1], then the UTF-8 blob
+#   donations    columns in timestamp order: int64 timestamp (UTC microseconds), float64 amount,
+#                float64 amount_eur, int32 currency, int32 charity, int32 donator (string ids)
+#   charities    int32 name, float64 total
+#   donators     int32 name, float64 total_eur, int64 donation_count
+#   rates        int32 source, int32 target, int32 date ordinal, float64 rate, float64 fee
+#   sources      int32 name, int64 offset, int64 crc32 of the bytes before offset (see source_checksum)
+#   rollups      int64 bucket index, int32 level, int32 charity, float64 total (see CharityRollups.iter_buckets)
+# Columns are read in place through memoryview casts over an mmap, nothing is deserialised up front.
+MAGIC = b"DONSNAP1"
+VERSION = 2
+HEADER = struct.Struct("<8sI4xqqqqqqqdqqq")
+# Number of bytes before a source offset covered by its checksum
+CHECKSUM_BYTES = 4096
+
+def source_checksum(file_path:str, offset:int) -> int:
+    """CRC32 of the bytes just before offset, used to detect a CSV file that was rewritten rather than appended to"""
+    with open(file_path, 'rb') as f:
+        start = max(0, offset - CHECKSUM_BYTES)
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+class _Writer:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, typecode:str, values):
+        data = array(typecode, values).tobytes()
+        self.f.write(data)
+        self.f.write(b"\0" * (-len(data) % 8))
+
+    def write_bytes(self, data:bytes):
+        self.f.write(data)
+        self.f.write(b"\0" * (-len(data) % 8))
+
+class _Reader:
+    def __init__(self, view:memoryview, offset:int):
+        self.view = view
+        self.offset = offset
+
+    def read(self, typecode:str, count:int) -> memoryview:
+        size = array(typecode).itemsize * count
+        column = self.view[self.offset:self.offset + size].cast(typecode)
+        self.offset += size + (-size % 8)
+        return column
+
+    def read_bytes(self, size:int) -> memoryview:
+        data = self.view[self.offset:self.offset + size]
+        self.offset += size + (-size % 8)
+        return data
+
+class SnapshotDonations:
+    """Read-only, time ordered view over the donation columns of a snapshot. Donations are built on demand."""
+    def __init__(self, snapshot:'Snapshot', timestamps, amounts, amounts_eur, currencies, charities, donators):
+        self.snapshot = snapshot
+        self.timestamps = timestamps
+        self.amounts = amounts
+        self.amounts_eur = amounts_eur
+        self.currencies = currencies
+        self.charities = charities
+        self.donators = donators
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def donation(self, i:int) -> Donation:
+        strings = self.snapshot.strings
+        return Donation.from_record(strings[self.donators[i]], strings[self.charities[i]], from_microseconds(self.timestamps[i]),
+                                    strings[self.currencies[i]], self.amounts[i], self.amounts_eur[i])
+
+    def between(self, start:datetime, end:datetime) -> List[Donation]:
+        """Donations with start <= timestamp <= end. O(log n + k)"""
+        lo = bisect.bisect_left(self.timestamps, to_microseconds(start))
+        hi = bisect.bisect_right(self.timestamps, to_microseconds(end))
+        return [self.donation(i) for i in range(lo, hi)]
+
+    def __iter__(self) -> Iterator[Donation]:
+        for i in range(len(self)):
+            yield self.donation(i)
+
+class Snapshot:
+    """A snapshot file opened with mmap."""
+    def __init__(self, path:str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        (magic, version, string_count, string_bytes, donation_count, charity_count, donator_count,
+         rate_count, source_count, self.total_donations, most_generous, rollup_count, retained_since) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} donation snapshot")
+
+        reader = _Reader(view, HEADER.size + (-HEADER.size % 8))
+        string_offsets = reader.read("q", string_count + 1)
+        blob = bytes(reader.read_bytes(string_bytes))
+        self.strings : List[str] = [blob[string_offsets[i]:string_offsets[i + 1]].decode('utf-8') for i in range(string_count)]
+        self.most_generous_donator : Optional[str] = self.strings[most_generous] if most_generous >= 0 else None
+        # midnight before which the saved service had compacted its raw donations, saved as a date ordinal or 0
+        self.retained_since : Optional[datetime] = datetime.fromordinal(retained_since) if retained_since else None
+
+        self.donations = SnapshotDonations(self, reader.read("q", donation_count), reader.read("d", donation_count),
+                                           reader.read("d", donation_count), reader.read("i", donation_count),
+                                           reader.read("i", donation_count), reader.read("i", donation_count))
+        self._charity_names = reader.read("i", charity_count)
+        self._charity_totals = reader.read("d", charity_count)
+        self._donator_names = reader.read("i", donator_count)
+        self._donator_totals = reader.read("d", donator_count)
+        self._donator_counts = reader.read("q", donator_count)
+        self._rates = [reader.read("i", rate_count), reader.read("i", rate_count), reader.read("i", rate_count),
+                       reader.read("d", rate_count), reader.read("d", rate_count)]
+        names = reader.read("i", source_count)
+        offsets = reader.read("q", source_count)
+        checksums = reader.read("q", source_count)
+        # Dict[name, (offset, checksum)]
+        self.sources : Dict[str, Tuple[int, int]] = {
+            self.strings[names[i]]: (offsets[i], checksums[i]) for i in range(source_count)}
+        self._rollups = [reader.read("q", rollup_count), reader.read("i", rollup_count),
+                         reader.read("i", rollup_count), reader.read("d", rollup_count)]
+
+    def iter_charity_totals(self) -> Iterator[Tuple[str, float]]:
+        for i in range(len(self._charity_names)):
+            yield self.strings[self._charity_names[i]], self._charity_totals[i]
+
+    def iter_donator_totals(self) -> Iterator[Tuple[str, float, int]]:
+        for i in range(len(self._donator_names)):
+            yield self.strings[self._donator_names[i]], self._donator_totals[i], self._donator_counts[i]
+
+    def iter_exchange_rates(self) -> Iterator[ExchangeRate]:
+        sources, targets, dates, rates, fees = self._rates
+        for i in range(len(sources)):
+            yield ExchangeRate(self.strings[sources[i]], self.strings[targets[i]], rates[i], fees[i], datetime.fromordinal(dates[i]))
+
+    def iter_rollups(self) -> Iterator[Tuple[int, int, str, float]]:
+        """(level, bucket index, charity, total EUR) entries, for CharityRollups.restore"""
+        indexes, levels, charities, totals = self._rollups
+        for i in range(len(indexes)):
+            yield levels[i], indexes[i], self.strings[charities[i]], totals[i]
+
+    def source_offset(self, name:str, file_path:str) -> int:
+        """
+        Where to resume reading a source file: the saved offset if the file still starts with
+        what was loaded, 0 if it changed and has to be loaded again.
+        """
+        offset, checksum = self.sources.get(name, (0, 0))
+        if offset == 0 or os.path.getsize(file_path) < offset or source_checksum(file_path, offset) != checksum:
+            return 0
+        return offset
+
+    def close(self):
+        # the columns are views on the mmap, so they have to go before it can be closed
+        self.donations = None
+        self._charity_names = self._charity_totals = None
+        self._donator_names = self._donator_totals = self._donator_counts = None
+        self._rates = None
+        self._rollups = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a caller still holds a view on the columns, the mmap goes with the last one
+            pass
+        self._file.close()
+
+def save_snapshot(path:str, donation_service, sources:Optional[Dict[str, Tuple[str, int]]] = None):
+    """
+    Write the state of donation_service and of its exchange rate service to path.
+    sources maps a name to (file path, offset) for every CSV file loaded so far, so a
+    restart only has to read what was appended after offset.
+    The file is written next to path and renamed over it, so a crash never leaves half a snapshot.
+    """
+    if donation_service.store is not None:
+        raise ValueError("A service with a store keeps its donations in the store, not in a snapshot")
+    sources = sources or {}
+    exchange_rate_service = donation_service.exchange_rate_service
+    string_ids : Dict[str, int] = {}
+    def string_id(value:str) -> int:
+        if value not in string_ids:
+            string_ids[value] = len(string_ids)
+        return string_ids[value]
+
+    # history from a previous snapshot and donations added since are two sorted runs
+    columns = ([], [], [], [], [], [])
+    for donation in heapq.merge(donation_service.get_history(), donation_service._donations_by_time,
+                                key=lambda d: d.timestamp):
+        for column, value in zip(columns, (to_microseconds(donation.timestamp), donation.amount, donation.amount_eur,
+                                           string_id(donation.currency), string_id(donation.charity), string_id(donation.donator))):
+            column.append(value)
+    charities = [(string_id(name), charity.total_donations) for name, charity in donation_service.charities.items()]
+    donators = [(string_id(name), donator.total_eur, donator.donation_count) for name, donator in donation_service.donators.items()]
+    rates = [(string_id(r.source), string_id(r.target), r.date.toordinal(), r.rate, r.fee) for r in exchange_rate_service.iter_exchange_rates()]
+    rollups = [(index, level, string_id(charity), total) for level, index, charity, total in donation_service.rollups.iter_buckets()]
+    saved_sources = [(string_id(name), offset, source_checksum(file_path, offset)) for name, (file_path, offset) in sources.items()]
+    most_generous = donation_service.most_generous_donator
+    most_generous_id = string_id(most_generous.donator_id) if most_generous is not None else -1
+
+    encoded = [value.encode('utf-8') for value in string_ids]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'wb') as f:
+        writer = _Writer(f)
+        writer.write_bytes(HEADER.pack(MAGIC, VERSION, len(encoded), string_offsets[-1], len(columns[0]), len(charities),
+                                       len(donators), len(rates), len(saved_sources), donation_service.total_donations,
+                                       most_generous_id, len(rollups),
+                                       donation_service.retained_since.toordinal() if donation_service.retained_since is not None else 0))
+        writer.write("q", string_offsets)
+        writer.write_bytes(b"".join(encoded))
+        for typecode, column in zip("qddiii", columns):
+            writer.write(typecode, column)
+        for typecode, column in zip("id", zip(*charities) if charities else ((), ())):
+            writer.write(typecode, column)
+        for typecode, column in zip("idq", zip(*donators) if donators else ((), (), ())):
+            writer.write(typecode, column)
+        for typecode, column in zip("iiidd", zip(*rates) if rates else ((),) * 5):
+            writer.write(typecode, column)
+        for typecode, column in zip("iqq", zip(*saved_sources) if saved_sources else ((), (), ())):
+            writer.write(typecode, column)
+        for typecode, column in zip("qiid", zip(*rollups) if rollups else ((),) * 4):
+            writer.write(typecode, column)
+    os.replace(temporary_path, path)
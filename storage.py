@@ -0,0 +1,246 @@
+from abc import ABC, abstractmethod
+from models import Donation, Donator, ExchangeRate
+from analytics import to_microseconds, from_microseconds
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import sqlite3
+import threading
+
+class DonationStore(ABC):
+    """Persistent storage behind DonationService. Aggregates are kept next to the raw donations."""
+    @abstractmethod
+    def add_donations(self, donations:List[Donation]):
+        """Persist a batch of converted donations and update the aggregates, all or nothing."""
+
+    @abstractmethod
+    def get_donation_count(self) -> int:
+        """Number of donations stored"""
+
+    @abstractmethod
+    def get_charity_totals(self) -> List[Tuple[str, float, int]]:
+        """(charity, total EUR, donation count) for every charity"""
+
+    @abstractmethod
+    def get_donator(self, donator_id:str) -> Optional[Donator]:
+        """The lifetime totals of a donator, or None if they never donated"""
+
+    @abstractmethod
+    def get_top_donators(self, k:int) -> List[Donator]:
+        """The k donators with the highest lifetime totals, most generous first"""
+
+    @abstractmethod
+    def get_top_charities(self, k:int) -> List[Tuple[str, float]]:
+        """(charity, total EUR) of the k highest grossing charities, highest first"""
+
+    @abstractmethod
+    def get_donations_between(self, start:datetime, end:datetime) -> List[Donation]:
+        """All donations with start <= timestamp <= end, ordered by timestamp"""
+
+    @abstractmethod
+    def get_highest_charity_between(self, start:datetime, end:datetime, latest:int = 5) -> Tuple[Optional[str], float, List[Donation]]:
+        """Highest grossing charity with start <= timestamp <= end, its total and its latest donations"""
+
+    @abstractmethod
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> List[Tuple[str, float]]:
+        """(charity, total EUR) of every charity with donations with start <= timestamp <= end"""
+
+    @abstractmethod
+    def get_top_donators_between(self, start:datetime, end:datetime, k:int) -> List[Tuple[str, float]]:
+        """(donator, total EUR) of the k donators who gave the most with start <= timestamp <= end, most generous first"""
+
+    @abstractmethod
+    def get_latest_timestamp(self) -> Optional[datetime]:
+        """Timestamp of the latest donation, or None if there are none"""
+
+class ExchangeRateStore(ABC):
+    """Persistent storage behind ExchangeRateService."""
+    @abstractmethod
+    def add_exchange_rates(self, exchange_rates:List[ExchangeRate]):
+        """Persist a batch of rates, replacing the stored rate of the same pair and date"""
+
+    @abstractmethod
+    def iter_exchange_rates(self) -> Iterator[ExchangeRate]:
+        """Every stored rate, in the order they were first added"""
+
+    @abstractmethod
+    def get_exchange_rate_count(self) -> int:
+        """Number of rates stored"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS donations (
+    id INTEGER PRIMARY KEY,
+    donator TEXT NOT NULL,
+    charity TEXT NOT NULL,
+    timestamp INTEGER NOT NULL, -- UTC, microseconds since the epoch
+    currency TEXT NOT NULL,
+    amount REAL NOT NULL,
+    amount_eur REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS donations_timestamp ON donations (timestamp);
+CREATE INDEX IF NOT EXISTS donations_charity_timestamp ON donations (charity, timestamp);
+
+CREATE TABLE IF NOT EXISTS charity_totals (
+    charity TEXT PRIMARY KEY,
+    total REAL NOT NULL,
+    donation_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS charity_totals_total ON charity_totals (total DESC);
+
+CREATE TABLE IF NOT EXISTS donator_totals (
+    donator TEXT PRIMARY KEY,
+    total REAL NOT NULL,
+    donation_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS donator_totals_total ON donator_totals (total DESC);
+
+CREATE TABLE IF NOT EXISTS exchange_rates (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    date INTEGER NOT NULL, -- date ordinal
+    rate REAL NOT NULL,
+    fee REAL NOT NULL,
+    PRIMARY KEY (source, target, date)
+);
+"""
+
+DONATION_COLUMNS = "donator, charity, timestamp, currency, amount, amount_eur"
+
+class SqliteStore(DonationStore, ExchangeRateStore):
+    """
+    SQLite implementation of both stores, in a single database file.
+    Every batch is written in one transaction, and the database runs in WAL mode so
+    readers don't block the writer. Per charity and per donator totals live in their
+    own tables so a restart reads the aggregates instead of replaying donations.
+    Every thread gets its own connection, so reader threads query a consistent
+    snapshot of the database while a writer commits.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self._local = threading.local()
+        self._connections : List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the calling thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def add_donations(self, donations:List[Donation]):
+        charity_totals = {}
+        donator_totals = {}
+        for donation in donations:
+            total, count = charity_totals.get(donation.charity, (0, 0))
+            charity_totals[donation.charity] = (total + donation.amount_eur, count + 1)
+            total, count = donator_totals.get(donation.donator, (0, 0))
+            donator_totals[donation.donator] = (total + donation.amount_eur, count + 1)
+
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO donations ({DONATION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [(d.donator, d.charity, to_microseconds(d.timestamp), d.currency, d.amount, d.amount_eur) for d in donations])
+            self.connection.executemany(
+                "INSERT INTO charity_totals VALUES (?, ?, ?) ON CONFLICT (charity) DO UPDATE SET "
+                "total = total + excluded.total, donation_count = donation_count + excluded.donation_count",
+                [(name, total, count) for name, (total, count) in charity_totals.items()])
+            self.connection.executemany(
+                "INSERT INTO donator_totals VALUES (?, ?, ?) ON CONFLICT (donator) DO UPDATE SET "
+                "total = total + excluded.total, donation_count = donation_count + excluded.donation_count",
+                [(name, total, count) for name, (total, count) in donator_totals.items()])
+
+    def get_donation_count(self) -> int:
+        # the totals tables are small, counting them avoids a scan of the donations
+        return self.connection.execute("SELECT COALESCE(SUM(donation_count), 0) FROM charity_totals").fetchone()[0]
+
+    def get_charity_totals(self) -> List[Tuple[str, float, int]]:
+        return self.connection.execute("SELECT charity, total, donation_count FROM charity_totals").fetchall()
+
+    def get_donator(self, donator_id:str) -> Optional[Donator]:
+        row = self.connection.execute(
+            "SELECT donator, total, donation_count FROM donator_totals WHERE donator = ?", (donator_id,)).fetchone()
+        return self._donator(row) if row is not None else None
+
+    def get_top_donators(self, k:int) -> List[Donator]:
+        rows = self.connection.execute(
+            "SELECT donator, total, donation_count FROM donator_totals ORDER BY total DESC LIMIT ?", (k,))
+        return [self._donator(row) for row in rows]
+
+    def get_top_charities(self, k:int) -> List[Tuple[str, float]]:
+        return self.connection.execute(
+            "SELECT charity, total FROM charity_totals ORDER BY total DESC LIMIT ?", (k,)).fetchall()
+
+    def get_donations_between(self, start:datetime, end:datetime) -> List[Donation]:
+        rows = self.connection.execute(
+            f"SELECT {DONATION_COLUMNS} FROM donations WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp, id",
+            (to_microseconds(start), to_microseconds(end)))
+        return [self._donation(row) for row in rows]
+
+    def get_highest_charity_between(self, start:datetime, end:datetime, latest:int = 5) -> Tuple[Optional[str], float, List[Donation]]:
+        window = (to_microseconds(start), to_microseconds(end))
+        # ties go to the charity with the oldest donation in the window, like the in-memory query
+        row = self.connection.execute(
+            "SELECT charity, SUM(amount_eur) FROM donations WHERE timestamp BETWEEN ? AND ? "
+            "GROUP BY charity ORDER BY SUM(amount_eur) DESC, MIN(timestamp), MIN(id) LIMIT 1", window).fetchone()
+        if row is None:
+            return (None, 0, [])
+        charity, total = row
+        rows = self.connection.execute(
+            f"SELECT {DONATION_COLUMNS} FROM donations WHERE charity = ? AND timestamp BETWEEN ? AND ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?", (charity,) + window + (latest,)).fetchall()
+        return (charity, total, [self._donation(row) for row in reversed(rows)])
+
+    def get_charity_totals_between(self, start:datetime, end:datetime) -> List[Tuple[str, float]]:
+        return self.connection.execute(
+            "SELECT charity, SUM(amount_eur) FROM donations WHERE timestamp BETWEEN ? AND ? GROUP BY charity",
+            (to_microseconds(start), to_microseconds(end))).fetchall()
+
+    def get_top_donators_between(self, start:datetime, end:datetime, k:int) -> List[Tuple[str, float]]:
+        return self.connection.execute(
+            "SELECT donator, SUM(amount_eur) FROM donations WHERE timestamp BETWEEN ? AND ? "
+            "GROUP BY donator ORDER BY SUM(amount_eur) DESC, MIN(id) LIMIT ?",
+            (to_microseconds(start), to_microseconds(end), k)).fetchall()
+
+    def get_latest_timestamp(self) -> Optional[datetime]:
+        latest = self.connection.execute("SELECT MAX(timestamp) FROM donations").fetchone()[0]
+        return from_microseconds(latest) if latest is not None else None
+
+    def add_exchange_rates(self, exchange_rates:List[ExchangeRate]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO exchange_rates VALUES (?, ?, ?, ?, ?) ON CONFLICT (source, target, date) DO UPDATE SET "
+                "rate = excluded.rate, fee = excluded.fee",
+                [(r.source, r.target, r.date.toordinal(), r.rate, r.fee) for r in exchange_rates])
+
+    def iter_exchange_rates(self) -> Iterator[ExchangeRate]:
+        rows = self.connection.execute("SELECT source, target, date, rate, fee FROM exchange_rates ORDER BY rowid")
+        for source, target, date, rate, fee in rows:
+            yield ExchangeRate(source, target, rate, fee, datetime.fromordinal(date))
+
+    def get_exchange_rate_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM exchange_rates").fetchone()[0]
+
+    @staticmethod
+    def _donation(row) -> Donation:
+        donator, charity, timestamp, currency, amount, amount_eur = row
+        return Donation.from_record(donator, charity, from_microseconds(timestamp), currency, amount, amount_eur)
+
+    @staticmethod
+    def _donator(row) -> Donator:
+        donator = Donator(row[0])
+        donator.total_eur = row[1]
+        donator.donation_count = row[2]
+        return donator
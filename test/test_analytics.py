@@ -0,0 +1,47 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from api import Api
+from analytics import WindowAnalytics, np
+
+@pytest.fixture
+def donation_service():
+    """Create a donation service with random EUR donations, added out of order"""
+    rng = random.Random(7)
+    service = DonationService(ExchangeRateService())
+    start = datetime(2023, 1, 1)
+    for _ in range(300):
+        timestamp = start + timedelta(minutes=rng.randrange(10 * 24 * 60))
+        service.add_donation(Donation(f"User{rng.randrange(20)}", f"€{rng.randint(1, 100)}.{rng.randint(0, 99)}",
+                                      f"Charity{rng.randrange(8)}", timestamp))
+    return service
+
+ENDS = [datetime(2022, 12, 31) + timedelta(hours=h) for h in range(0, 12 * 24, 7)]
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(np is None, reason="NumPy not installed"))])
+def test_highest_charity_per_window(donation_service, use_numpy):
+    """Test that every window gives the same answer as the single window query"""
+    analytics = WindowAnalytics(donation_service._donations_by_time, use_numpy=use_numpy)
+    results = analytics.highest_charity_per_window(ENDS)
+    assert len(results) == len(ENDS)
+    for end, (charity, total, donations) in zip(ENDS, results):
+        expected_charity, expected_total, expected_donations = donation_service.get_highest_charity_over_24_hours(end)
+        assert charity == expected_charity
+        assert total == pytest.approx(expected_total)
+        assert donations == expected_donations
+
+def test_batch_query_through_api(donation_service):
+    """Test the batch endpoint and that the snapshot is rebuilt after new donations"""
+    api = Api(donation_service)
+    end = datetime(2023, 1, 5, 12)
+    before = api.get_highest_grossing_charities_over_24_hours([end])[0]
+    assert before["charity"] == api.get_highest_grossing_charity_over_24_hours(end)["charity"]
+
+    donation_service.add_donation(Donation("UserX", "€10000", "CharityNew", end))
+    after = api.get_highest_grossing_charities_over_24_hours([end, datetime(2020, 1, 1)])
+    assert after[0]["charity"] == "CharityNew"
+    assert after[0]["total"] == 10000
+    assert after[1] == {"charity": None, "total": 0, "donations": []}
@@ -0,0 +1,48 @@
+import json
+from collections import Counter
+from datetime import datetime
+from exchange_rate_service import ExchangeRateService
+from benchmarks.generators import make_exchange_rates, make_donation_rows, make_donations
+from benchmarks import suite
+
+START = datetime(2023, 1, 1)
+
+def test_generators_are_seeded():
+    assert list(make_donation_rows(200, START, 5, seed=1)) == list(make_donation_rows(200, START, 5, seed=1))
+    assert list(make_donation_rows(200, START, 5, seed=1)) != list(make_donation_rows(200, START, 5, seed=2))
+    assert [repr(rate) for rate in make_exchange_rates(START, 30, 1)] == [repr(rate) for rate in make_exchange_rates(START, 30, 1)]
+
+def test_donation_stream_shape():
+    donations = make_donations(5000, START, 10, charities=100, late_share=0.1)
+    charities = Counter(donation.charity for donation in donations)
+    # Zipf: the most popular charity gets many times the donations of the median one
+    counts = sorted(charities.values(), reverse=True)
+    assert counts[0] > 10 * counts[len(counts) // 2]
+    assert {donation.currency for donation in donations} == {"USD", "GBP", "EUR"}
+    assert any(a.timestamp > b.timestamp for a, b in zip(donations, donations[1:]))
+
+def test_every_donation_converts_over_a_multi_year_rate_table():
+    service = ExchangeRateService()
+    service.add_exchange_rates(make_exchange_rates(START, 3 * 365))
+    for donation in make_donations(500, datetime(2025, 6, 1), 30):
+        assert donation.currency == "EUR" or service.convert_to_eur(donation.amount, donation.currency, donation.timestamp) > 0
+
+def test_suite_saves_and_compares_baselines(tmp_path, capsys):
+    baseline = str(tmp_path / "baseline.json")
+    arguments = ["--rows", "300", "--days", "3", "--rate-years", "1", "--queries", "30", "--batch-size", "100"]
+    assert suite.run(suite.parse_args(arguments + ["--save", baseline])) == 0
+    with open(baseline) as f:
+        report = json.load(f)
+    assert report["meta"]["arguments"]["rows"] == 300
+    for name, result in report["results"].items():
+        assert result["ops_per_second"] > 0 and result["p99_us"] >= result["p50_us"], name
+        assert result["peak_memory_kb"] is not None
+    assert "api.top_donators" in report["results"] and "ingest.add_donations" in report["results"]
+
+    # a baseline 100 times faster than anything we can do makes every case a regression
+    for result in report["results"].values():
+        result["ops_per_second"] *= 100
+    with open(baseline, "w") as f:
+        json.dump(report, f)
+    assert suite.run(suite.parse_args(arguments + ["--only", "api.top_charities", "convert", "--no-memory", "--compare", baseline])) == 1
+    assert capsys.readouterr().out.count("REGRESSION") == 2
@@ -0,0 +1,148 @@
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from concurrency import ReadWriteLock
+from donation_log import DonationLog
+from api import Api
+
+def test_readers_share_and_writers_exclude():
+    lock = ReadWriteLock()
+    events = []
+    with lock.read():
+        # a second reader gets in while the first holds the lock
+        with lock.read():
+            events.append("two readers")
+
+        def write():
+            with lock.write():
+                events.append("writer")
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        # the writer waits for the reader
+        assert events == ["two readers"]
+    writer.join(1)
+    assert events == ["two readers", "writer"]
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    events = []
+    def write():
+        with lock.write():
+            events.append("writer")
+    def read():
+        with lock.read():
+            events.append("late reader")
+
+    with lock.read():
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        late_reader = threading.Thread(target=read)
+        late_reader.start()
+        time.sleep(0.05)
+        assert events == []
+    writer.join(1)
+    late_reader.join(1)
+    assert events == ["writer", "late reader"]
+
+def test_optimistic_read_waits_for_a_writer():
+    """Test that a read overlapping a write is retried and ends up waiting for the writer"""
+    lock = ReadWriteLock()
+    state = {"value": 1}
+    assert lock.optimistic_read(lambda: state["value"]) == 1
+
+    def write():
+        with lock.write():
+            time.sleep(0.05)
+            state["value"] = 2
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.01)
+    assert lock.optimistic_read(lambda: state["value"]) == 2
+    writer.join(1)
+
+def test_readers_never_see_torn_totals():
+    """Test that readers running during ingestion always see totals that add up"""
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    service = DonationService(exchange_rate_service)
+    api = Api(service)
+    base = datetime(2023, 1, 21)
+    done = threading.Event()
+    errors = []
+
+    def write():
+        for i in range(300):
+            batch = [Donation(f"User{j % 13}", "£3", f"Charity{j % 5}", base + timedelta(minutes=i * 10 + j)) for j in range(10)]
+            if i % 2:
+                service.add_donations(batch)
+            else:
+                for donation in batch:
+                    service.add_donation(donation)
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                totals = api.get_running_totals_for_all_charities()
+                assert totals["total_donations"] == pytest.approx(sum(totals["total_per_charity"].values()))
+                top = api.get_top_charities(5)
+                assert [c["total"] for c in top] == sorted((c["total"] for c in top), reverse=True)
+                donations = service.get_donations_between(base, base + timedelta(days=2))
+                assert all(a.timestamp <= b.timestamp for a, b in zip(donations, donations[1:]))
+                api.get_highest_grossing_charity_over_24_hours(base + timedelta(hours=30))
+        except Exception as error:
+            errors.append(error)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    write()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+    assert api.get_running_totals_for_all_charities()["total_donations"] == pytest.approx(service.total_donations)
+
+def test_donation_log_reads_during_appends(tmp_path):
+    """Test that queries served from a DonationLog run safely while another thread appends late donations"""
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    log = DonationLog(str(tmp_path / "donations.log"))
+    service = DonationService(exchange_rate_service, store=log)
+    base = datetime(2023, 1, 21)
+    done = threading.Event()
+    errors = []
+
+    def write():
+        for i in range(200):
+            # every other batch arrives a day late, so the log is read through its sorted permutation
+            start = base + timedelta(minutes=i * 10) - timedelta(days=i % 2)
+            service.add_donations(Donation(f"User{j % 13}", "£3", f"Charity{j % 5}", start + timedelta(minutes=j)) for j in range(10))
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                donations = service.get_donations_between(base - timedelta(days=1), base + timedelta(days=2))
+                assert all(a.timestamp <= b.timestamp for a, b in zip(donations, donations[1:]))
+                service.get_highest_charity_over_24_hours(base + timedelta(hours=12))
+                service.get_top_donators_over(timedelta(hours=6), 5)
+                service.get_top_charity_totals(5)
+                log.get_charity_totals()
+        except Exception as error:
+            errors.append(error)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    write()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+    assert log.get_donation_count() == 2000
+    log.close()
@@ -0,0 +1,130 @@
+import pytest
+from datetime import datetime
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from storage import SqliteStore
+from main import DataLoader
+import main
+import multiprocessing
+
+@pytest.fixture
+def exchange_rates_csv(tmp_path):
+    """Write a small exchange rates CSV file"""
+    path = tmp_path / "exchange_rates.csv"
+    path.write_text(
+        "source,target,rate,fee,date\n"
+        "GBP,EUR,1.18,0.3,21 Jan 2023\n"
+        "USD,EUR,0.92,0.4,21 Jan 2023\n"
+    )
+    return str(path)
+
+@pytest.fixture
+def donations_csv(tmp_path):
+    """Write a small donations CSV file"""
+    path = tmp_path / "donations.csv"
+    path.write_text(
+        "donator,amount,charity,timestamp\n"
+        "User1,$10,Cancer Research,21 Jan 2023 10:15 EST\n"
+        "User2,£15,Wildlife conservation,21 Jan 2023 12:11 GMT\n"
+        "User3,€4,Literacy at home,21 Jan 2023 10:07 CET\n"
+        "User1,€2,Cancer Research,21 Jan 2023 10:37 GMT\n"
+        "User4,$10,Literacy at home,21 Jan 2023 13:50 EST\n"
+    )
+    return str(path)
+
+def test_iter_donations_is_lazy(donations_csv):
+    """Test that donations are streamed one row at a time"""
+    donations = DataLoader.iter_donations(donations_csv)
+    first = next(donations)
+    assert first.donator == "User1"
+    assert first.timestamp == datetime(2023, 1, 21, 15, 15)
+    assert len(list(donations)) == 4
+
+def test_stream_into_services(exchange_rates_csv, donations_csv):
+    """Test that streaming in chunks gives the same totals as loading everything at once"""
+    exchange_rate_service = ExchangeRateService()
+    assert DataLoader.stream_exchange_rates(exchange_rates_csv, exchange_rate_service, chunk_size=1) == 2
+
+    streamed = DonationService(exchange_rate_service)
+    assert DataLoader.stream_donations(donations_csv, streamed, chunk_size=2) == 5
+
+    loaded = DonationService(exchange_rate_service)
+    for donation in DataLoader.load_donations(donations_csv):
+        loaded.add_donation(donation)
+
+    assert streamed.total_donations == pytest.approx(loaded.total_donations)
+    assert len(streamed.donations) == 5
+    assert streamed.most_generous_donator.donator_id == loaded.most_generous_donator.donator_id
+
+@pytest.mark.parametrize("parts", [1, 2, 3, 5, 50])
+def test_split_byte_ranges(donations_csv, parts):
+    """Test that byte ranges start on line starts and cover every row exactly once"""
+    ranges = DataLoader.split_byte_ranges(donations_csv, parts)
+    assert len(ranges) <= parts
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    rows = [d.donator for start, end in ranges for d in DataLoader.iter_donations(donations_csv, start, end)]
+    assert rows == [d.donator for d in DataLoader.iter_donations(donations_csv)]
+
+def test_load_donations_parallel(exchange_rates_csv, donations_csv):
+    """Test that a parallel load ends in the same state as a sequential one"""
+    exchange_rate_service = ExchangeRateService()
+    DataLoader.stream_exchange_rates(exchange_rates_csv, exchange_rate_service)
+
+    parallel = DonationService(exchange_rate_service)
+    assert DataLoader.load_donations_parallel(donations_csv, parallel, workers=2, ranges_per_worker=2) == 5
+    sequential = DonationService(exchange_rate_service)
+    DataLoader.stream_donations(donations_csv, sequential)
+
+    assert [(d.donator, d.timestamp, d.amount_eur) for d in parallel.donations] == \
+           [(d.donator, d.timestamp, d.amount_eur) for d in sequential.donations]
+    assert parallel.total_donations == pytest.approx(sequential.total_donations)
+    for name, charity in sequential.charities.items():
+        assert parallel.charities[name].total_donations == pytest.approx(charity.total_donations)
+        assert [(d.donator, d.timestamp) for d in parallel.charities[name].donations] == \
+               [(d.donator, d.timestamp) for d in charity.donations]
+    assert [(d.donator_id, d.donation_count) for d in parallel.get_top_donators(10)] == \
+           [(d.donator_id, d.donation_count) for d in sequential.get_top_donators(10)]
+    assert parallel.most_generous_donator.donator_id == sequential.most_generous_donator.donator_id
+    end = datetime(2023, 1, 22)
+    assert parallel.get_highest_charity_over_24_hours(end)[:2] == sequential.get_highest_charity_over_24_hours(end)[:2]
+
+def test_load_donations_parallel_spawn_with_store(exchange_rates_csv, donations_csv, tmp_path, monkeypatch):
+    """Test that workers started with spawn get the rates, not the service and its store connection"""
+    store = SqliteStore(str(tmp_path / "donations.db"))
+    exchange_rate_service = ExchangeRateService(store=store)
+    DataLoader.stream_exchange_rates(exchange_rates_csv, exchange_rate_service)
+    monkeypatch.setattr(main.multiprocessing, "Pool", multiprocessing.get_context("spawn").Pool)
+
+    service = DonationService(exchange_rate_service, store=store)
+    assert DataLoader.load_donations_parallel(donations_csv, service, workers=2) == 5
+    assert store.get_donation_count() == 5
+    store.close()
+
+def test_load_donations_parallel_missing_rate(donations_csv):
+    """Test that a conversion error in a worker reaches the caller"""
+    with pytest.raises(ValueError):
+        DataLoader.load_donations_parallel(donations_csv, DonationService(ExchangeRateService()), workers=2)
+
+def test_stream_invalid_chunk_size(donations_csv):
+    """Test that a chunk size below 1 is rejected"""
+    with pytest.raises(ValueError):
+        DataLoader.stream_donations(donations_csv, DonationService(ExchangeRateService()), chunk_size=0)
+
+@pytest.mark.parametrize("timestamp_str, expected", [
+    ("21 Jan 2023 10:15 EST", datetime(2023, 1, 21, 15, 15)),
+    ("21 Jan 2023 00:30 CET", datetime(2023, 1, 20, 23, 30)),
+    ("31 Dec 2023 22:00 EST", datetime(2024, 1, 1, 3, 0)),
+    ("1 Feb 2023 9:05 GMT", datetime(2023, 2, 1, 9, 5)),
+    # not the fixed layout, these go through strptime
+    ("21 Jan 2023 10:15", datetime(2023, 1, 21, 10, 15)),
+    ("21 JAN 2023 10:15 CET", datetime(2023, 1, 21, 9, 15)),
+    ("21 Jan 2023  10:15 EST", datetime(2023, 1, 21, 15, 15)),
+])
+def test_parse_timestamp(timestamp_str, expected):
+    """Test that the fast parser and the strptime fallback both convert to UTC"""
+    assert DataLoader.parse_timestamp(timestamp_str) == expected
+
+def test_parse_timestamp_invalid():
+    """Test that an invalid timestamp is still rejected"""
+    with pytest.raises(ValueError):
+        DataLoader.parse_timestamp("30 Feb 2023 10:15 EST")
@@ -0,0 +1,150 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from donation_log import DonationLog, RECORD, np
+
+def make_exchange_rate_service():
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    exchange_rate_service.add_exchange_rate(ExchangeRate("USD", "EUR", 0.92, 0.4, datetime(2023, 1, 21)))
+    return exchange_rate_service
+
+def make_donations():
+    timestamp_base = datetime(2023, 1, 21, 12, 0)
+    return [
+        Donation("User1", "$10", "Charity1", timestamp_base - timedelta(hours=2)),
+        Donation("User2", "£15", "Charity2", timestamp_base),
+        Donation("User1", "€5", "Charity1", timestamp_base + timedelta(hours=1)),
+        Donation("User3", "$20", "Charity1", timestamp_base + timedelta(days=1)),
+        Donation("User2", "£10", "Charity2", timestamp_base + timedelta(days=1, hours=2)),
+    ]
+
+@pytest.fixture
+def log_path(tmp_path):
+    """Path of a donation log with the donations already written"""
+    path = str(tmp_path / "donations.log")
+    log = DonationLog(path)
+    service = DonationService(make_exchange_rate_service(), store=log)
+    donations = make_donations()
+    service.add_donation(donations[0])
+    service.add_donations(donations[1:])
+    log.close()
+    return path
+
+@pytest.fixture
+def in_memory_service():
+    service = DonationService(make_exchange_rate_service())
+    service.add_donations(make_donations())
+    return service
+
+def test_columns_are_read_in_place(log_path):
+    """Test that every field of every record is readable from the mapped columns"""
+    log = DonationLog(log_path)
+    assert len(log) == 5
+    assert [log.strings[i] for i in log.charities] == ["Charity1", "Charity2", "Charity1", "Charity1", "Charity2"]
+    assert [log.strings[i] for i in log.currencies] == ["USD", "GBP", "EUR", "USD", "GBP"]
+    assert list(log.amounts) == [10, 15, 5, 20, 10]
+    assert log.amounts_eur[2] == 5
+    assert log.donation(1).timestamp == datetime(2023, 1, 21, 12, 0)
+    log.close()
+
+@pytest.mark.skipif(np is None, reason="NumPy is not installed")
+def test_numpy_memmap(log_path):
+    log = DonationLog(log_path)
+    records = log.as_numpy()
+    assert records["amount"].tolist() == list(log.amounts)
+    assert records["amount_eur"].sum() == pytest.approx(sum(log.amounts_eur))
+    log.close()
+
+def test_restart_restores_aggregates(log_path, in_memory_service):
+    log = DonationLog(log_path)
+    service = DonationService(make_exchange_rate_service(), store=log)
+
+    assert len(service.donations) == 0
+    assert service.total_donations == pytest.approx(in_memory_service.total_donations)
+    for name, charity in in_memory_service.charities.items():
+        assert service.charities[name].total_donations == pytest.approx(charity.total_donations)
+    assert service.most_generous_donator.donator_id == "User2"
+    assert [d.donator_id for d in service.get_top_donators(2)] == ["User2", "User3"]
+    assert [c.name for c in service.get_top_charities(2)] == ["Charity1", "Charity2"]
+    log.close()
+
+def test_queries_match_in_memory(log_path, in_memory_service):
+    log = DonationLog(log_path)
+    service = DonationService(make_exchange_rate_service(), store=log)
+    # an out of order donation makes the log fall back to a sorted permutation
+    late = Donation("User4", "€100", "Charity2", datetime(2023, 1, 21, 11))
+    service.add_donation(late)
+    in_memory_service.add_donation(Donation("User4", "€100", "Charity2", datetime(2023, 1, 21, 11)))
+
+    for end in [datetime(2023, 1, 21, 12), datetime(2023, 1, 22, 12), datetime(2023, 1, 25)]:
+        charity, total, donations = service.get_highest_charity_over_24_hours(end)
+        expected_charity, expected_total, expected_donations = in_memory_service.get_highest_charity_over_24_hours(end)
+        assert charity == expected_charity
+        assert total == pytest.approx(expected_total)
+        assert [(d.donator, d.timestamp, d.amount_eur) for d in donations] == \
+               [(d.donator, d.timestamp, d.amount_eur) for d in expected_donations]
+    start, end = datetime(2023, 1, 21), datetime(2023, 1, 23)
+    assert [(d.donator, d.timestamp) for d in service.get_donations_between(start, end)] == \
+           [(d.donator, d.timestamp) for d in in_memory_service.get_donations_between(start, end)]
+    assert service.most_generous_donator.donator_id == "User4"
+    log.close()
+
+def test_partial_record_is_dropped(log_path):
+    """Test that a record cut short by a crash is ignored and later appends stay aligned"""
+    with open(log_path, 'ab') as f:
+        f.write(b"\1" * (RECORD.size // 2))
+    log = DonationLog(log_path)
+    assert len(log) == 5
+    log.add_donations([Donation.from_record("User5", "Charity3", datetime(2023, 1, 24), "EUR", 1.0, 1.0)])
+    assert log.donation(5).donator == "User5"
+    assert log.get_donation_count() == 6
+    log.close()
+
+def test_timestamp_order_is_kept_on_append(tmp_path):
+    """Test that the sorted permutation is merged on every append, for late, in order and large batches"""
+    log = DonationLog(str(tmp_path / "donations.log"))
+    start = datetime(2023, 1, 1)
+    # a late donation then batches that extend, interleave a few and interleave many donations
+    batches = [[0, 10, 5], [11, 12], [3, 10, 7], [(i * 7) % 40 for i in range(40)]]
+    logged = []
+    for batch in batches:
+        donations = [Donation.from_record(f"User{len(logged) + i}", "Charity1", start + timedelta(hours=hour), "EUR", 1.0, 1.0)
+                     for i, hour in enumerate(batch)]
+        log.add_donations(donations)
+        logged.extend(donations)
+        expected = sorted(logged, key=lambda d: d.timestamp)
+        assert [d.donator for d in log.get_donations_between(start, start + timedelta(days=2))] == [d.donator for d in expected]
+    window = log.get_donations_between(start + timedelta(hours=5), start + timedelta(hours=10))
+    assert [d.timestamp.hour for d in window] == [5, 5, 6, 7, 7, 8, 9, 10, 10, 10]
+    assert log._order is not None
+    log.close()
+
+def test_appends_are_mapped_by_the_next_query(tmp_path):
+    """Test that appends only aggregate the new donations, and the first query after them maps the log"""
+    log = DonationLog(str(tmp_path / "donations.log"))
+    start = datetime(2023, 1, 1)
+    for hour in (1, 2, 3):
+        log.add_donations([Donation.from_record(f"User{hour}", "Charity1", start + timedelta(hours=hour), "EUR", hour, hour)])
+    assert len(log) == 3 and log._mapped_count == 0
+    assert log.get_top_charities(1) == [("Charity1", 6.0)]
+    assert [d.donator for d in log.get_donations_between(start, start + timedelta(days=1))] == ["User1", "User2", "User3"]
+    assert log._mapped_count == 3
+    log.close()
+
+def test_service_keeps_raw_donations_in_the_log(log_path, in_memory_service):
+    """Test that a service with a store only keeps the aggregates, and reads donations from the store"""
+    log = DonationLog(log_path)
+    service = DonationService(make_exchange_rate_service(), store=log)
+    service.add_donation(Donation("User4", "€1", "Charity1", datetime(2023, 1, 23, 13, 0)))
+    service.add_donations([Donation("User4", "€2", "Charity2", datetime(2023, 1, 23, 14, 0))])
+    service.add_aggregated([Donation.from_record("User4", "Charity1", datetime(2023, 1, 23, 15, 0), "EUR", 3.0, 3.0)],
+                           {"Charity1": (3.0, 1)}, {"User4": (3.0, 1)})
+    assert service.donations == [] and service._donations_by_time == []
+    assert all(charity.donations == [] for charity in service.charities.values())
+    assert service.get_totals().charity_totals["Charity1"] == pytest.approx(in_memory_service.charities["Charity1"].total_donations + 4)
+    assert [d.donator for d in service.get_donations_between(datetime(2023, 1, 23, 13, 0), datetime(2023, 1, 24))] == ["User4"] * 3
+    assert service.get_top_donators_over(timedelta(hours=2), 1) == (datetime(2023, 1, 23, 15, 0), [("User4", 6.0)])
+    log.close()
@@ -161,4 +161,77 @@ def test_donations_in_time_window(donation_service):
     assert not any(t == day3 for t in donation_timestamps)
 
     assert charity_id == "CharityX"
-    assert (len(donations) == 2)
\ No newline at end of file
+    assert (len(donations) == 2)
+
+def test_out_of_order_donations_in_time_window(exchange_rate_service):
+    """Test that the time index handles donations that arrive out of order"""
+    service = DonationService(exchange_rate_service)
+    day = datetime(2023, 1, 21, 12, 0)
+
+    service.add_donation(Donation("UserA", "€5", "CharityA", day))
+    service.add_donation(Donation("UserB", "€8", "CharityB", day - timedelta(hours=30)))
+    service.add_donation(Donation("UserC", "€2", "CharityA", day - timedelta(hours=3)))
+    service.add_donation(Donation("UserD", "€4", "CharityB", day - timedelta(hours=1)))
+
+    charity_id, total, donations = service.get_highest_charity_over_24_hours(day)
+
+    # CharityB's €8 donation is outside the window
+    assert charity_id == "CharityA"
+    assert total == 7
+    assert [d.timestamp for d in donations] == [day - timedelta(hours=3), day]
+    assert len(service.get_donations_between(day - timedelta(days=2), day)) == 4
+
+def test_add_donations_matches_add_donation(exchange_rate_service):
+    """Test that a batch gives the same state as adding donations one by one"""
+    timestamp_base = datetime(2023, 1, 21, 12, 0)
+    def make_donations():
+        return [
+            Donation("User1", "$10", "Charity1", timestamp_base - timedelta(hours=2)),
+            Donation("User2", "£15", "Charity2", timestamp_base),
+            Donation("User1", "€5", "Charity1", timestamp_base + timedelta(hours=1)),
+            Donation("User3", "$20", "Charity1", timestamp_base - timedelta(days=1)),
+            Donation("User2", "£10", "Charity2", timestamp_base + timedelta(hours=2)),
+        ]
+
+    one_by_one = DonationService(exchange_rate_service)
+    for donation in make_donations():
+        one_by_one.add_donation(donation)
+
+    batched = DonationService(exchange_rate_service)
+    donations = make_donations()
+    assert batched.add_donations(d for d in donations[:2]) == 2
+    assert batched.add_donations(d for d in donations[2:]) == 3
+
+    assert batched.total_donations == pytest.approx(one_by_one.total_donations)
+    for name, charity in one_by_one.charities.items():
+        assert batched.charities[name].total_donations == pytest.approx(charity.total_donations)
+        assert len(batched.charities[name].donations) == len(charity.donations)
+    for name, donator in one_by_one.donators.items():
+        assert batched.donators[name].total_eur == pytest.approx(donator.total_eur)
+        assert batched.donators[name].donation_count == donator.donation_count
+    assert batched.most_generous_donator.donator_id == one_by_one.most_generous_donator.donator_id
+    assert ([d.timestamp for d in batched.get_highest_charity_over_24_hours(timestamp_base)[2]] ==
+            [d.timestamp for d in one_by_one.get_highest_charity_over_24_hours(timestamp_base)[2]])
+
+def test_add_donations_missing_rate(exchange_rate_service):
+    """Test that a batch with a donation that can't be converted isn't added at all"""
+    service = DonationService(ExchangeRateService())
+    with pytest.raises(ValueError):
+        service.add_donations([
+            Donation("User1", "€5", "Charity1", datetime(2023, 1, 21, 12, 0)),
+            Donation("User2", "$10", "Charity1", datetime(2023, 1, 21, 12, 0)),
+        ])
+    assert len(service.donations) == 0
+    assert service.total_donations == 0
+
+def test_top_donators_and_charities(donation_service):
+    """Test the leaderboards of donators and charities"""
+    # User2: £15 + £10, User3: $20, User1: $10 + €5
+    assert [d.donator_id for d in donation_service.get_top_donators(2)] == ["User2", "User3"]
+    # Charity1: $10 + €5 + $20, Charity2: £15 + £10
+    assert [c.name for c in donation_service.get_top_charities(5)] == ["Charity1", "Charity2"]
+
+    donation_service.add_donations([Donation("User1", "€30", "Charity2", datetime(2023, 1, 22, 14, 0))])
+    assert [d.donator_id for d in donation_service.get_top_donators(3)] == ["User1", "User2", "User3"]
+    assert donation_service.get_top_charities(1)[0].name == "Charity2"
+    assert donation_service.get_top_donators(1)[0] is donation_service.most_generous_donator
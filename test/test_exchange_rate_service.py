@@ -1,5 +1,5 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
 from models import ExchangeRate
 from exchange_rate_service import ExchangeRateService
 
@@ -104,4 +104,124 @@ def test_convert_to_eur_missing_rate():
 def test_convert_to_eur_already_eur(exchange_rate_service):
     """Test converting EUR to EUR (should return the amount unchanged)"""
     amount_eur = exchange_rate_service.convert_to_eur(100, "EUR", datetime(2023, 1, 21))
-    assert amount_eur == 100
\ No newline at end of file
+    assert amount_eur == 100
+
+def test_get_exchange_rate_closest_date_tie():
+    """Test that the closest date lookup prefers the date added first on a tie"""
+    service = ExchangeRateService()
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.17, 0.3, datetime(2023, 1, 20)))
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.14, 0.3, datetime(2023, 1, 24)))
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.10, 0.3, datetime(2023, 1, 10)))
+
+    # Jan 22 is 2 days away from both Jan 20 and Jan 24
+    rate = service.get_exchange_rate("GBP", "EUR", datetime(2023, 1, 22))
+    assert rate.rate == 1.17
+
+    # A partial day is rounded down, so Jan 23 10:00 is 0 days away from Jan 24
+    rate = service.get_exchange_rate("GBP", "EUR", datetime(2023, 1, 23, 10))
+    assert rate.rate == 1.14
+
+    # Before the first date
+    rate = service.get_exchange_rate("GBP", "EUR", datetime(2023, 1, 1))
+    assert rate.rate == 1.10
+
+def test_conversion_cache_hits(exchange_rate_service):
+    """Test that repeated conversions for the same currency and date are served from the cache"""
+    exchange_rate_service.convert_to_eur(100, "GBP", datetime(2023, 1, 21, 10))
+    amount_eur = exchange_rate_service.convert_to_eur(50, "GBP", datetime(2023, 1, 21, 18))
+    assert round(amount_eur, 3) == 58.823
+
+    info = exchange_rate_service.cache_info()
+    assert info["misses"] == 1
+    assert info["hits"] == 1
+    assert info["size"] == 1
+
+def test_conversion_cache_midnight_and_intraday_fallback():
+    """Test that a midnight and an intra-day conversion on the same day don't share a cache entry"""
+    service = ExchangeRateService()
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.17, 0.0, datetime(2023, 1, 20)))
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.14, 0.0, datetime(2023, 1, 24)))
+
+    # Jan 22 10:00 rounds down to 1 day away from Jan 24, Jan 22 midnight is a tie won by Jan 20
+    assert service.convert_to_eur(100, "GBP", datetime(2023, 1, 22, 10)) == pytest.approx(114)
+    assert service.convert_to_eur(100, "GBP", datetime(2023, 1, 22)) == pytest.approx(117)
+    assert service.convert_to_eur(100, "GBP", datetime(2023, 1, 22, 18)) == pytest.approx(114)
+    assert service.cache_info()["size"] == 2
+
+def test_conversion_cache_invalidation(exchange_rate_service):
+    """Test that adding a rate only evicts the conversions it can affect"""
+    exchange_rate_service.convert_to_eur(100, "GBP", datetime(2023, 1, 22))
+    exchange_rate_service.convert_to_eur(100, "USD", datetime(2023, 1, 21))
+    assert len(exchange_rate_service.conversion_cache) == 2
+
+    # A new rate on Jan 22 doesn't change the rates used on Jan 21
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.2, 0.3, datetime(2023, 1, 22)))
+    assert len(exchange_rate_service.conversion_cache) == 1
+    amount_eur = exchange_rate_service.convert_to_eur(100, "GBP", datetime(2023, 1, 22))
+    assert round(amount_eur, 2) == 119.64
+
+def test_conversion_cache_is_bounded():
+    """Test that the conversion cache never grows past its maximum size"""
+    service = ExchangeRateService(conversion_cache_size=2)
+    service.add_exchange_rate(ExchangeRate("USD", "EUR", 0.92, 0.4, datetime(2023, 1, 21)))
+    for day in range(1, 6):
+        service.convert_to_eur(100, "USD", datetime(2023, 1, day))
+
+    info = service.cache_info()
+    assert info["size"] == 2
+    assert info["evictions"] == 3
+
+def test_convert_to_eur_multi_hop():
+    """Test converting through several intermediate currencies"""
+    service = ExchangeRateService()
+    service.add_exchange_rate(ExchangeRate("JPY", "CHF", 0.007, 0.0, datetime(2023, 1, 21)))
+    service.add_exchange_rate(ExchangeRate("CHF", "USD", 1.08, 0.0, datetime(2023, 1, 21)))
+    service.add_exchange_rate(ExchangeRate("USD", "EUR", 0.92, 0.0, datetime(2023, 1, 21)))
+
+    assert service.get_conversion_path("JPY", "EUR", datetime(2023, 1, 21)) == ["JPY", "CHF", "USD", "EUR"]
+    amount_eur = service.convert_to_eur(10000, "JPY", datetime(2023, 1, 21))
+    assert round(amount_eur, 4) == 69.552
+
+def test_convert_to_eur_cheapest_path():
+    """Test that the cheapest path is used when there are several ones, fees included"""
+    service = ExchangeRateService()
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 5.0, datetime(2023, 1, 21)))
+    service.add_exchange_rate(ExchangeRate("GBP", "USD", 1.22, 0.0, datetime(2023, 1, 21)))
+    service.add_exchange_rate(ExchangeRate("USD", "EUR", 0.92, 0.0, datetime(2023, 1, 21)))
+
+    # GBP -> EUR directly gives 1.121, going through USD gives 1.1224
+    assert service.get_conversion_path("GBP", "EUR", datetime(2023, 1, 21)) == ["GBP", "USD", "EUR"]
+    amount_eur = service.convert_to_eur(100, "GBP", datetime(2023, 1, 21))
+    assert round(amount_eur, 2) == 112.24
+
+def test_precomputed_paths_cover_timestamped_conversions(monkeypatch):
+    """Test that after precompute_paths, conversions with a time of day never build a graph"""
+    service = ExchangeRateService()
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.17, 0.3, datetime(2023, 1, 20)))
+    service.add_exchange_rate(ExchangeRate("USD", "GBP", 0.82, 0.3, datetime(2023, 1, 21)))
+    service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.14, 0.3, datetime(2023, 1, 24)))
+    service.precompute_paths("EUR")
+
+    builds = []
+    build_graph = service._build_graph
+    monkeypatch.setattr(service, "_build_graph", lambda day: builds.append(day) or build_graph(day))
+    # Jan 22 and 23 have no rate of their own
+    for day in range(20, 25):
+        for hour in (0, 15):
+            assert service.convert_to_eur(100, "USD", datetime(2023, 1, day, hour, 15 if hour else 0)) > 0
+    assert builds == []
+
+def test_precomputed_paths_outlast_the_path_cache(monkeypatch):
+    """Test that a rate table longer than the path cache keeps every precomputed day"""
+    service = ExchangeRateService(path_cache_size=100)
+    start = datetime(2015, 1, 1)
+    service.add_exchange_rates([ExchangeRate("GBP", "EUR", 1.1, 0.0, start + timedelta(days=i)) for i in range(0, 2200, 2)])
+    service.precompute_paths("EUR")
+    assert len(service.path_cache) == 2 * 2199
+
+    builds = []
+    build_graph = service._build_graph
+    monkeypatch.setattr(service, "_build_graph", lambda day: builds.append(day) or build_graph(day))
+    for day in (0, 1, 1100, 2198):
+        assert service.convert_to_eur(100, "GBP", start + timedelta(days=day, hours=day % 2)) > 0
+    assert builds == []
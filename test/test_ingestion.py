@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from ingestion import AsyncIngestor
+from storage import SqliteStore
+
+@pytest.fixture
+def donation_service():
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    return DonationService(exchange_rate_service)
+
+def make_donations(n:int):
+    base = datetime(2023, 1, 21, 12, 0)
+    return [Donation(f"User{i % 7}", "£10" if i % 2 else "€5", f"Charity{i % 3}", base + timedelta(minutes=i)) for i in range(n)]
+
+def test_concurrent_submissions(donation_service):
+    """Test that concurrent producers are all acknowledged and batched, with totals matching a direct load"""
+    donations = make_donations(500)
+
+    async def run():
+        async with AsyncIngestor(donation_service, max_queue_size=16, max_batch_size=50) as ingestor:
+            async def producer(chunk):
+                return [await ingestor.submit(donation) for donation in chunk]
+            results = await asyncio.gather(*(producer(donations[i::10]) for i in range(10)))
+        return ingestor, results
+
+    ingestor, results = asyncio.run(run())
+    assert sum(len(r) for r in results) == 500
+    metrics = ingestor.metrics()
+    assert metrics["ingested"] == metrics["submitted"] == 500
+    assert metrics["failed"] == 0
+    assert metrics["queue_depth"] == 0
+    # the bounded queue never grew past its capacity
+    assert metrics["max_queue_depth"] <= 16
+    assert metrics["batches"] < 500
+    assert metrics["latency_p50"] <= metrics["latency_p99"] <= metrics["latency_max"]
+
+    expected = DonationService(donation_service.exchange_rate_service)
+    expected.add_donations(make_donations(500))
+    assert donation_service.total_donations == pytest.approx(expected.total_donations)
+    assert donation_service.most_generous_donator.total_eur == pytest.approx(expected.most_generous_donator.total_eur)
+
+def test_failed_donation_is_rejected_alone(donation_service):
+    """Test that a donation without a rate fails its own acknowledgement and not the rest of its batch"""
+    good = make_donations(4)
+    bad = Donation("User9", "$10", "Charity1", datetime(2023, 1, 21, 12, 30))
+
+    async def run():
+        async with AsyncIngestor(donation_service) as ingestor:
+            acknowledgements = [await ingestor.enqueue(d) for d in good[:2] + [bad] + good[2:]]
+            return ingestor, await asyncio.gather(*acknowledgements, return_exceptions=True)
+
+    ingestor, results = asyncio.run(run())
+    assert isinstance(results[2], ValueError)
+    assert results[:2] + results[3:] == good
+    assert ingestor.metrics()["failed"] == 1
+    assert len(donation_service.donations) == 4
+
+def test_enqueue_needs_start(donation_service):
+    async def run():
+        await AsyncIngestor(donation_service).enqueue(make_donations(1)[0])
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+def test_store_errors_fail_their_batch(donation_service, tmp_path):
+    """Test that a store error rejects its batch without stopping the writer, and that stop() returns"""
+    class FailingStore(SqliteStore):
+        def add_donations(self, donations):
+            raise sqlite3.OperationalError("disk I/O error")
+
+    store = FailingStore(str(tmp_path / "donations.db"))
+    service = DonationService(donation_service.exchange_rate_service, store=store)
+
+    async def run():
+        async with AsyncIngestor(service, max_queue_size=4, max_batch_size=2) as ingestor:
+            results = await asyncio.gather(*(ingestor.submit(d) for d in make_donations(20)), return_exceptions=True)
+        return ingestor, results
+
+    ingestor, results = asyncio.run(asyncio.wait_for(run(), 10))
+    assert all(isinstance(result, sqlite3.OperationalError) for result in results)
+    assert ingestor.metrics()["failed"] == 20
+    assert service.total_donations == 0
+    store.close()
+
+def test_stop_after_the_writer_died(donation_service):
+    """Test that stop() doesn't wait on a full queue nobody drains, and rejects what is left in it"""
+    async def run():
+        ingestor = AsyncIngestor(donation_service, max_queue_size=2)
+        ingestor.start()
+        await asyncio.sleep(0)
+        ingestor._writer.cancel()
+        await asyncio.sleep(0)
+        queued = [await ingestor.enqueue(d) for d in make_donations(2)]
+        with pytest.raises(asyncio.CancelledError):
+            await ingestor.stop()
+        return queued
+
+    queued = asyncio.run(asyncio.wait_for(run(), 10))
+    assert all(isinstance(acknowledgement.exception(), RuntimeError) for acknowledgement in queued)
@@ -0,0 +1,103 @@
+import random
+import pytest
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from ranking import WindowedRanking
+from storage import SqliteStore
+from donation_log import DonationLog
+from snapshot import Snapshot, save_snapshot
+from api import Api
+
+BASE = datetime(2023, 1, 20)
+
+def make_donations(n:int, seed:int = 9):
+    """Donations every 5 minutes on average, with one in five arriving up to 2 days late"""
+    rng = random.Random(seed)
+    donations = []
+    for i in range(n):
+        timestamp = BASE + timedelta(seconds=i * 300 + rng.randrange(300))
+        if rng.random() < 0.2:
+            timestamp -= timedelta(seconds=rng.randrange(2 * 86400))
+        donations.append(Donation(f"User{rng.randrange(40)}", f"€{rng.randint(1, 100)}.{rng.randrange(100):02}", "Charity", timestamp))
+    return donations
+
+def brute_force(donations, window, k):
+    end = max(donation.timestamp for donation in donations)
+    totals = {}
+    for donation in donations:
+        if end - window <= donation.timestamp <= end:
+            totals[donation.donator] = totals.get(donation.donator, 0) + donation.amount_eur
+    return end, sorted(totals.items(), key=lambda item: -item[1])[:k]
+
+def assert_same(result, expected):
+    assert result[0] == expected[0]
+    assert [donator for donator, _ in result[1]] == [donator for donator, _ in expected[1]]
+    assert [total for _, total in result[1]] == pytest.approx([total for _, total in expected[1]])
+
+def test_windowed_ranking_expires_entries():
+    ranking = WindowedRanking(timedelta(hours=1))
+    ranking.add([(BASE, "a", 10), (BASE + timedelta(minutes=10), "b", 5)])
+    ranking.add([(BASE + timedelta(minutes=30), "b", 1), (BASE - timedelta(hours=2), "c", 100)])
+    assert ranking.top(3) == [("a", 10), ("b", 6)]
+    ranking.add([(BASE + timedelta(minutes=65), "c", 1)])
+    assert ranking.start == BASE + timedelta(minutes=5)
+    assert ranking.top(3) == [("b", 6), ("c", 1)]
+    ranking.add([(BASE + timedelta(hours=3), "d", 2)])
+    assert ranking.top(3) == [("d", 2)]
+    assert len(ranking) == 1
+
+def test_windows_match_a_full_scan():
+    """Test that the incremental leaderboards match a scan after every batch, with late donations"""
+    service = DonationService(ExchangeRateService())
+    donations = make_donations(4000)
+    for i in range(0, len(donations), 250):
+        if i % 500:
+            service.add_donations(donations[i:i + 250])
+        else:
+            for donation in donations[i:i + 250]:
+                service.add_donation(donation)
+        added = donations[:i + 250]
+        for window in (timedelta(days=1), timedelta(days=7)):
+            assert_same(service.get_top_donators_over(window, 5), brute_force(added, window, 5))
+    # a window that isn't maintained is summed from the time index
+    assert_same(service.get_top_donators_over(timedelta(hours=6), 5), brute_force(donations, timedelta(hours=6), 5))
+
+def test_api(tmp_path):
+    service = DonationService(ExchangeRateService(), leaderboard_windows=[timedelta(hours=12)])
+    api = Api(service)
+    assert api.get_top_donators_over_window(timedelta(hours=12)) == {"start": None, "end": None, "top_donators": []}
+    donations = make_donations(1000)
+    service.add_donations(donations)
+    result = api.get_top_donators_over_window(timedelta(hours=12), 3)
+    end, expected = brute_force(donations, timedelta(hours=12), 3)
+    assert (result["start"], result["end"]) == (end - timedelta(hours=12), end)
+    assert [d["donator_id"] for d in result["top_donators"]] == [donator for donator, _ in expected]
+
+def test_stores_seed_the_windows(tmp_path):
+    donations = make_donations(1200)
+    for store in (SqliteStore(str(tmp_path / "donations.db")), DonationLog(str(tmp_path / "donations.log"))):
+        service = DonationService(ExchangeRateService(), store=store)
+        service.add_donations(donations[:1000])
+        # a new service on the same store sees the donations of the previous session
+        restarted = DonationService(ExchangeRateService(), store=store)
+        restarted.add_donations(donations[1000:])
+        # 3 days isn't maintained, the store sums it
+        for window in (timedelta(days=1), timedelta(days=7), timedelta(days=3)):
+            assert_same(restarted.get_top_donators_over(window, 5), brute_force(donations, window, 5))
+        store.close()
+
+def test_snapshot_restore_seeds_the_windows(tmp_path):
+    donations = make_donations(1000)
+    service = DonationService(ExchangeRateService())
+    service.add_donations(donations)
+    save_snapshot(str(tmp_path / "snapshot"), service)
+    snapshot = Snapshot(str(tmp_path / "snapshot"))
+    restored = DonationService(ExchangeRateService())
+    restored.restore_snapshot(snapshot)
+    assert_same(restored.get_top_donators_over(timedelta(days=1), 5), brute_force(donations, timedelta(days=1), 5))
+    later = Donation("User1", "€5000", "Charity", max(d.timestamp for d in donations) + timedelta(hours=1))
+    restored.add_donation(later)
+    assert_same(restored.get_top_donators_over(timedelta(days=1), 5), brute_force(donations + [later], timedelta(days=1), 5))
+    snapshot.close()
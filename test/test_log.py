@@ -0,0 +1,42 @@
+import io
+import logging
+import pytest
+from datetime import datetime
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from log import SampleFilter, configure_logging
+
+@pytest.fixture
+def log_stream():
+    """Capture log records written through configure_logging"""
+    stream = io.StringIO()
+    root = logging.getLogger()
+    level = root.level
+    handler = configure_logging(logging.DEBUG, sample_every=3, stream=stream)
+    yield stream
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+def test_sample_filter():
+    """Test that only one in every n debug records passes and other levels always pass"""
+    sample_filter = SampleFilter(3)
+    debug = logging.LogRecord("test", logging.DEBUG, __file__, 0, "debug", None, None)
+    info = logging.LogRecord("test", logging.INFO, __file__, 0, "info", None, None)
+    assert [sample_filter.filter(debug) for _ in range(6)] == [True, False, False, True, False, False]
+    assert all(sample_filter.filter(info) for _ in range(3))
+
+def test_add_donation_does_not_print(capsys):
+    """Test that the hot path doesn't write to stdout"""
+    service = DonationService(ExchangeRateService())
+    service.add_donation(Donation("User1", "€5", "Charity1", datetime(2023, 1, 21, 12, 0)))
+    service.get_highest_charity_over_24_hours(datetime(2023, 1, 21, 12, 0))
+    assert capsys.readouterr().out == ""
+
+def test_sampled_debug_output(log_stream):
+    """Test that debug records are sampled once logging is configured"""
+    service = DonationService(ExchangeRateService())
+    for i in range(6):
+        service.add_donation(Donation(f"User{i}", "€5", "Charity1", datetime(2023, 1, 21, 12, 0)))
+    # each donation logs from DonationService and from Charity
+    assert len(log_stream.getvalue().splitlines()) == 4
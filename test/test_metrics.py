@@ -0,0 +1,135 @@
+import io
+import os
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from metrics import REGISTRY, Histogram, MetricsRegistry, capture
+from api import Api
+
+@pytest.fixture
+def registry():
+    """The shared registry, enabled and emptied for one test"""
+    REGISTRY.reset()
+    REGISTRY.enable()
+    yield REGISTRY
+    REGISTRY.disable()
+    REGISTRY.reset()
+
+@pytest.fixture
+def service():
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rates([
+        ExchangeRate("GBP", "EUR", 1.2, 0.0, datetime(2023, 1, 20)),
+        ExchangeRate("USD", "GBP", 0.8, 0.0, datetime(2023, 1, 20)),
+    ])
+    return DonationService(exchange_rate_service)
+
+def test_histogram():
+    histogram = Histogram()
+    for microseconds in [3] * 98 + [1000, 5000]:
+        histogram.observe(microseconds / 1e6)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["p50_us"] == 4
+    assert 1000 <= summary["p99_us"] <= 1024
+    assert summary["max_us"] == pytest.approx(5000)
+    assert Histogram().percentile(0.5) == 0.0
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry()
+    calls = []
+    @registry.timed("f")
+    def f(x):
+        calls.append(x)
+        return x * 2
+    assert f(2) == 4 and calls == [2]
+    registry.increment("count")
+    assert registry.stages("stages") is None
+    assert registry.report() == {"counters": {}, "histograms": {}}
+
+def test_counters_timers_and_stages():
+    registry = MetricsRegistry(enabled=True)
+    @registry.timed()
+    def f():
+        return 1
+    for _ in range(3):
+        f()
+    registry.increment("count")
+    registry.increment("count", 4)
+    stages = registry.stages("add")
+    stages.lap("convert")
+    stages.lap("apply")
+    report = registry.report()
+    assert report["counters"] == {"count": 5}
+    assert report["histograms"][f"{__name__}.test_counters_timers_and_stages.<locals>.f"]["count"] == 3
+    assert {"add.convert", "add.apply"} <= set(report["histograms"])
+    assert "add.apply" in registry.format_report()
+
+def test_instrumented_service(registry, service):
+    service.add_donation(Donation("User1", "£10", "Charity1", datetime(2023, 1, 20, 10)))
+    service.add_donations([Donation("User2", "$10", "Charity2", datetime(2023, 1, 20, 11)),
+                           Donation("User3", "€10", "Charity1", datetime(2023, 1, 20, 12))])
+    api = Api(service)
+    end = datetime(2023, 1, 20, 23)
+    api.get_highest_grossing_charity_over_24_hours(end)
+    api.get_highest_grossing_charity_over_24_hours(end)
+    report = registry.report()
+    assert report["counters"]["donation_service.donations_added"] == 3
+    assert report["counters"]["donation_service.batches_added"] == 1
+    histograms = report["histograms"]
+    for stage in ("convert", "lock_wait", "apply", "publish"):
+        assert histograms[f"donation_service.add_donation.{stage}"]["count"] == 1
+    assert histograms["donation_service.add_donations.group"]["count"] == 1
+    # GBP has a direct rate to EUR, USD goes through GBP, EUR needs no conversion
+    assert {name for name in histograms if name.startswith("exchange_rate_service.conversion.")} == {
+        "exchange_rate_service.conversion.one_hop", "exchange_rate_service.conversion.two_hop"}
+    assert histograms["exchange_rate_service.conversion.one_hop"]["count"] == 1
+    assert histograms["exchange_rate_service.conversion.two_hop"]["count"] == 1
+    assert histograms["window_cache.get.miss"]["count"] == 1
+    assert histograms["window_cache.get.hit"]["count"] == 1
+    assert histograms["api.Api.get_highest_grossing_charity_over_24_hours"]["count"] == 2
+
+def test_capture(tmp_path, service):
+    stream = io.StringIO()
+    profile = str(tmp_path / "ingest.prof")
+    with capture(profile, trace_memory=True, stream=stream):
+        service.add_donations([Donation(f"User{i}", "€1", "Charity1", datetime(2023, 1, 20) + timedelta(minutes=i)) for i in range(100)])
+    output = stream.getvalue()
+    assert os.path.getsize(profile) > 0
+    assert "add_donations" in output
+    assert "=== Memory (peak" in output
+    # without options the block simply runs
+    with capture(stream=stream):
+        pass
+    assert stream.getvalue() == output
+
+def test_conversions_are_counted_by_path(registry):
+    """Test that every conversion, cached or not, is counted by path length and by how each of its rates was found"""
+    service = ExchangeRateService()
+    service.add_exchange_rates([
+        ExchangeRate("GBP", "EUR", 1.2, 0.0, datetime(2023, 1, 20)),
+        ExchangeRate("EUR", "USD", 1.1, 0.0, datetime(2023, 1, 20)),
+        ExchangeRate("CHF", "GBP", 0.9, 0.0, datetime(2023, 1, 18)),
+    ])
+    # USD: one inverse rate, GBP: one direct rate, CHF: the closest date then a direct rate, JPY: no path
+    for _ in range(2):
+        for currency in ("USD", "GBP", "CHF", "JPY"):
+            service.convert_to_eur(10, currency, datetime(2023, 1, 20))
+    service.get_conversion_multiplier("EUR", "EUR", datetime(2023, 1, 20))
+    report = registry.report()
+    # latencies use the same case names as the path counters, rate kinds are only counters
+    assert {name for name in report["histograms"] if name.startswith("exchange_rate_service.conversion.")} == {
+        "exchange_rate_service.conversion." + case for case in ("one_hop", "two_hop", "no_path", "same_currency", "cached")}
+    counters = report["counters"]
+    assert counters["exchange_rate_service.graphs_built"] == 1
+    assert {name: count for name, count in counters.items() if ".path." in name or ".rate." in name} == {
+        "exchange_rate_service.path.one_hop": 4,
+        "exchange_rate_service.path.two_hop": 2,
+        "exchange_rate_service.path.no_path": 2,
+        "exchange_rate_service.path.same_currency": 1,
+        "exchange_rate_service.rate.direct": 4,
+        "exchange_rate_service.rate.inverse": 2,
+        "exchange_rate_service.rate.closest_date": 2,
+    }
@@ -0,0 +1,34 @@
+import random
+from ranking import RankedIndex
+
+def test_top_k_matches_sorting():
+    """Test that the top k match a full sort after random increases, decreases and removals"""
+    rng = random.Random(3)
+    ranking = RankedIndex()
+    scores = {}
+    order = {}
+    for step in range(2000):
+        key = f"key{rng.randrange(200)}"
+        if key in scores and rng.random() < 0.1:
+            ranking.remove(key)
+            del scores[key]
+            del order[key]
+            continue
+        scores[key] = rng.choice([scores.get(key, 0) + rng.randint(1, 50), rng.randint(0, 500)])
+        order.setdefault(key, step)
+        ranking.update(key, scores[key])
+
+        if step % 100 == 0:
+            expected = sorted(scores.items(), key=lambda item: (-item[1], order[item[0]]))[:10]
+            assert ranking.top(10) == expected
+    assert len(ranking) == len(scores)
+
+def test_ties_go_to_first_added():
+    """Test that keys with the same score are ranked by the order they were added"""
+    ranking = RankedIndex()
+    for key in ["a", "b", "c"]:
+        ranking.update(key, 5)
+    ranking.update("d", 7)
+    assert ranking.top(3) == [("d", 7), ("a", 5), ("b", 5)]
+    assert ranking.top(0) == []
+    assert ranking.score("c") == 5
@@ -0,0 +1,116 @@
+import random
+import pytest
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from snapshot import Snapshot, save_snapshot
+
+BASE = datetime(2023, 1, 1)
+
+def make_donations(days:int, per_day:int = 200, seed:int = 5):
+    """Donations in time order, with one in ten arriving up to 12 hours late"""
+    rng = random.Random(seed)
+    donations = []
+    for i in range(days * per_day):
+        timestamp = BASE + timedelta(seconds=i * 86400 // per_day)
+        if rng.random() < 0.1:
+            timestamp -= timedelta(seconds=rng.randrange(12 * 3600))
+        donations.append(Donation(f"User{rng.randrange(50)}", f"€{rng.randint(1, 100)}.{rng.randrange(100):02}",
+                                  f"Charity{rng.randrange(8)}", timestamp))
+    return donations
+
+def load(service:DonationService, donations):
+    for i in range(0, len(donations), 100):
+        if i % 300:
+            service.add_donations(donations[i:i + 100])
+        else:
+            for donation in donations[i:i + 100]:
+                service.add_donation(donation)
+
+@pytest.fixture
+def services():
+    donations = make_donations(30)
+    full = DonationService(ExchangeRateService())
+    retained = DonationService(ExchangeRateService(), retention=timedelta(days=3))
+    load(full, donations)
+    load(retained, donations)
+    return full, retained
+
+def test_totals_are_exact(services):
+    full, retained = services
+    # same donations added in the same order, so the float sums are identical
+    assert retained.total_donations == full.total_donations
+    assert retained.get_totals().charity_totals == full.get_totals().charity_totals
+    assert {name: d.total_eur for name, d in retained.donators.items()} == {name: d.total_eur for name, d in full.donators.items()}
+    assert retained.most_generous_donator.donator_id == full.most_generous_donator.donator_id
+    assert [c.name for c in retained.get_top_charities(8)] == [c.name for c in full.get_top_charities(8)]
+
+def test_raw_donations_are_bounded(services):
+    full, retained = services
+    assert retained.retained_since == datetime(2023, 1, 27)
+    assert len(retained.donations) < 5 * 200
+    assert all(donation.timestamp >= retained.retained_since for donation in retained.donations)
+    assert sum(len(charity.donations) for charity in retained.charities.values()) == len(retained.donations)
+    assert retained.rollups.bucket_count("minute") < full.rollups.bucket_count("minute") / 5
+    assert retained.rollups.bucket_count("day") == full.rollups.bucket_count("day")
+
+def test_recent_queries_match(services):
+    full, retained = services
+    for hours in (0, 5, 30, 60):
+        end = datetime(2023, 1, 30, 23) - timedelta(hours=hours)
+        assert retained.get_highest_charity_over_24_hours(end) == full.get_highest_charity_over_24_hours(end)
+        assert retained.get_charity_totals_between(end - timedelta(hours=30, minutes=7), end) == \
+            pytest.approx(full.get_charity_totals_between(end - timedelta(hours=30, minutes=7), end))
+    ends = [datetime(2023, 1, 29) + timedelta(hours=i) for i in range(24)]
+    # cumulative sums start from different donations, so totals only match up to rounding
+    for (charity, total, donations), expected in zip(retained.get_highest_charities_over_24_hours(ends),
+                                                     full.get_highest_charities_over_24_hours(ends)):
+        assert (charity, donations) == (expected[0], expected[2])
+        assert total == pytest.approx(expected[1])
+
+def test_compacted_ranges(services):
+    full, retained = services
+    # whole days before the cutoff come from the day buckets
+    start = datetime(2023, 1, 3)
+    for end in (datetime(2023, 1, 10) - timedelta(microseconds=1), datetime(2023, 1, 29, 17, 3)):
+        assert retained.get_charity_totals_between(start, end) == pytest.approx(full.get_charity_totals_between(start, end))
+    with pytest.raises(ValueError):
+        retained.get_charity_totals_between(datetime(2023, 1, 3, 12), datetime(2023, 1, 29))
+    with pytest.raises(ValueError):
+        retained.get_charity_totals_between(start, datetime(2023, 1, 10, 12))
+    with pytest.raises(ValueError):
+        retained.get_highest_charity_over_24_hours(datetime(2023, 1, 27, 12))
+    with pytest.raises(ValueError):
+        retained.get_donations_between(datetime(2023, 1, 20), datetime(2023, 1, 28))
+
+def test_late_donation_before_the_cutoff_counts(services):
+    _, retained = services
+    total = retained.total_donations
+    retained.add_donation(Donation("Late", "€1000", "Charity0", datetime(2023, 1, 5, 10)))
+    assert retained.total_donations == total + 1000
+    assert retained.get_charity_totals_between(datetime(2023, 1, 5), datetime(2023, 1, 6) - timedelta(microseconds=1))["Charity0"] > 1000
+
+def test_retention_is_validated(tmp_path):
+    with pytest.raises(ValueError):
+        DonationService(ExchangeRateService(), retention=timedelta(hours=12))
+
+def test_snapshots_keep_the_horizon(services, tmp_path):
+    """Test that a snapshot restores into a service with a horizon, and that a compacted snapshot keeps its horizon"""
+    full, retained = services
+    for name, saved, retention in (("full", full, timedelta(days=3)), ("retained", retained, None)):
+        save_snapshot(str(tmp_path / name), saved)
+        snapshot = Snapshot(str(tmp_path / name))
+        restored = DonationService(ExchangeRateService(), retention=retention)
+        restored.restore_snapshot(snapshot)
+        assert restored.retained_since == datetime(2023, 1, 27)
+        end = datetime(2023, 1, 30, 23)
+        charity, total, donations = restored.get_highest_charity_over_24_hours(end)
+        expected = full.get_highest_charity_over_24_hours(end)
+        assert (charity, [str(d) for d in donations]) == (expected[0], [str(d) for d in expected[2]])
+        assert total == pytest.approx(expected[1])
+        start = datetime(2023, 1, 3)
+        assert restored.get_charity_totals_between(start, end) == pytest.approx(full.get_charity_totals_between(start, end))
+        with pytest.raises(ValueError):
+            restored.get_donations_between(datetime(2023, 1, 20), datetime(2023, 1, 28))
+        snapshot.close()
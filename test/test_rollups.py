@@ -0,0 +1,78 @@
+import random
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from storage import SqliteStore
+from api import Api
+
+BASE = datetime(2023, 1, 20)
+
+def make_donations(n:int, seed:int = 7):
+    rng = random.Random(seed)
+    return [Donation(f"User{rng.randrange(20)}", f"€{rng.randint(1, 100)}", f"Charity{rng.randrange(6)}",
+                     BASE + timedelta(seconds=rng.randrange(10 * 86400), microseconds=rng.randrange(1000000)))
+            for _ in range(n)]
+
+def brute_force(donations, start, end):
+    totals = {}
+    for donation in donations:
+        if start <= donation.timestamp <= end:
+            totals[donation.charity] = totals.get(donation.charity, 0) + donation.amount_eur
+    return totals
+
+@pytest.fixture
+def service():
+    service = DonationService(ExchangeRateService())
+    donations = make_donations(3000)
+    service.add_donations(donations[:2000])
+    for donation in donations[2000:]:
+        service.add_donation(donation)
+    return service
+
+def test_random_ranges_match_brute_force(service):
+    """Test that bucket sums plus raw edges give the totals of the raw donations over any range"""
+    rng = random.Random(1)
+    for _ in range(200):
+        start = BASE + timedelta(seconds=rng.randrange(-86400, 11 * 86400), microseconds=rng.randrange(1000000))
+        end = start + rng.choice([timedelta(seconds=rng.randrange(90)), timedelta(minutes=rng.randrange(200)),
+                                  timedelta(hours=rng.randrange(72), seconds=rng.randrange(3600)), timedelta(days=rng.randrange(12))])
+        expected = brute_force(service.donations, start, end)
+        totals = service.get_charity_totals_between(start, end)
+        assert totals.keys() == expected.keys()
+        for charity, total in expected.items():
+            assert totals[charity] == pytest.approx(total)
+
+def test_bounds_are_inclusive(service):
+    donation = service.donations[0]
+    totals = service.get_charity_totals_between(donation.timestamp, donation.timestamp)
+    assert totals == pytest.approx(brute_force(service.donations, donation.timestamp, donation.timestamp))
+    assert service.get_charity_totals_between(donation.timestamp, donation.timestamp - timedelta(seconds=1)) == {}
+
+def test_buckets_per_granularity(service):
+    assert service.rollups.bucket_count("day") == 10
+    assert service.rollups.bucket_count("hour") <= 240
+    assert service.rollups.bucket_count("minute") <= 3000
+
+def test_api_ranges(service):
+    api = Api(service)
+    end = BASE + timedelta(days=5, hours=3, minutes=17, seconds=42)
+    day = api.get_charity_totals_over_24_hours(end)
+    assert day["start"] == end - timedelta(days=1)
+    assert day["total_per_charity"] == pytest.approx(brute_force(service.donations, end - timedelta(days=1), end))
+    assert day["total_donations"] == pytest.approx(sum(day["total_per_charity"].values()))
+    week = api.get_charity_totals_over_7_days(end)
+    assert week["total_per_charity"] == pytest.approx(brute_force(service.donations, end - timedelta(days=7), end))
+
+def test_store_pushdown(tmp_path):
+    """Test that a service with a store answers range totals from the store"""
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    store = SqliteStore(str(tmp_path / "donations.db"))
+    service = DonationService(exchange_rate_service, store=store)
+    donations = make_donations(500)
+    service.add_donations(donations)
+    start, end = BASE + timedelta(days=2, minutes=3), BASE + timedelta(days=4, hours=5)
+    assert service.get_charity_totals_between(start, end) == pytest.approx(brute_force(donations, start, end))
+    store.close()
@@ -0,0 +1,105 @@
+import http.client
+import json
+import threading
+import pytest
+from datetime import datetime
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from api import Api
+from server import ApiServer, to_json
+from benchmarks.bench_server import load
+
+@pytest.fixture
+def server():
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.2, 0.0, datetime(2023, 1, 20)))
+    service = DonationService(exchange_rate_service)
+    service.add_donations([
+        Donation("User1", "£10", "Charity1", datetime(2023, 1, 20, 10)),
+        Donation("User2", "€20", "Charity2", datetime(2023, 1, 20, 11)),
+    ])
+    server = ApiServer(Api(service), ("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def connection(server):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    yield connection
+    connection.close()
+
+def request(connection, method, path, body=None, headers=None):
+    connection.request(method, path, json.dumps(body) if body is not None else None, headers or {})
+    response = connection.getresponse()
+    payload = response.read()
+    return response, json.loads(payload) if payload else None
+
+def test_to_json():
+    donation = Donation("User1", "£10", "Charity1", datetime(2023, 1, 20, 10))
+    donation.amount_eur = 12.0
+    assert json.loads(to_json({"donations": [donation], "end": datetime(2023, 1, 21)})) == {
+        "donations": [{"donator": "User1", "charity": "Charity1", "timestamp": "2023-01-20T10:00:00",
+                       "currency": "GBP", "amount": 10.0, "amount_eur": 12.0}],
+        "end": "2023-01-21T00:00:00",
+    }
+
+def test_get_endpoints_on_one_connection(server, connection):
+    response, totals = request(connection, "GET", "/charities/totals")
+    assert response.status == 200 and response.getheader("Content-Type") == "application/json"
+    assert totals == {"total_donations": 32.0, "total_per_charity": {"Charity1": 12.0, "Charity2": 20.0}}
+    socket = connection.sock
+    _, donator = request(connection, "GET", "/donators/most-generous")
+    assert donator == {"donator_id": "User2", "total_eur": 20.0}
+    _, highest = request(connection, "GET", "/charities/highest-24h?end=2023-01-20T23:00:00")
+    assert (highest["charity"], highest["total"]) == ("Charity2", 20.0)
+    assert highest["donations"][0]["timestamp"] == "2023-01-20T11:00:00"
+    # keep-alive: every request went over the first socket
+    assert connection.sock is socket
+
+def test_responses_are_cached_until_a_donation_changes_them(server, connection):
+    first, totals = request(connection, "GET", "/charities/totals")
+    again, _ = request(connection, "GET", "/charities/totals")
+    assert server.responses.info()["hits"] == 1
+    etag = first.getheader("ETag")
+    assert again.getheader("ETag") == etag
+    not_modified, body = request(connection, "GET", "/charities/totals", headers={"If-None-Match": etag})
+    assert not_modified.status == 304 and body is None
+
+    response, added = request(connection, "POST", "/donations", [
+        {"donator": "User3", "amount": "€30", "charity": "Charity1", "timestamp": "2023-01-20T13:00:00+01:00"},
+        {"donator": "User3", "amount": "£10", "charity": "Charity3", "timestamp": "2023-01-20T12:30:00"},
+    ])
+    assert response.status == 200 and added == {"added": 2}
+    changed, totals = request(connection, "GET", "/charities/totals", headers={"If-None-Match": etag})
+    assert changed.status == 200 and changed.getheader("ETag") != etag
+    assert totals["total_per_charity"] == {"Charity1": 42.0, "Charity2": 20.0, "Charity3": 12.0}
+    _, donator = request(connection, "GET", "/donators/most-generous")
+    assert donator == {"donator_id": "User3", "total_eur": 42.0}
+    _, highest = request(connection, "GET", "/charities/highest-24h?end=2023-01-20T23:00:00")
+    assert highest["charity"] == "Charity1"
+    assert [d["timestamp"] for d in highest["donations"]] == ["2023-01-20T10:00:00", "2023-01-20T12:00:00"]
+
+def test_errors(server, connection):
+    assert request(connection, "GET", "/nope")[0].status == 404
+    response, error = request(connection, "GET", "/charities/highest-24h?end=yesterday")
+    assert response.status == 400 and "error" in error
+    # a batch with a bad donation is rejected as a whole
+    response, error = request(connection, "POST", "/donations", [
+        {"donator": "User3", "amount": "€30", "charity": "Charity1", "timestamp": "2023-01-20T13:00:00"},
+        {"donator": "User3", "amount": "¥30", "charity": "Charity1", "timestamp": "2023-01-20T13:00:00"},
+    ])
+    assert response.status == 400 and "Charity3" not in server.api.donation_service.charities
+    assert request(connection, "POST", "/donations", [{"donator": "User3"}])[0].status == 400
+    assert server.api.donation_service.total_donations == 32.0
+    # the connection survives the errors
+    assert request(connection, "GET", "/charities/totals")[0].status == 200
+
+def test_load_harness(server):
+    stats, errors = load(server.url, connections=2, seconds=0.3, post_share=0.2, batch_size=5)
+    assert not errors
+    assert stats["total"]["requests"] > 0 and stats["total"]["p99_ms"] >= stats["total"]["p50_ms"]
+    assert "POST /donations" in stats
@@ -0,0 +1,102 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from sharding import ShardedDonationService, shard_of
+from api import Api
+from benchmarks.generators import make_exchange_rates, make_donations
+
+START = datetime(2023, 1, 1)
+
+def make_exchange_rate_service():
+    service = ExchangeRateService()
+    service.add_exchange_rates(make_exchange_rates(START, 11))
+    return service
+
+@pytest.fixture(scope="module")
+def services():
+    """A sharded and a single service fed the same donations, in batches and one at a time"""
+    donations = make_donations(3000, START, 10, charities=40, donators=200)
+    single = DonationService(make_exchange_rate_service())
+    sharded = ShardedDonationService(make_exchange_rate_service(), shards=3)
+    for service in (single, sharded):
+        for i in range(0, 2500, 500):
+            service.add_donations(Donation.from_record(d.donator, d.charity, d.timestamp, d.currency, d.amount, None)
+                                  for d in donations[i:i + 500])
+            # totals are gathered between batches, so the later batches come back as partials
+            service.get_totals()
+        for donation in donations[2500:]:
+            service.add_donation(Donation.from_record(donation.donator, donation.charity, donation.timestamp,
+                                                      donation.currency, donation.amount, None))
+    yield single, sharded
+    sharded.close()
+
+def test_shard_of_is_stable():
+    assert shard_of("Cancer Research", 4) == shard_of("Cancer Research", 4) == 3
+    assert {shard_of(f"Charity{i}", 4) for i in range(100)} == {0, 1, 2, 3}
+
+def test_running_totals_match(services):
+    single, sharded = services
+    expected, totals = single.get_totals(), sharded.get_totals()
+    assert totals.total_donations == pytest.approx(expected.total_donations)
+    assert totals.charity_totals == pytest.approx(expected.charity_totals)
+    assert sharded.get_totals() is totals
+
+def test_donator_partials_merge(services):
+    single, sharded = services
+    expected, totals = single.get_totals().most_generous_donator, sharded.get_totals().most_generous_donator
+    assert (totals.donator_id, totals.donation_count) == (expected.donator_id, expected.donation_count)
+    assert totals.total_eur == pytest.approx(expected.total_eur)
+    assert [name for name, _ in sharded.get_top_donator_totals(10)] == [name for name, _ in single.get_top_donator_totals(10)]
+    assert [name for name, _ in sharded.get_top_charity_totals(5)] == [name for name, _ in single.get_top_charity_totals(5)]
+
+def test_window_maxima_merge(services):
+    single, sharded = services
+    for hours in range(0, 240, 17):
+        end = START + timedelta(hours=hours)
+        charity, total, donations = sharded.get_highest_charity_over_24_hours(end)
+        expected = single.get_highest_charity_over_24_hours(end)
+        assert charity == expected[0]
+        assert total == pytest.approx(expected[1])
+        assert [(d.donator, d.timestamp, d.amount_eur) for d in donations] == [(d.donator, d.timestamp, d.amount_eur) for d in expected[2]]
+    assert sharded.get_highest_charity_over_24_hours(START - timedelta(days=5)) == (None, 0, [])
+
+def test_api_over_shards(services):
+    single, sharded = services
+    api, expected = Api(sharded), Api(single)
+    assert api.get_most_generous_donator()["donator_id"] == expected.get_most_generous_donator()["donator_id"]
+    assert api.get_running_totals_for_all_charities()["total_donations"] == pytest.approx(expected.get_running_totals_for_all_charities()["total_donations"])
+    end = START + timedelta(days=5)
+    assert api.get_highest_grossing_charity_over_24_hours(end)["charity"] == expected.get_highest_grossing_charity_over_24_hours(end)["charity"]
+    ends = [START + timedelta(hours=hours) for hours in range(0, 240, 13)]
+    assert ([result["charity"] for result in api.get_highest_grossing_charities_over_24_hours(ends)]
+            == [result["charity"] for result in expected.get_highest_grossing_charities_over_24_hours(ends)])
+    totals, expected_totals = api.get_charity_totals_over_7_days(end), expected.get_charity_totals_over_7_days(end)
+    assert totals["total_per_charity"] == pytest.approx(expected_totals["total_per_charity"])
+    window, expected_window = api.get_top_donators_over_window(timedelta(days=1), 5), expected.get_top_donators_over_window(timedelta(days=1), 5)
+    assert window["end"] == expected_window["end"]
+    assert [d["donator_id"] for d in window["top_donators"]] == [d["donator_id"] for d in expected_window["top_donators"]]
+
+def test_ties_across_shards_go_to_the_oldest_donation():
+    names = [f"Charity{i}" for i in range(10)]
+    # the charity that sorts last gave first, in a shard of its own
+    later = next(name for name in reversed(names) if shard_of(name, 2) != shard_of(names[0], 2))
+    donations = [Donation("User1", "€10", later, START + timedelta(hours=1)), Donation("User2", "€10", names[0], START + timedelta(hours=2))]
+    single = DonationService(ExchangeRateService())
+    single.add_donations(list(donations))
+    with ShardedDonationService(ExchangeRateService(), shards=2) as sharded:
+        sharded.add_donations([Donation(d.donator, f"€{d.amount:g}", d.charity, d.timestamp) for d in donations])
+        end = START + timedelta(hours=3)
+        assert sharded.get_highest_charity_over_24_hours(end)[0] == single.get_highest_charity_over_24_hours(end)[0] == later
+        assert sharded.get_highest_charities_over_24_hours([end])[0][0] == later
+
+def test_failed_conversion_adds_nothing():
+    exchange_rate_service = ExchangeRateService()
+    with ShardedDonationService(exchange_rate_service, shards=2) as sharded:
+        sharded.add_donation(Donation("User1", "€10", "Charity1", START))
+        with pytest.raises(ValueError):
+            sharded.add_donations([Donation("User1", "€10", "Charity2", START), Donation("User1", "$10", "Charity3", START)])
+        totals = sharded.get_totals()
+        assert totals.charity_totals == {"Charity1": 10}
+        assert (totals.most_generous_donator.donator_id, totals.most_generous_donator.total_eur) == ("User1", 10)
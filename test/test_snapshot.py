@@ -0,0 +1,128 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from snapshot import Snapshot, save_snapshot
+from main import DataLoader
+
+RATES_CSV = """source,target,rate,fee,date
+GBP,EUR,1.18,0.3,21 Jan 2023
+USD,EUR,0.92,0.4,21 Jan 2023
+"""
+
+DONATIONS_CSV = """donator,amount,charity,timestamp
+User1,$10,Charity1,21 Jan 2023 10:00 GMT
+User2,£15,Charity2,21 Jan 2023 12:00 GMT
+User1,€5,Charity1,21 Jan 2023 13:00 GMT
+"""
+
+MORE_DONATIONS_CSV = """User3,$20,Charity1,22 Jan 2023 12:00 GMT
+User2,£10,Charity2,22 Jan 2023 14:00 GMT
+"""
+
+def load(rates_path, donations_path, offset=0, snapshot=None):
+    exchange_rate_service = ExchangeRateService()
+    service = DonationService(exchange_rate_service)
+    if snapshot is not None:
+        exchange_rate_service.restore_snapshot(snapshot)
+        service.restore_snapshot(snapshot)
+    DataLoader.stream_exchange_rates(rates_path, exchange_rate_service)
+    DataLoader.stream_donations(donations_path, service, offset=offset)
+    return service
+
+@pytest.fixture
+def csv_paths(tmp_path):
+    rates_path = tmp_path / "exchange_rates.csv"
+    rates_path.write_text(RATES_CSV)
+    donations_path = tmp_path / "donations.csv"
+    donations_path.write_text(DONATIONS_CSV)
+    return str(rates_path), str(donations_path)
+
+@pytest.fixture
+def snapshot_path(tmp_path, csv_paths):
+    """Path of a snapshot saved after loading the CSV files"""
+    path = str(tmp_path / "state.snap")
+    service = load(*csv_paths)
+    save_snapshot(path, service, {"donations": (csv_paths[1], len(DONATIONS_CSV.encode()))})
+    return path
+
+def assert_same_state(restored, expected):
+    assert restored.total_donations == pytest.approx(expected.total_donations)
+    assert {name: c.total_donations for name, c in restored.charities.items()} == \
+        pytest.approx({name: c.total_donations for name, c in expected.charities.items()})
+    assert [(d.donator_id, d.donation_count) for d in restored.get_top_donators(10)] == \
+        [(d.donator_id, d.donation_count) for d in expected.get_top_donators(10)]
+    assert [c.name for c in restored.get_top_charities(10)] == [c.name for c in expected.get_top_charities(10)]
+    assert restored.most_generous_donator.donator_id == expected.most_generous_donator.donator_id
+    start, end = datetime(2023, 1, 20), datetime(2023, 1, 23)
+    assert [str(d) for d in restored.get_donations_between(start, end)] == [str(d) for d in expected.get_donations_between(start, end)]
+    for end in (datetime(2023, 1, 21, 14), datetime(2023, 1, 22, 15)):
+        charity, total, latest = restored.get_highest_charity_over_24_hours(end)
+        expected_charity, expected_total, expected_latest = expected.get_highest_charity_over_24_hours(end)
+        assert (charity, total) == (expected_charity, pytest.approx(expected_total))
+        assert [str(d) for d in latest] == [str(d) for d in expected_latest]
+    assert restored.get_charity_totals_between(start, end) == pytest.approx(expected.get_charity_totals_between(start, end))
+    ends = [datetime(2023, 1, 21) + timedelta(hours=h) for h in range(48)]
+    assert [r[:2] for r in restored.get_highest_charities_over_24_hours(ends)] == \
+        [r[:2] for r in expected.get_highest_charities_over_24_hours(ends)]
+
+def test_restore_matches_a_full_load(csv_paths, snapshot_path):
+    snapshot = Snapshot(snapshot_path)
+    restored = DonationService(ExchangeRateService())
+    restored.exchange_rate_service.restore_snapshot(snapshot)
+    restored.restore_snapshot(snapshot)
+
+    assert len(snapshot.donations) == 3
+    assert restored.donations == []
+    assert_same_state(restored, load(*csv_paths))
+    # the rollups are read back from the snapshot rather than rebuilt from the donations
+    for granularity in ("minute", "hour", "day"):
+        assert restored.rollups.bucket_count(granularity) == load(*csv_paths).rollups.bucket_count(granularity)
+    # rates come back too, so new donations can be converted
+    assert restored.exchange_rate_service.convert_to_eur(10, "USD", datetime(2023, 1, 21)) == \
+        pytest.approx(load(*csv_paths).exchange_rate_service.convert_to_eur(10, "USD", datetime(2023, 1, 21)))
+    snapshot.close()
+
+def test_appended_rows_are_replayed_once(csv_paths, snapshot_path):
+    rates_path, donations_path = csv_paths
+    with open(donations_path, 'a') as f:
+        f.write(MORE_DONATIONS_CSV)
+    snapshot = Snapshot(snapshot_path)
+    offset = snapshot.source_offset("donations", donations_path)
+    assert offset == len(DONATIONS_CSV.encode())
+
+    restored = load(rates_path, donations_path, offset, snapshot)
+    assert len(restored.donations) == 2
+    expected = load(rates_path, donations_path)
+    assert_same_state(restored, expected)
+
+    # saving again merges the restored donations with the new ones
+    path = snapshot_path + ".2"
+    save_snapshot(path, restored)
+    again = Snapshot(path)
+    assert [str(d) for d in again.donations] == [str(d) for d in expected.get_donations_between(datetime.min, datetime.max)]
+    again.close()
+    snapshot.close()
+
+def test_rewritten_source_is_loaded_again(csv_paths, snapshot_path):
+    with open(csv_paths[1], 'w') as f:
+        f.write(DONATIONS_CSV.replace("User1,$10", "User9,$10"))
+    snapshot = Snapshot(snapshot_path)
+    assert snapshot.source_offset("donations", csv_paths[1]) == 0
+    assert snapshot.source_offset("unknown", csv_paths[1]) == 0
+    snapshot.close()
+
+def test_restore_needs_an_empty_service(snapshot_path):
+    snapshot = Snapshot(snapshot_path)
+    service = DonationService(ExchangeRateService())
+    service.add_donation(Donation("User1", "€5", "Charity1", datetime(2023, 1, 21)))
+    with pytest.raises(ValueError):
+        service.restore_snapshot(snapshot)
+    snapshot.close()
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a.snap"
+    path.write_bytes(b"\0" * 256)
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
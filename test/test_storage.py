@@ -0,0 +1,93 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Donation, ExchangeRate
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from storage import DonationStore, SqliteStore
+
+def make_donations():
+    timestamp_base = datetime(2023, 1, 21, 12, 0)
+    return [
+        Donation("User1", "$10", "Charity1", timestamp_base - timedelta(hours=2)),
+        Donation("User2", "£15", "Charity2", timestamp_base),
+        Donation("User1", "€5", "Charity1", timestamp_base + timedelta(hours=1)),
+        Donation("User3", "$20", "Charity1", timestamp_base + timedelta(days=1)),
+        Donation("User2", "£10", "Charity2", timestamp_base + timedelta(days=1, hours=2)),
+    ]
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Path of a SQLite database with rates and donations already stored"""
+    path = str(tmp_path / "donations.db")
+    store = SqliteStore(path)
+    exchange_rate_service = ExchangeRateService(store=store)
+    exchange_rate_service.add_exchange_rates([
+        ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)),
+        ExchangeRate("USD", "EUR", 0.92, 0.4, datetime(2023, 1, 21)),
+    ])
+    service = DonationService(exchange_rate_service, store=store)
+    donations = make_donations()
+    service.add_donation(donations[0])
+    service.add_donations(donations[1:])
+    store.close()
+    return path
+
+@pytest.fixture
+def in_memory_service():
+    """The same rates and donations without a store"""
+    exchange_rate_service = ExchangeRateService()
+    exchange_rate_service.add_exchange_rate(ExchangeRate("GBP", "EUR", 1.18, 0.3, datetime(2023, 1, 21)))
+    exchange_rate_service.add_exchange_rate(ExchangeRate("USD", "EUR", 0.92, 0.4, datetime(2023, 1, 21)))
+    service = DonationService(exchange_rate_service)
+    service.add_donations(make_donations())
+    return service
+
+def test_restart_restores_aggregates(db_path, in_memory_service):
+    """Test that a service opened on an existing database has the same totals without replaying donations"""
+    store = SqliteStore(db_path)
+    service = DonationService(ExchangeRateService(store=store), store=store)
+
+    assert store.get_donation_count() == 5
+    assert len(service.donations) == 0
+    assert service.total_donations == pytest.approx(in_memory_service.total_donations)
+    for name, charity in in_memory_service.charities.items():
+        assert service.charities[name].total_donations == pytest.approx(charity.total_donations)
+    assert service.most_generous_donator.donator_id == "User2"
+    assert service.exchange_rate_service.convert_to_eur(100, "GBP", datetime(2023, 1, 21)) == pytest.approx(117.646)
+
+def test_queries_are_pushed_down(db_path, in_memory_service):
+    """Test that window and leaderboard queries read the stored donations"""
+    store = SqliteStore(db_path)
+    service = DonationService(ExchangeRateService(store=store), store=store)
+
+    for end in [datetime(2023, 1, 21, 12), datetime(2023, 1, 22, 12), datetime(2023, 1, 25)]:
+        charity, total, donations = service.get_highest_charity_over_24_hours(end)
+        expected_charity, expected_total, expected_donations = in_memory_service.get_highest_charity_over_24_hours(end)
+        assert charity == expected_charity
+        assert total == pytest.approx(expected_total)
+        assert [(d.donator, d.timestamp, d.amount_eur) for d in donations] == \
+               [(d.donator, d.timestamp, d.amount_eur) for d in expected_donations]
+
+    assert [d.donator_id for d in service.get_top_donators(2)] == ["User2", "User3"]
+    assert [c.name for c in service.get_top_charities(2)] == ["Charity1", "Charity2"]
+
+def test_new_donations_after_restart(db_path):
+    """Test that donators restored on demand keep their lifetime totals"""
+    store = SqliteStore(db_path)
+    service = DonationService(ExchangeRateService(store=store), store=store)
+    user1_total = store.get_donator("User1").total_eur
+
+    service.add_donation(Donation("User1", "€20", "Charity3", datetime(2023, 1, 22, 13, 0)))
+    assert service.donators["User1"].total_eur == pytest.approx(user1_total + 20)
+    assert service.donators["User1"].donation_count == 3
+    assert store.get_donator("User1").total_eur == pytest.approx(user1_total + 20)
+    assert service.most_generous_donator.donator_id == "User1"
+    assert store.get_donation_count() == 6
+
+def test_incomplete_store_fails_at_construction():
+    class PartialStore(DonationStore):
+        def add_donations(self, donations):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialStore()
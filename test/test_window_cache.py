@@ -0,0 +1,101 @@
+import random
+import pytest
+from datetime import datetime, timedelta
+from models import Donation
+from exchange_rate_service import ExchangeRateService
+from donation_service import DonationService
+from window_cache import WindowResultCache
+
+BASE = datetime(2023, 1, 20)
+
+def make_donation(rng:random.Random, start:datetime = BASE, days:int = 5) -> Donation:
+    return Donation(f"User{rng.randrange(20)}", f"€{rng.randint(1, 100)}.{rng.randrange(100):02}", f"Charity{rng.randrange(6)}",
+                    start + timedelta(seconds=rng.randrange(days * 86400)))
+
+def brute_force(donations, end):
+    totals, per_charity = {}, {}
+    for donation in sorted(donations, key=lambda d: d.timestamp):
+        if end - timedelta(days=1) <= donation.timestamp <= end:
+            totals[donation.charity] = totals.get(donation.charity, 0) + donation.amount_eur
+            per_charity.setdefault(donation.charity, []).append(donation)
+    if not totals:
+        return (None, 0, [])
+    highest = max(totals, key=totals.get)
+    return (highest, totals[highest], per_charity[highest][-5:])
+
+def assert_same(result, expected):
+    assert result[0] == expected[0]
+    assert result[1] == pytest.approx(expected[1])
+    assert result[2] == expected[2]
+
+@pytest.fixture
+def service():
+    service = DonationService(ExchangeRateService())
+    rng = random.Random(3)
+    service.add_donations([make_donation(rng) for _ in range(2000)])
+    return service
+
+def test_repeated_end_is_a_hit(service):
+    end = BASE + timedelta(days=2, hours=5)
+    first = service.get_highest_charity_over_24_hours(end)
+    assert service.get_highest_charity_over_24_hours(end) == first
+    info = service.window_cache_info()
+    assert (info["misses"], info["hits"], info["slides"]) == (1, 1, 0)
+    assert info["hit_rate"] == 0.5
+    assert_same(first, brute_force(service.donations, end))
+
+def test_advancing_end_slides_the_window(service):
+    end = BASE + timedelta(days=1)
+    for _ in range(300):
+        assert_same(service.get_highest_charity_over_24_hours(end), brute_force(service.donations, end))
+        end += timedelta(minutes=7, seconds=13)
+    info = service.window_cache_info()
+    assert info["misses"] == 1
+    assert info["slides"] == 299
+    # the slid entry replaces the one it came from
+    assert info["size"] == 1
+
+def test_only_donations_inside_a_window_invalidate_it(service):
+    end = BASE + timedelta(days=2)
+    service.get_highest_charity_over_24_hours(end)
+    # after the window and before it
+    service.add_donation(Donation("Late", "€5", "Charity1", end + timedelta(seconds=1)))
+    service.add_donations([Donation("Early", "€5", "Charity1", end - timedelta(days=1, seconds=1))])
+    assert service.window_cache_info()["invalidations"] == 0
+    service.get_highest_charity_over_24_hours(end)
+    assert service.window_cache_info()["hits"] == 1
+
+    inside = Donation("Big", "€100000", "Charity5", end - timedelta(hours=1))
+    service.add_donation(inside)
+    assert service.window_cache_info()["invalidations"] == 1
+    charity, total, donations = service.get_highest_charity_over_24_hours(end)
+    assert charity == "Charity5" and inside in donations
+    assert_same((charity, total, donations), brute_force(service.donations, end))
+
+def test_interleaved_adds_and_queries_match_a_recompute():
+    """Test that in order and out of order adds between sliding queries never leave a stale result"""
+    rng = random.Random(11)
+    service = DonationService(ExchangeRateService())
+    end = BASE + timedelta(hours=6)
+    for step in range(400):
+        if rng.random() < 0.3:
+            # mostly around the current window, sometimes far in the past
+            start = end - timedelta(days=rng.choice([1, 1, 1, 10]))
+            service.add_donations([make_donation(rng, start, 2) for _ in range(rng.randint(1, 20))])
+        end += timedelta(seconds=rng.choice([0, 0, 30, 600, 3600, 2 * 86400]))
+        assert_same(service.get_highest_charity_over_24_hours(end), brute_force(service.donations, end))
+
+def test_eviction_and_refresh():
+    cache = WindowResultCache(maxsize=2, refresh_after=2)
+    donations = [Donation("User", "€1", f"Charity{i % 3}", BASE + timedelta(hours=i)) for i in range(100)]
+    def donations_between(start, end):
+        return [d for d in donations if start <= d.timestamp <= end]
+    for days in (3, 6, 9):
+        cache.get(BASE + timedelta(days=days), donations_between)
+    info = cache.info()
+    assert (info["misses"], info["evictions"], info["size"]) == (3, 1, 2)
+    end = BASE + timedelta(days=2)
+    cache.get(end, donations_between)
+    for hours in range(1, 5):
+        assert_same(cache.get(end + timedelta(hours=hours), donations_between), brute_force(donations, end + timedelta(hours=hours)))
+    assert cache.info()["slides"] == 4
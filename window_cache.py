@@ -0,0 +1,176 @@
+from models import Donation
+from analytics import MICROSECOND
+from metrics import REGISTRY
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+import bisect
+import threading
+
+class WindowState:
+    """Totals and donations per charity of one window start <= timestamp <= end, in timestamp order"""
+    __slots__ = ("start", "end", "totals", "donations", "slides", "stale")
+
+    def __init__(self, start:datetime, end:datetime):
+        self.start = start
+        self.end = end
+        self.totals : Dict[str, float] = {}
+        self.donations : Dict[str, Deque[Donation]] = {}
+        # slides since the totals were last summed from scratch
+        self.slides = 0
+        # set when a donation was added inside the window while a reader had the state checked out
+        self.stale = False
+
+    def fill(self, donations_between:Callable[[datetime, datetime], List[Donation]]):
+        self.totals.clear()
+        self.donations.clear()
+        self.slides = 0
+        self._append(donations_between(self.start, self.end))
+
+    def slide(self, start:datetime, end:datetime, donations_between:Callable[[datetime, datetime], List[Donation]]):
+        """Move the window forward, dropping the donations before start and adding those after the old end"""
+        for charity in list(self.donations):
+            donations = self.donations[charity]
+            while donations and donations[0].timestamp < start:
+                self.totals[charity] -= donations.popleft().amount_eur
+            if not donations:
+                del self.donations[charity]
+                del self.totals[charity]
+        added = donations_between(self.end + MICROSECOND, end)
+        self.start, self.end = start, end
+        self.slides += 1
+        self._append(added)
+
+    def result(self, latest:int) -> Tuple[Optional[str], float, List[Donation]]:
+        if not self.totals:
+            return (None, 0, [])
+        # ties go to the charity with the earliest donation in the window, as with a recompute
+        highest = min(self.totals, key=lambda charity: (-self.totals[charity], self.donations[charity][0].timestamp))
+        donations = self.donations[highest]
+        return (highest, self.totals[highest], [donations[i] for i in range(max(0, len(donations) - latest), len(donations))])
+
+    def _append(self, donations:Iterable[Donation]):
+        for donation in donations:
+            charity = donation.charity
+            self.totals[charity] = self.totals.get(charity, 0) + donation.amount_eur
+            queue = self.donations.get(charity)
+            if queue is None:
+                queue = self.donations[charity] = deque()
+            queue.append(donation)
+
+class WindowResultCache:
+    """
+    Results of the highest grossing charity over a fixed length window, keyed by the window end.
+    A cached window is only invalidated by a donation whose timestamp falls inside it. A query
+    for a slightly later end slides the closest earlier cached window: donations that left the
+    window are subtracted and the ones that entered it are added, instead of recomputing.
+    After refresh_after slides the totals are summed again from scratch, so float rounding
+    doesn't accumulate. Thread safe: states are checked out while they are computed, and a
+    state invalidated meanwhile is not cached again.
+    """
+    def __init__(self, window:timedelta = timedelta(days=1), maxsize:int = 64, latest:int = 5, refresh_after:int = 1000):
+        self.window = window
+        self.maxsize = maxsize
+        self.latest = latest
+        self.refresh_after = refresh_after
+        self.hits = 0
+        self.slides = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries : OrderedDict = OrderedDict() # OrderedDict[end, WindowState]
+        # states checked out by readers, with the (first, last) timestamps they may cover
+        self._borrowed : Dict[int, Tuple[WindowState, datetime, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, end:datetime, donations_between:Callable[[datetime, datetime], List[Donation]]) -> Tuple[Optional[str], float, List[Donation]]:
+        """
+        The highest grossing charity over [end - window, end], its total and its latest donations.
+        donations_between(start, end) returns the donations with start <= timestamp <= end, in timestamp order.
+        """
+        start = end - self.window
+        # latency per lookup case, when metrics are enabled
+        timer = REGISTRY.stages("window_cache.get")
+        with self._lock:
+            state = self._entries.get(end)
+            if state is not None:
+                self.hits += 1
+                self._entries.move_to_end(end)
+                result = state.result(self.latest)
+                if timer:
+                    timer.lap("hit")
+                return result
+            # the closest earlier end whose window still overlaps this one
+            earlier = [cached for cached in self._entries if end - self.window < cached < end]
+            if earlier:
+                state = self._entries.pop(max(earlier))
+                self.slides += 1
+            else:
+                state = WindowState(start, end)
+                self.misses += 1
+            self._borrowed[id(state)] = (state, state.start, end)
+
+        if state.end == end:
+            case = "miss"
+            state.fill(donations_between)
+        elif state.slides >= self.refresh_after:
+            case = "refresh"
+            state.start, state.end = start, end
+            state.fill(donations_between)
+        else:
+            case = "slide"
+            state.slide(start, end, donations_between)
+        result = state.result(self.latest)
+
+        with self._lock:
+            del self._borrowed[id(state)]
+            if not state.stale and end not in self._entries and self.maxsize > 0:
+                if len(self._entries) >= self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+                self._entries[end] = state
+        if timer:
+            timer.lap(case)
+        return result
+
+    def invalidate(self, donations:Iterable[Donation]):
+        """Drop the cached windows that any of the donations falls inside"""
+        if not self._entries and not self._borrowed:
+            return
+        timestamps = sorted(donation.timestamp for donation in donations)
+        with self._lock:
+            for end in [end for end, state in self._entries.items() if self._covers(timestamps, state.start, end)]:
+                del self._entries[end]
+                self.invalidations += 1
+            for state, first, last in self._borrowed.values():
+                if not state.stale and self._covers(timestamps, first, last):
+                    state.stale = True
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for state, _, _ in self._borrowed.values():
+                state.stale = True
+
+    def info(self) -> Dict:
+        """Cache statistics. Slides are counted as hits in the hit rate, since they avoid a recompute"""
+        lookups = self.hits + self.slides + self.misses
+        return {
+            "hits": self.hits,
+            "slides": self.slides,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.slides) / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _covers(timestamps:List[datetime], start:datetime, end:datetime) -> bool:
+        position = bisect.bisect_left(timestamps, start)
+        return position < len(timestamps) and timestamps[position] <= end